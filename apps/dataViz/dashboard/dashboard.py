@@ -7,15 +7,32 @@ import PyQt5.QtCore as qtc
 import pyqtgraph as pg
 import serial
 import numpy as np
-import json
 import sys
+import os
 import time
+import argparse
+import atexit
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../common'))
+from ingest import FrameReader, ReaderThread
+from lod import MinMaxPyramid
+from report import ReportDecoder
+from rollstats import RollingStats
+from store import FrameStore, StoreWriter
 
-if len(sys.argv) <= 1:
-    FILENAME_SERIAL = '/dev/ttyACM0'
-else:
-    FILENAME_SERIAL = sys.argv[1]
+
+parser = argparse.ArgumentParser(description='Quadrant data visualizer')
+parser.add_argument('device', nargs='?', default='/dev/ttyACM0')
+parser.add_argument('--history', type=int, default=512, help='number of samples to plot')
+parser.add_argument('--rate', type=float, default=100.,
+                        help='nominal report rate in Hz, used to size the 10 s and 60 s stats windows')
+parser.add_argument('--store', metavar='DIR', help='also keep every frame in a store (see common/store.py)')
+parser.add_argument('--open', metavar='DIR', help='browse a stored session instead of reading a board')
+args = parser.parse_args()
+
+FILENAME_SERIAL = args.open or args.device
+HISTORY = args.history
+STATS_WINDOWS = (('50 samples', 50), ('10 s', int(10 * args.rate)), ('60 s', int(60 * args.rate)))
 
 
 class MainWindow(qtw.QMainWindow):
@@ -46,8 +63,9 @@ class CBLabel(qtw.QLabel):
 
 class GraphingWidget(qtw.QFrame):
 
-    def __init__(self):
+    def __init__(self, history):
         super().__init__()
+        self.history = history
         self.setFrameStyle(qtw.QFrame.Box | qtw.QFrame.Plain)
         self.setLineWidth(2)
 
@@ -60,6 +78,12 @@ class GraphingWidget(qtw.QFrame):
         self.plots.append(self.pgwidget.addPlot(row=2, col=0))
         self.plots.append(self.pgwidget.addPlot(row=3, col=0))
 
+        # created once and only ever setData'd, with a min/max decimation of
+        # the visible range (lod.py) sized to the plot's width in pixels
+        self.curves = [plot.plot() for plot in self.plots]
+        self.pyramid = None
+        for plot in self.plots:
+            plot.getViewBox().sigXRangeChanged.connect(self.redraw)
 
         self.labels= []
         for i in range(4):
@@ -101,18 +125,31 @@ class GraphingWidget(qtw.QFrame):
 
     def reset_zoom(self):
         for plot in self.plots:
-            plot.setXRange(0, 512)
+            plot.setXRange(0, self.history)
             plot.setYRange(0, 400)
 
-    def update_data(self, data):
-        #data is of type np.zeros((4,512), dtype=np.float32)
+    def update_data(self, pyramid, stats, stats_name):
+        #pyramid is a MinMaxPyramid(4, history)
+        #stats is a RollingStats over the same 4 channels
+        self.pyramid = pyramid
+        self.redraw()
+        mean, std, lo, hi = stats.mean(), stats.std(), stats.min(), stats.max()
+        latest = pyramid.raw.latest()
         for i in range(4):
-            self.plots[i].clear()
-            self.plots[i].plot(data[i,:])
-            cur = data[i,-1]
-            mean = np.mean(data[i,-50:])
-            std = np.std(data[i,-50:])
-            self.labels[i].setText(f"<b>Channel {i} = {cur:.1f}</b> (mean={mean:.1f}, std={std:.1f})")
+            cur = latest[i]
+            self.labels[i].setText(f"<b>Channel {i} = {cur:.1f}</b> (mean={mean[i]:.1f}, "
+                                    f"std={std[i]:.1f}, min={lo[i]:.0f}, max={hi[i]:.0f} "
+                                    f"over {stats_name})")
+
+    def redraw(self, *args):
+        # also on every pan/zoom, so only what's visible is ever drawn
+        if self.pyramid is None:
+            return
+        for i, plot in enumerate(self.plots):
+            vb = plot.getViewBox()
+            x0, x1 = vb.viewRange()[0]
+            x, y = self.pyramid.segment(x0, x1, int(vb.width()))
+            self.curves[i].setData(x, y[i])
 
     def eventFilter(self, target, e):
         if (target is self.pgwidget):
@@ -184,9 +221,7 @@ class ElevationWidget(qtw.QFrame):
         self.layout.addWidget(self.gauge)
         self.setLayout(self.layout)
 
-    def update_report(self, report_dict):
-        value = report_dict['val']
-        engaged = report_dict['en']
+    def update_report(self, value, engaged):
         if engaged:
             self.label.setText('Elevation:\n%1.3f' % value)
             self.gauge.set_value(value)
@@ -208,9 +243,7 @@ class PitchWidget(qtw.QFrame):
         self.layout.addWidget(self.gauge)
         self.setLayout(self.layout)
 
-    def update_report(self, report_dict):
-        value = report_dict['val']
-        engaged = report_dict['en']
+    def update_report(self, value, engaged):
         if engaged:
             self.label.setText('Pitch:\n%1.3f' % value)
             self.gauge.set_value(value)
@@ -232,9 +265,7 @@ class RollWidget(qtw.QFrame):
         self.layout.addWidget(self.gauge)
         self.setLayout(self.layout)
 
-    def update_report(self, report_dict):
-        value = report_dict['val']
-        engaged = report_dict['en']
+    def update_report(self, value, engaged):
         if engaged:
             self.label.setText('Roll:\n%1.3f' % value)
             self.gauge.set_value(value)
@@ -256,9 +287,7 @@ class ArcWidget(qtw.QFrame):
         self.layout.addWidget(self.gauge)
         self.setLayout(self.layout)
 
-    def update_report(self, report_dict):
-        value = report_dict['val']
-        engaged = report_dict['en']
+    def update_report(self, value, engaged):
         if engaged:
             self.label.setText('Arc:\n%1.3f' % value)
             self.gauge.set_value(value)
@@ -277,14 +306,46 @@ class SampleRateWidget(qtw.QFrame):
         self.layout = qtw.QVBoxLayout()
         self.layout.addWidget(self.label)
         self.setLayout(self.layout)
-        self.tlast = 0
-        self.tnow = 0
+        self.tlast = None
+
+    def update_report(self, timestamps_us, overflows=0):
+        # all the timestamps received since the last update
+        if self.tlast is not None and timestamps_us[-1] > self.tlast:
+            self.set_rate(1e6 * len(timestamps_us) / (timestamps_us[-1] - self.tlast), overflows)
+        self.tlast = timestamps_us[-1]
+
+    def set_rate(self, rate, overflows=0):
+        text = 'Sample Rate:\n%.1f Hz' % rate
+        if overflows:
+            text += '\n(%d dropped)' % overflows
+        self.label.setText(text)
+
+
+class ScrubWidget(qtw.QWidget):
+
+    # position slider and time readout for browsing a stored session
+
+    def __init__(self, store, on_move):
+        super().__init__()
+        self.store = store
+        self.slider = qtw.QSlider(qtc.Qt.Horizontal)
+        self.slider.setRange(0, max(len(store) - 1, 0))
+        self.slider.valueChanged.connect(on_move)
+        self.label = qtw.QLabel()
+        self.layout = qtw.QHBoxLayout()
+        self.layout.addWidget(self.slider)
+        self.layout.addWidget(self.label)
+        self.setLayout(self.layout)
 
-    def update_report(self, timestamp_us):
-        self.tlast = self.tnow
-        self.tnow = timestamp_us
-        if all(t is not None for t in [self.tlast, self.tnow]):
-            self.label.setText('Sample Rate:\n%.1f Hz' % (1e6/(self.tnow - self.tlast)))
+    def set_time(self, index):
+        t = (self.store.t[index] - self.store.t[0]) * 1e-6
+        self.label.setText('%s / %s' % (self.format(t), self.format(self.store.duration())))
+
+    @staticmethod
+    def format(seconds):
+        m, s = divmod(seconds, 60)
+        h, m = divmod(int(m), 60)
+        return '%d:%02d:%06.3f' % (h, m, s) if h else '%d:%06.3f' % (m, s)
 
 
 class MainWidget(qtw.QWidget):
@@ -295,7 +356,7 @@ class MainWidget(qtw.QWidget):
         self.l1 = qtw.QLabel('Streams')
         self.l1.setAlignment(qtc.Qt.AlignCenter)
 
-        self.graphing_widget = GraphingWidget()
+        self.graphing_widget = GraphingWidget(HISTORY)
         self.elevation_widget = ElevationWidget()
         self.pitch_widget = PitchWidget()
         self.roll_widget = RollWidget()
@@ -316,7 +377,16 @@ class MainWidget(qtw.QWidget):
         self.layout.addWidget(self.graphing_widget)
         self.layout.addLayout(self.rhs)
 
-        self.setLayout(self.layout)
+        # browsing a stored session: no board, a scrub bar under the plots
+        self.store = FrameStore(args.open) if args.open else None
+        if self.store is not None:
+            self.scrub_widget = ScrubWidget(self.store, self.show_at)
+            self.outer = qtw.QVBoxLayout()
+            self.outer.addLayout(self.layout)
+            self.outer.addWidget(self.scrub_widget)
+            self.setLayout(self.outer)
+        else:
+            self.setLayout(self.layout)
 
 
         self.running = False
@@ -324,60 +394,96 @@ class MainWidget(qtw.QWidget):
         self.refresh_timer = qtc.QTimer()
         self.refresh_timer.timeout.connect(self.refresh)
 
-        self.quadrant = serial.Serial(FILENAME_SERIAL, 115200, timeout=0.025)
-        self.databuf = np.zeros((4,512), dtype=np.float32)
-        self.datanew = np.zeros(4, dtype=np.float32).reshape(4,1)
+        self.databuf = MinMaxPyramid(4, HISTORY)
+        self.stats = [RollingStats(4, n) for name, n in STATS_WINDOWS]
+        self.stats_index = 0
+        self.reader_thread = None
+        self.store_writer = None
+        if self.store is not None:
+            if len(self.store):
+                self.scrub_widget.slider.setValue(len(self.store) - 1)
+                self.show_at(len(self.store) - 1)
+            return
 
-        self.tnow = 0
-        self.tlast = 0
+        self.quadrant = serial.Serial(FILENAME_SERIAL, 115200, timeout=0.025)
+        self.decoder = ReportDecoder(on_error=lambda line: print('failed to parse'))
+        self.reader = FrameReader(self.quadrant, parse_batch=self.decoder.decode_batch)
+        if args.store:
+            self.store_writer = StoreWriter(args.store)
+            atexit.register(self.store_writer.close)
 
     def start_stop(self):
+        if self.store is not None:
+            return
         if self.running:
             self.refresh_timer.stop()
+            self.reader_thread.stop()
             self.running = False
             self.start_stop_button.setText('Start')
         else:
+            self.quadrant.reset_input_buffer()
+            self.reader_thread = ReaderThread(self.reader)
+            self.reader_thread.start()
             self.refresh_timer.start(15)
             self.running = True
             self.start_stop_button.setText('Stop')
 
     def refresh(self):
-        while self.quadrant.in_waiting:
-            report_raw = self.quadrant.readline();
-            try:
-                report = json.loads(report_raw)
-            except json.decoder.JSONDecodeError:
-                print('failed to parse')
-                continue
-            # throttle
-            self.tnow = report['ts']
-            self.sample_rate_widget.update_report(self.tnow)
-            if self.tnow - self.tlast > 30000:
-                # graphing distance
-                for i,s in enumerate(['l0', 'l1', 'l2', 'l3']):
-                    try:
-                        self.datanew[i,0] = report[s]['dist']
-                    except KeyError:
-                        print('keyerror: dist')
-                        self.datanew[i,0] = 8190
-                self.databuf = np.concatenate((self.databuf[:,1:], self.datanew), axis=1)
-                self.graphing_widget.update_data(self.databuf)
-                # parameter widgets
-                for s,w in zip(('elevation', 'pitch', 'roll', 'arc'),
-                                (self.elevation_widget, self.pitch_widget, self.roll_widget,
-                                    self.arc_widget)):
-                    try:
-                        w.update_report(report[s])
-                    except KeyError:
-                        print('keyerror: report')
-                        pass
-                self.tlast = self.tnow
+        frames = self.reader_thread.drain()
+        if not len(frames):
+            return
+        if self.store_writer is not None:
+            self.store_writer.append(frames)
+        # one ring buffer write and one redraw per refresh, using every sample
+        block = frames['dist'].T.astype(np.float32)
+        self.databuf.extend(block)
+        for stats in self.stats:
+            stats.extend(block)
+        self.graphing_widget.update_data(self.databuf, self.stats[self.stats_index],
+                                            STATS_WINDOWS[self.stats_index][0])
+        self.sample_rate_widget.update_report(frames['ts'],
+                                                self.reader_thread.overflows)
+        # parameter widgets
+        val, val_en = frames['val'][-1].tolist(), frames['val_en'][-1].tolist()
+        for i,w in enumerate((self.elevation_widget, self.pitch_widget, self.roll_widget,
+                                self.arc_widget)):
+            w.update_report(val[i], val_en[i])
+
+    def show_at(self, index):
+        # plot the HISTORY frames up to and including frame `index` of the
+        # stored session, with the stats over the current stats window
+        name, nstats = STATS_WINDOWS[self.stats_index]
+        stop = index + 1
+        start = max(stop - max(HISTORY, nstats), 0)
+        dist = self.store.dist(start, stop).astype(np.float32)
+        data = MinMaxPyramid(4, HISTORY)
+        data.extend(dist[:,-HISTORY:])
+        stats = RollingStats(4, nstats)
+        stats.extend(dist[:,-nstats:])
+        self.graphing_widget.update_data(data, stats, name)
+        t = self.store.t[max(stop - nstats, 0):stop]
+        if len(t) > 1 and t[-1] > t[0]:
+            self.sample_rate_widget.set_rate(1e6 * (len(t) - 1) / (t[-1] - t[0]))
+        frame = self.store.frames(index, stop)[0]
+        val, val_en = frame['val'].tolist(), frame['val_en'].tolist()
+        for i,w in enumerate((self.elevation_widget, self.pitch_widget, self.roll_widget,
+                                self.arc_widget)):
+            w.update_report(val[i], val_en[i])
+        self.scrub_widget.set_time(index)
 
     def keyPressEvent(self, e):
         if e.key() == qtc.Qt.Key_Space:
             self.start_stop()
         elif e.key() == qtc.Qt.Key_Escape:
             self.graphing_widget.toggle_axes_linked()
+        elif e.key() == qtc.Qt.Key_W:
+            self.stats_index = (self.stats_index + 1) % len(self.stats)
+            if self.store is not None and len(self.store):
+                self.show_at(self.scrub_widget.slider.value())
+        elif self.store is not None and e.key() in (qtc.Qt.Key_Left, qtc.Qt.Key_Right):
+            step = HISTORY // 8 if e.key() == qtc.Qt.Key_Right else -(HISTORY // 8)
+            slider = self.scrub_widget.slider
+            slider.setValue(min(max(slider.value() + step, 0), slider.maximum()))
 
 
 if __name__ == '__main__':
@@ -7,13 +7,24 @@ import PyQt5.QtCore as qtc
 import pyqtgraph as pg
 import serial
 import numpy as np
-import json
 import sys
+import os
+import argparse
 
-if len(sys.argv) <= 1:
-    FILENAME_SERIAL = '/dev/ttyACM0'
-else:
-    FILENAME_SERIAL = sys.argv[1]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../common'))
+from ingest import FrameReader, ReaderThread
+from ringbuf import RingBuffer
+from rollstats import RollingStats
+from report import ReportDecoder
+from jitter import JitterAnalyzer
+
+parser = argparse.ArgumentParser(description='Quadrant report timing scope')
+parser.add_argument('device', nargs='?', default='/dev/ttyACM0')
+parser.add_argument('--analysis', action='store_true',
+                        help='start with the interval histogram and skew analysis shown (toggle with A)')
+args = parser.parse_args()
+
+FILENAME_SERIAL = args.device
 
 
 class MainWindow(qtw.QMainWindow):
@@ -44,6 +55,7 @@ class GraphingWidget(qtw.QFrame):
 
         self.plots = []
         self.plots.append(self.pgwidget.addPlot(row=0, col=0))
+        self.curves = [plot.plot() for plot in self.plots]
 
         self.labels= []
         for i in range(1):
@@ -65,15 +77,18 @@ class GraphingWidget(qtw.QFrame):
             plot.setXRange(0, 512)
             plot.setYRange(0, 100)
 
-    def update_data(self, data):
+    def update_data(self, data, stats, overflows=0):
         #data is of type np.zeros(512, dtype=np.float32)
+        #stats is a single-channel RollingStats
+        mean, std, lo, hi = stats.mean(), stats.std(), stats.min(), stats.max()
         for i in range(1):
-            self.plots[i].clear()
-            self.plots[i].plot(data)
+            self.curves[i].setData(data)
             cur = data[-1]
-            mean = np.mean(data[-50:])
-            std = np.std(data[-50:])
-            self.labels[i].setText(f"<b>Sample Rate = {cur:.1f}</b> (mean={mean:.1f}, std={std:.1f})")
+            text = (f"<b>Sample Rate = {cur:.1f}</b> (mean={mean[i]:.1f}, std={std[i]:.1f}, "
+                    f"min={lo[i]:.1f}, max={hi[i]:.1f})")
+            if overflows:
+                text += f" [{overflows} dropped]"
+            self.labels[i].setText(text)
 
     def eventFilter(self, target, e):
         if (target is self.pgwidget):
@@ -84,14 +99,60 @@ class GraphingWidget(qtw.QFrame):
         return False
 
 
+class AnalysisWidget(qtw.QFrame):
+
+    def __init__(self):
+        super().__init__()
+        self.setFrameStyle(qtw.QFrame.Box | qtw.QFrame.Plain)
+        self.setLineWidth(2)
+
+        self.pgwidget = pg.GraphicsLayoutWidget()
+
+        self.hist_plot = self.pgwidget.addPlot(row=0, col=0)
+        self.hist_plot.setLogMode(x=True, y=False)
+        self.hist_plot.setLabel('bottom', 'report interval (device ts)', units='ms')
+        self.hist_curve = self.hist_plot.plot(stepMode='center', fillLevel=0, brush=(100,100,255,120))
+
+        self.skew_plot = self.pgwidget.addPlot(row=1, col=0)
+        self.skew_plot.setLabel('left', 'host - device', units='ms')
+        self.skew_curve = self.skew_plot.plot()
+        self.skew_buf = RingBuffer(1, 4096, dtype=np.float64, fill=np.nan)
+
+        self.label = qtw.QLabel('')
+        self.label.setFont(qtg.QFontDatabase.systemFont(qtg.QFontDatabase.FixedFont))
+
+        self.layout = qtw.QVBoxLayout()
+        self.layout.addWidget(self.pgwidget)
+        self.layout.addWidget(self.label)
+        self.setLayout(self.layout)
+
+    def update_data(self, analyzer, skew):
+        self.skew_buf.extend(skew.reshape(1,-1) / 1000)
+        self.skew_curve.setData(self.skew_buf.view()[0], connect='finite')
+        edges, counts = analyzer.device.histogram()
+        self.hist_curve.setData(edges / 1000, counts)
+        lines = ['%d reports' % analyzer.nreports,
+                    '%-28s %9s %9s %9s' % ('', 'p50', 'p99', 'p99.9')]
+        summary = analyzer.summary()
+        for name, desc in (('device', 'interval, device ts (ms)'),
+                            ('host', 'interval, host arrival (ms)'),
+                            ('delay', 'transport delay (ms)')):
+            q = summary[name]
+            lines.append('%-28s %9.3f %9.3f %9.3f' % (desc, q[0]/1000, q[1]/1000, q[2]/1000))
+        self.label.setText('\n'.join(lines))
+
+
 class MainWidget(qtw.QWidget):
 
     def __init__(self):
         qtw.QWidget.__init__(self)
 
         self.graphing_widget = GraphingWidget()
+        self.analysis_widget = AnalysisWidget()
+        self.analysis_widget.setVisible(args.analysis)
         self.layout = qtw.QHBoxLayout()
         self.layout.addWidget(self.graphing_widget)
+        self.layout.addWidget(self.analysis_widget)
         self.setLayout(self.layout)
 
         self.running = False
@@ -100,43 +161,50 @@ class MainWidget(qtw.QWidget):
         self.refresh_timer.timeout.connect(self.refresh)
 
         self.quadrant = serial.Serial(FILENAME_SERIAL, 115200, timeout=0.025)
-        self.databuf = np.zeros(512, dtype=np.float32)
-
-        self.tlast = None
-        self.tnow = None
+        self.decoder = ReportDecoder(on_error=lambda line: print('dropped some data'))
+        self.reader = FrameReader(self.quadrant, parse_batch=self.decoder.decode_batch)
+        self.reader_thread = None
+        self.databuf = RingBuffer(1, 512)
+        self.stats = RollingStats(1, 50)
+        self.analyzer = JitterAnalyzer()
 
     def start_stop(self):
         if self.running:
             self.refresh_timer.stop()
+            self.reader_thread.stop()
             self.running = False
             #self.start_stop_button.setText('Start')
         else:
+            self.quadrant.reset_input_buffer()
+            self.analyzer = JitterAnalyzer()
+            self.reader_thread = ReaderThread(self.reader)
+            self.reader_thread.start()
             self.refresh_timer.start(15)
             self.running = True
             #self.start_stop_button.setText('Stop')
 
     def refresh(self):
-        while self.quadrant.in_waiting:
-            report_raw = self.quadrant.readline();
-            try:
-                report = json.loads(report_raw)
-                self.tlast = self.tnow
-                self.tnow = report['ts']
-                if all(t is not None for t in [self.tlast, self.tnow]):
-                    datanew = np.array([1e6/(self.tnow - self.tlast)], dtype=np.float32)
-                    self.databuf = np.concatenate((self.databuf[1:], datanew))
-                    self.graphing_widget.update_data(self.databuf)
-            except json.decoder.JSONDecodeError:
-                print('dropped some data')
-                continue
-            except KeyError:
-                continue
+        frames = self.reader_thread.drain()
+        if not len(frames):
+            return
+        dt, skew = self.analyzer.update(frames['ts'], frames['host'])
+        if self.analysis_widget.isVisible():
+            self.analysis_widget.update_data(self.analyzer, skew)
+        rate = (1e6 / dt[dt > 0]).astype(np.float32).reshape(1,-1)
+        if not rate.size:
+            return
+        self.databuf.extend(rate)
+        self.stats.extend(rate)
+        self.graphing_widget.update_data(self.databuf.view()[0], self.stats,
+                                            self.reader_thread.overflows)
 
     def keyPressEvent(self, e):
         if e.key() == qtc.Qt.Key_Space:
             self.start_stop()
         elif e.key() == qtc.Qt.Key_Escape:
             self.graphing_widget.toggle_axes_linked()
+        elif e.key() == qtc.Qt.Key_A:
+            self.analysis_widget.setVisible(not self.analysis_widget.isVisible())
 
 
 if __name__ == '__main__':
@@ -2,4 +2,4 @@
 
 pasuspender -- pd main.pd &
 sleep 2
-python3 -u ../../common/serial2stdout.py | pdsend 8000
+python3 ../../common/serial2stdout.py --out 8000
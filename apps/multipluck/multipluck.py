@@ -1,35 +1,55 @@
 #!/usr/bin/python3 -u
 
-import serial
-import struct
 import sys
+import os
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../common'))
+from report import ReportDecoder
+from fudi import open_sink, add_sink_argument
+from gesture import BandDetector, ENGAGE
+from pipeline import Pipeline, open_source, SOURCE_HELP
+from jitterbuf import JitterBuffer, add_latency_argument
+from synth import open_synth, render_session, add_synth_argument
 
 THRESH1 = 180
 THRESH2 = 70
 
-if len(sys.argv) > 1:
-    deviceFile = sys.argv[1]
+parser = argparse.ArgumentParser(description='send notes to Pd from two distance bands per channel')
+parser.add_argument('device', nargs='?', default='/dev/ttyACM0', help=SOURCE_HELP)
+add_sink_argument(parser)
+add_latency_argument(parser)
+add_synth_argument(parser)
+args = parser.parse_args()
+
+# the samples and volumes main.pd plays for each channel, for --out synth
+NOTES = ['c4', 'd4', 'e4', 'f4', 'g4', 'a4', 'b4', 'c5']
+
+
+def volume(value):
+    return (1 - value / 128) ** 2 / 8
+
+
+# channels 0-3: between the thresholds, reported relative to THRESH2;
+# channels 4-7: closer than THRESH2
+detector = BandDetector(4, [(THRESH2, THRESH1, THRESH2), (float('-inf'), THRESH2, 0)])
+
+
+def multipluck(ready):
+    out = []
+    for board, t, batch in ready:
+        events = detector.process(batch['dist'], batch['ts'])
+        events = events[events['kind'] == ENGAGE]
+        messages = ['%d %d;' % e for e in zip(events['chan'].tolist(), events['value'].tolist())]
+        out += jitter.stamp(board, t, batch['ts'], events['t'], messages) if jitter else messages
+    return out
+
+
+decoder = ReportDecoder(on_error=lambda line: print('wtf!'))
+sink = open_synth(args, NOTES, volume) or open_sink(args.out)
+jitter = JitterBuffer(sink, args.latency / 1000) if args.latency is not None else None
+if args.render:
+    render_session(args.device, decoder.decode_batch, multipluck, sink)
 else:
-    deviceFile = '/dev/ttyACM0'
-
-quadrant = serial.Serial(deviceFile, 115200)
-
-engaged = [False, False, False, False, False, False, False, False]
-
-while True:
-    data_raw = quadrant.readline();
-    data = tuple(map(int, data_raw.split()))
-    if len(data) == 4:
-        for i in range(4):
-            if (not engaged[i]) and (THRESH2 <= data[i] < THRESH1):
-                engaged[i] = True
-                print('%d %d;' % (i, data[i] - THRESH2))
-            if engaged[i] and (data[i] >= THRESH1) or (data[i] < THRESH2):
-                engaged[i] = False
-            if (not engaged[i+4]) and (data[i] < THRESH2):
-                engaged[i+4] = True
-                print('%d %d;' % (i+4, data[i]))
-            if engaged[i+4] and (data[i] >= THRESH2):
-                engaged[i+4] = False
-    else:
-        print('wtf!')
+    source = open_source(args.device, parse_batch=decoder.decode_batch)
+    Pipeline([source], [jitter or sink], detect=multipluck).run()
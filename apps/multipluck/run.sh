@@ -2,4 +2,4 @@
 
 pasuspender -- pd main.pd &
 sleep 2
-python3 -u ./multipluck.py | pdsend 8000
+python3 ./multipluck.py --out 8000
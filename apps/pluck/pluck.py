@@ -1,27 +1,50 @@
 #!/usr/bin/python3 -u
 
-import serial
-import struct
 import sys
+import os
+import argparse
 
-if len(sys.argv) > 1:
-    deviceFile = sys.argv[1]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../common'))
+from report import ReportDecoder
+from fudi import open_sink, add_sink_argument
+from gesture import ThresholdDetector, ENGAGE
+from pipeline import Pipeline, open_source, SOURCE_HELP
+from jitterbuf import JitterBuffer, add_latency_argument
+from synth import open_synth, render_session, add_synth_argument
+
+parser = argparse.ArgumentParser(description='send a note to Pd when a hand crosses into a channel')
+parser.add_argument('device', nargs='?', default='/dev/ttyACM0', help=SOURCE_HELP)
+add_sink_argument(parser)
+add_latency_argument(parser)
+add_synth_argument(parser)
+args = parser.parse_args()
+
+# the samples and volumes main.pd plays for each channel, for --out synth
+NOTES = ['c4', 'd4', 'e4', 'g4']
+
+
+def volume(value):
+    return (1 - value / 255) ** 2 / 4
+
+
+detector = ThresholdDetector(4, 180)
+
+
+def pluck(ready):
+    out = []
+    for board, t, batch in ready:
+        events = detector.process(batch['dist'], batch['ts'])
+        events = events[events['kind'] == ENGAGE]
+        messages = ['%d %d;' % e for e in zip(events['chan'].tolist(), events['value'].tolist())]
+        out += jitter.stamp(board, t, batch['ts'], events['t'], messages) if jitter else messages
+    return out
+
+
+decoder = ReportDecoder(on_error=lambda line: print('bad readout: ', line))
+sink = open_synth(args, NOTES, volume) or open_sink(args.out)
+jitter = JitterBuffer(sink, args.latency / 1000) if args.latency is not None else None
+if args.render:
+    render_session(args.device, decoder.decode_batch, pluck, sink)
 else:
-    deviceFile = '/dev/ttyACM0'
-
-quadrant = serial.Serial(deviceFile, 115200)
-
-engaged = [False, False, False, False]
-
-while True:
-    data_raw = quadrant.readline();
-    data = tuple(map(int, data_raw.split()))
-    if len(data) == 4:
-        for i in range(4):
-            if (not engaged[i]) and (data[i] < 180):
-                engaged[i] = True
-                print('%d %d;' % (i, data[i]))
-            if engaged[i] and (data[i] >= 180):
-                engaged[i] = False
-    else:
-        print('bad readout: ', data_raw)
+    source = open_source(args.device, parse_batch=decoder.decode_batch)
+    Pipeline([source], [jitter or sink], detect=pluck).run()
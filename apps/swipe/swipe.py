@@ -1,73 +1,69 @@
 #!/usr/bin/python3 -u
 
-import serial
-import struct
 import sys
-import rtmidi
+import os
+import argparse
 
-def program_change(midi_out, channel, program):
-    statusByte = (192 & 0xf0) | (channel - 1 & 0xf)
-    msg = [statusByte] + [program & 0x7f]
-    midi_out.send_message(msg)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../common'))
+from report import ReportDecoder
+from gesture import SwipeDetector, SWIPE_LEFT, SWIPE_RIGHT, FAKEOUT_LEFT, FAKEOUT_RIGHT
+from pipeline import Pipeline, open_source, SOURCE_HELP
+from midi import ControllerEngine, Controller, open_midi, add_midi_argument, DIN_BANDWIDTH
 
-if len(sys.argv) > 1:
-    deviceFile = sys.argv[1]
-else:
-    deviceFile = '/dev/ttyACM0'
+parser = argparse.ArgumentParser(description='change MIDI program with left/right swipes')
+parser.add_argument('device', nargs='?', default='/dev/ttyACM0', help=SOURCE_HELP)
+add_midi_argument(parser)
+parser.add_argument('--controllers', action='store_true',
+                        help='also send distances (CC 20-23), elevation (NRPN 0), pitch (bend), '
+                                'roll (CC 1) and arc (CC 2) continuously')
+parser.add_argument('--max-rate', type=float, default=100.,
+                        help='messages/s per controller, program changes included')
+parser.add_argument('--bandwidth', type=float, default=DIN_BANDWIDTH,
+                        help='bytes/s for all messages (default: a DIN link); 0 for no limit')
+args = parser.parse_args()
 
-quadrant = serial.Serial(deviceFile, 115200)
+detector = SwipeDetector(4, 180, [(1, 3)])
+currentProgram = 1
 
-engaged = [False, False, False, False]
-primeRight = False
-primeLeft = False
-primeUp = False
-primeDown = False
+# the program, set on swipes, goes through the engine too so it shares the
+# rate cap and bandwidth with the controllers
+PROGRAM = 0
+controllers = [Controller(None, 'program', 1, max_rate=args.max_rate)]
+if args.controllers:
+    # closer hands send higher values
+    controllers += ([Controller('l%d' % i, 'cc', 1, 20 + i, 400, 0, args.max_rate) for i in range(4)] +
+                    [Controller('elevation', 'nrpn', 1, 0, 0, 1, args.max_rate),
+                     Controller('pitch', 'bend', 1, 0, -1, 1, args.max_rate),
+                     Controller('roll', 'cc', 1, 1, -1, 1, args.max_rate),
+                     Controller('arc', 'cc', 1, 2, -1, 1, args.max_rate)])
+engine = ControllerEngine(controllers, args.bandwidth or None)
 
-midiOut = rtmidi.MidiOut()
-available_ports = midiOut.get_ports()
-if available_ports:
-    print('opening port 0')
-    midiOut.open_port(0)
-else:
-    print('opening virtual port')
-    midiOut.open_virtual_port("My virtual output")
 
-currentProgram = 1
+def swipe(ready):
+    global currentProgram
+    out = []
+    for board, t, batch in ready:
+        for kind in detector.process(batch['dist'])['kind'].tolist():
+            if kind == SWIPE_LEFT:
+                print('left swipe')
+                currentProgram -= 1
+                if currentProgram == 0:
+                    currentProgram = 16
+                engine.set(PROGRAM, currentProgram)
+            elif kind == SWIPE_RIGHT:
+                print('right swipe')
+                currentProgram += 1
+                if currentProgram == 17:
+                    currentProgram = 1
+                engine.set(PROGRAM, currentProgram)
+            elif kind == FAKEOUT_RIGHT:
+                print('right fakeout')
+            elif kind == FAKEOUT_LEFT:
+                print('left fakeout')
+        out += engine.process(batch, t)
+    return out
+
 
-while True:
-    data_raw = quadrant.readline();
-    data = tuple(map(int, data_raw.split()))
-    if len(data) == 4:
-        for i in range(4):
-            if (not engaged[i]) and (data[i] < 180):
-                engaged[i] = True
-                if i==1 and engaged[3]:
-                    primeRight = True
-                if i==3 and engaged[1]:
-                    primeLeft = True
-            if engaged[i] and (data[i] >= 180):
-                engaged[i] = False
-                if i==1 and engaged[3]:
-                    if primeLeft:
-                        print('left swipe')
-                        currentProgram -= 1
-                        if currentProgram == 0:
-                            currentProgram = 16
-                        program_change(midiOut, 1, currentProgram)
-                        primeLeft = False
-                    elif primeRight:
-                        print('right fakeout')
-                        primeRight = False
-                if i==3 and engaged[1]:
-                    if primeRight:
-                        print('right swipe')
-                        currentProgram += 1
-                        if currentProgram == 17:
-                            currentProgram = 1
-                        program_change(midiOut, 1, currentProgram)
-                        primeRight = False
-                    elif primeLeft:
-                        print('left fakeout')
-                        primeLeft = False
-    else:
-        print('wtf!')
+decoder = ReportDecoder(on_error=lambda line: print('wtf!'))
+source = open_source(args.device, parse_batch=decoder.decode_batch)
+Pipeline([source], [open_midi(args.midi)], detect=swipe).run()
@@ -1,61 +1,139 @@
 #!/usr/bin/python3 -u
 
-import serial
 import numpy as np
-import json
 import sys
-import itertools
-
-
-FILENAME_LEFT = '/dev/ttyACM0'
-FILENAME_RIGHT = '/dev/ttyACM1'
+import os
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../common'))
+from report import ReportDecoder, ELEVATION, PITCH, ROLL, event_names
+from fudi import open_sink, add_sink_argument
+from filters import AlphaBetaFilter
+from pipeline import Pipeline, open_source, SOURCE_HELP
+from mux import TimelineAligner
+
+
+parser = argparse.ArgumentParser(description='two-board triangulation: hits, swipes and continuous controls to Pd')
+parser.add_argument('left', nargs='?', default='/dev/ttyACM0', help=SOURCE_HELP)
+parser.add_argument('right', nargs='?', default='/dev/ttyACM1', help=SOURCE_HELP)
+add_sink_argument(parser)
+parser.add_argument('--align', choices=('order', 'clock'), default='order',
+                        help='use each board\'s latest report as it arrives, or interpolate both '
+                                'onto a common timeline using the boards\' clocks (JSON or binary '
+                                'reports); events go out on the timeline too')
+parser.add_argument('--rate', type=float, default=100., help='timeline rate with --align clock, Hz')
+parser.add_argument('--hit-speed', type=float, default=10000., metavar='MM_PER_S',
+                        help='approach speed that plays a hit at full velocity; the default, '
+                                '10000 (about as fast as a hand strikes), is not calibrated on '
+                                'the boards, so tune it by ear on a recorded session')
+args = parser.parse_args()
 
 DIFF_THRESH = 50
 
-quadrant_left = serial.Serial(FILENAME_LEFT, 115200)
-quadrant_right = serial.Serial(FILENAME_RIGHT, 115200)
+# hit velocity: fastest approach (mm/s) over the last PEAK_HOLD seconds or
+# so, scaled so --hit-speed is full velocity
+HIT_VEL_MIN = 0.05
+PEAK_HOLD = 0.2
 
 scale_left = [0, 2, 4, 7]
 scale_right = [9, 12, 14, 16]
 
-report_left = None
-report_right = None
-
-"""
-bs_last = np.ones(8, dtype=np.float32) * 512
-hit_dist_left = [512,512,512,512]
-hit_dist_right = [512,512,512,512]
-engaged_left = [False, False, False, False]
-engaged_right = [False, False, False, False]
-was_engaged_left = [False, False, False, False]
-was_engaged_right = [False, False, False, False]
-elevation_was_engaged = False
-"""
-
-any_were_engaged = False
-cof = 0
-
-while True:
-
-    while quadrant_left.in_waiting:
-        report_raw = quadrant_left.readline();
-        try:
-            report_left = json.loads(report_raw)
-        except json.decoder.JSONDecodeError:
-            print('failed to parse')
-            continue
-
-    while quadrant_right.in_waiting:
-        report_raw = quadrant_right.readline();
-        try:
-            report_right = json.loads(report_raw)
-        except json.decoder.JSONDecodeError:
-            print('failed to parse')
-            continue
-
-    if (report_left and report_right):
-
-        print()
+
+class Triangulation:
+
+    def __init__(self):
+        self.decoders = [ReportDecoder(on_error=lambda line: print('failed to parse')) for board in range(2)]
+        # with --align clock both boards on one timeline, by their clocks
+        # rather than by whichever was read last; latest FRAME record of each
+        self.aligner = TimelineAligner(2, args.rate) if args.align == 'clock' else None
+        self.latest = [None, None]
+        # (board, dist, time) of every frame since the last smooth(), for the
+        # approach speeds
+        self.samples = []
+        """
+        bs_last = np.ones(8, dtype=np.float32) * 512
+        hit_dist_left = [512,512,512,512]
+        hit_dist_right = [512,512,512,512]
+        engaged_left = [False, False, False, False]
+        engaged_right = [False, False, False, False]
+        was_engaged_left = [False, False, False, False]
+        was_engaged_right = [False, False, False, False]
+        elevation_was_engaged = False
+        """
+        self.any_were_engaged = False
+        self.cof = 0
+        # each board's 4 channels on its own times
+        self.smoothers = [AlphaBetaFilter(4) for board in range(2)]
+        self.approach = np.zeros(8)
+        self.t_approach = [None, None]
+        # the filter's predicted distances, sent as the board sample
+        self.bs = np.full(8, 512.)
+
+    def sources(self, left, right):
+        return [open_source(spec, parse_batch=decoder.decode_batch)
+                for spec, decoder in zip((left, right), self.decoders)]
+
+    def collect(self, ready):
+        # keeps each board's latest frame; returns (events_left, events_right)
+        # of the new frames, or None until both boards have spoken
+        if self.aligner is not None:
+            return self._collect_timeline(ready)
+        events = ([], [])
+        for board, t, frames in ready:
+            if not len(frames):
+                continue
+            self.latest[board] = frames[-1]
+            # the board's clock where it has one: a batch shares one host time
+            times = np.where(frames['ts'] >= 0, frames['ts'] * 1e-6, t)
+            self.samples.extend((board, dist, th) for dist, th in zip(frames['dist'], times.tolist()))
+            for mask in frames['events'][frames['events'] != 0].tolist():
+                events[board].extend(event_names(mask))
+        if None in self.latest:
+            return None
+        return events
+
+    def _collect_timeline(self, ready):
+        frames = self.aligner.push(ready)
+        if not len(frames):
+            return None
+        self.latest = [frames[-1,0], frames[-1,1]]
+        events = ([], [])
+        for board in range(2):
+            times = frames['host'][:,board].tolist()
+            self.samples.extend(zip([board] * len(frames), frames['dist'][:,board], times))
+            masks = frames['events'][:,board]
+            for mask in masks[masks != 0].tolist():
+                events[board].extend(event_names(mask))
+        return events
+
+    def smooth(self, events):
+        # smoothed distances and approach speed for hit velocities, from every
+        # frame so they don't depend on how many came in this batch; events
+        # pass through
+        for board, dist, t in self.samples:
+            _, vel, predicted = self.smoothers[board].update(np.clip(dist, 0, 512), t)
+            chans = slice(4 * board, 4 * board + 4)
+            self.bs[chans] = predicted
+            t_last = self.t_approach[board]
+            decay = np.exp((t_last - t) / PEAK_HOLD) if t_last is not None and t >= t_last else 0.
+            self.approach[chans] = np.maximum(self.approach[chans] * decay, -vel)
+            self.t_approach[board] = t
+        self.samples = []
+        return events
+
+    def hit_velocity(self, i):
+        # uses up channel i's approach, so one fast move makes one loud hit
+        vel = min(max(self.approach[i] / args.hit_speed, HIT_VEL_MIN), 1.)
+        self.approach[i] = 0.
+        return vel
+
+    def detect(self, events):
+        if events is None:
+            return []
+        events_left, events_right = events
+        report_left, report_right = self.latest
+
+        out = ['']
 
         # cycle COF on elevation first engaged
         """
@@ -67,56 +145,50 @@ while True:
 
         # if any_engaged has a rising edge, then do a key chnage
         any_engaged = False
-        for r,k in itertools.product([report_left, report_right], ['l0', 'l1', 'l2', 'l3']):
-            if r[k]['en']:
-                any_engaged = True
-                break
-        if (any_engaged and not any_were_engaged):
-            cof = (cof + 7) % 12
-            print('cof %d;' % cof)
-        any_were_engaged = any_engaged
+        if report_left['dist_en'].any() or report_right['dist_en'].any():
+            any_engaged = True
+        if (any_engaged and not self.any_were_engaged):
+            self.cof = (self.cof + 7) % 12
+            out.append('cof %d;' % self.cof)
+        self.any_were_engaged = any_engaged
 
-        # board sample
-        bs_left = tuple(np.clip(report_left[s]['dist'], 0,512) for s in ['l0', 'l1', 'l2', 'l3'])
-        bs_right = tuple(np.clip(report_right[s]['dist'], 0,512) for s in ['l0', 'l1', 'l2', 'l3'])
-        bs = np.array(bs_left + bs_right, dtype=np.float32)
-        print('bs %.2f %.2f %.2f %.2f %.2f %.2f %.2f %.2f;' % tuple(bs))
+        # board sample, smoothed and a little ahead
+        bs = np.clip(self.bs, 0, 512)
+        out.append('bs %.2f %.2f %.2f %.2f %.2f %.2f %.2f %.2f;' % tuple(bs))
 
         # elevations
-        aveL = (1 - report_left['elevation']['val']) * 1023
-        aveR = (1 - report_right['elevation']['val']) * 1023
-        print('aves %.2f %.2f;' % (aveL, aveR))
+        aveL = (1 - report_left['val'][ELEVATION]) * 1023
+        aveR = (1 - report_right['val'][ELEVATION]) * 1023
+        out.append('aves %.2f %.2f;' % (aveL, aveR))
 
         # pitch
-        pitchL = report_left['pitch']['val'] * 512
-        pitchR = report_right['pitch']['val'] * 512
-        print('pitches %.2f %.2f;' % (pitchL, pitchR))
+        pitchL = report_left['val'][PITCH] * 512
+        pitchR = report_right['val'][PITCH] * 512
+        out.append('pitches %.2f %.2f;' % (pitchL, pitchR))
 
         # roll
-        rollL = report_left['roll']['val'] * 512
-        rollR = report_right['roll']['val'] * 512
-        print('rolls %.2f %.2f;' % (rollL, rollR))
+        rollL = report_left['val'][ROLL] * 512
+        rollR = report_right['val'][ROLL] * 512
+        out.append('rolls %.2f %.2f;' % (rollL, rollR))
 
         # events
         hits = ['hit0', 'hit1', 'hit2', 'hit3']
-        events_left = report_left['events']
         for e in events_left:
             if e in hits:
                 i = hits.index(e)
-                print('hitL %d %.4f;' % (scale_left[i], 0.25))
+                out.append('hitL %d %.4f;' % (scale_left[i], self.hit_velocity(i)))
             elif e == 'swl':
-                print('lswipe 0;')
+                out.append('lswipe 0;')
             elif e == 'swr':
-                print('lswipe 1;')
-        events_right = report_right['events']
+                out.append('lswipe 1;')
         for e in events_right:
             if e in hits:
                 i = hits.index(e)
-                print('hitR %d %.4f;' % (scale_right[i], 0.25))
+                out.append('hitR %d %.4f;' % (scale_right[i], self.hit_velocity(i + 4)))
             elif e == 'swl':
-                print('rswipe 0;')
+                out.append('rswipe 0;')
             elif e == 'swr':
-                print('rswipe 1;')
+                out.append('rswipe 1;')
 
         # hits (velocity)
         """
@@ -149,3 +221,10 @@ while True:
         report_right = None
         """
 
+        return out
+
+
+triangulation = Triangulation()
+Pipeline(triangulation.sources(args.left, args.right), [open_sink(args.out)],
+            parse=triangulation.collect, filter=triangulation.smooth,
+            detect=triangulation.detect).run()
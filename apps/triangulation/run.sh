@@ -2,4 +2,4 @@
 
 pasuspender -- pd pd/main.pd &
 sleep 2
-python3 -u readSerial.py | pdsend 8000
+python3 readSerial.py --out 8000
@@ -1,32 +1,47 @@
 #!/usr/bin/python3 -u
 
-import serial
-import struct
 import sys
+import os
+import argparse
 
-if len(sys.argv) > 2:
-    deviceFile0 = sys.argv[1]
-    deviceFile1 = sys.argv[2]
-else:
-    deviceFile0 = '/dev/ttyACM0'
-    deviceFile1 = '/dev/ttyACM1'
+import numpy as np
 
-quadrant0 = serial.Serial(deviceFile0, 115200)
-quadrant1 = serial.Serial(deviceFile1, 115200)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../common'))
+from report import ReportDecoder
+from mux import FrameAligner, TimelineAligner
+from fudi import open_sink, add_sink_argument
+from pipeline import Pipeline, open_source, SOURCE_HELP
 
-while True:
+parser = argparse.ArgumentParser(description='forward raw distances from several Quadrants to Pd, '
+                                    '4 values per board')
+parser.add_argument('devices', nargs='*', default=['/dev/ttyACM0', '/dev/ttyACM1'], help=SOURCE_HELP)
+add_sink_argument(parser)
+parser.add_argument('--align', choices=('order', 'clock'), default='order',
+                        help='pair each frame of the fastest board with the others\' latest as '
+                                'they arrive, or interpolate them onto a common timeline; both go '
+                                'by each board\'s clock where it reports one (JSON or binary)')
+parser.add_argument('--rate', type=float, default=100., help='output rate with --align clock, Hz')
+args = parser.parse_args()
 
-    data0_raw = quadrant0.readline();
-    data0 = tuple(map(int, data0_raw.split()))
-    quadrant0.reset_input_buffer()
+sources = [open_source(device, parse_batch=ReportDecoder(on_error=lambda line: print('wtf!')).decode_batch)
+            for device in args.devices]
+if args.align == 'clock':
+    aligner = TimelineAligner(len(sources), args.rate)
+else:
+    aligner = FrameAligner(len(sources))
+fmt = ' '.join(['%d'] * 4 * len(sources)) + ';'
 
-    data1_raw = quadrant1.readline();
-    data1 = tuple(map(int, data1_raw.split()))
-    quadrant1.reset_input_buffer()
 
-    if (len(data0) == 4) and (len(data1) == 4):
-        data = struct.unpack('BBBBBBBB', data0[:4] + data1[:4])
-        print('%d %d %d %d %d %d %d %d;' % data)
+def align(ready):
+    frames = aligner.push(ready)
+    if not len(frames):
+        return []
+    # (nframes, 4 * nboards) distances, formatted in one go
+    if args.align == 'clock':
+        dist = frames['dist'].reshape(len(frames), -1)
     else:
-        print('wtf!')
-        continue
+        dist = np.concatenate([np.array([f['dist'] for f in board]) for board in zip(*frames)], axis=1)
+    return [fmt % tuple(row) for row in dist.tolist()]
+
+
+Pipeline(sources, [open_sink(args.out)], detect=align).run()
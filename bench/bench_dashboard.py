@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+# Time per call of dashboard.py's MainWidget.refresh and
+# GraphingWidget.update_data, under Qt's offscreen platform so no display is
+# needed. refresh is fed `batch` frames a call (15 at 1 kHz with the 15 ms
+# refresh timer) from synthetic reports or recorded sessions, in place of the
+# ReaderThread; "refresh + paint" also lets Qt repaint the window.
+#
+#   python3 bench_dashboard.py [--history 512 ...] [session.qs ...]
+
+import argparse
+import importlib
+import sys
+import os
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '../common'))
+sys.path.insert(0, os.path.join(HERE, '../apps/dataViz/dashboard'))
+from report import ReportDecoder
+from store import StoreWriter
+
+CALLS = 500
+
+
+class _Feed:
+
+    # stands in for the ReaderThread: `batch` frames per drain(), looping
+
+    def __init__(self, frames, batch):
+        self.frames = frames
+        self.batch = batch
+        self.pos = 0
+        self.overflows = 0
+
+    def drain(self):
+        if self.pos + self.batch > len(self.frames):
+            self.pos = 0
+        out = self.frames[self.pos:self.pos+self.batch]
+        self.pos += self.batch
+        return out
+
+
+def _window(frames, history, root):
+    # a dashboard browsing a one-frame store in root: no board needed, and
+    # refresh() works the same as when reading one
+    writer = StoreWriter(root)
+    writer.append(frames[:1])
+    writer.close()
+    sys.argv = ['dashboard.py', '--open', root, '--history', str(history)]
+    if 'dashboard' in sys.modules:
+        dashboard = importlib.reload(sys.modules['dashboard'])
+    else:
+        dashboard = importlib.import_module('dashboard')
+    win = dashboard.MainWindow()
+    win.resize(1200, 800)
+    win.show()
+    return dashboard, win
+
+
+def _time(fn, calls=CALLS):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - t0) / calls
+
+
+def run(frames, histories=(512,), batch=15):
+    # {name: ms per call}
+    import PyQt5.QtWidgets as qtw
+    app = qtw.QApplication.instance() or qtw.QApplication([])
+    results = {}
+    for history in histories:
+        with tempfile.TemporaryDirectory(prefix='bench_dashboard.') as root:
+            dashboard, win = _window(frames, history, root)
+            app.processEvents()
+            widget = win.widget
+            widget.reader_thread = _Feed(frames, batch)
+            # fill the history first, so the plots draw a full window
+            for _ in range(history // batch + 1):
+                widget.refresh()
+            results['refresh (history %d)' % history] = 1e3 * _time(widget.refresh)
+
+            def paint():
+                widget.refresh()
+                win.repaint()
+                app.processEvents()
+            results['refresh + paint (history %d)' % history] = 1e3 * _time(paint)
+            graph = widget.graphing_widget
+            stats = widget.stats[widget.stats_index]
+            name = dashboard.STATS_WINDOWS[widget.stats_index][0]
+            results['update_data (history %d)' % history] = \
+                1e3 * _time(lambda: graph.update_data(widget.databuf, stats, name))
+            win.close()
+    return results
+
+
+def synthetic_frames(n):
+    from bench_report import synthetic_reports
+    frames = ReportDecoder().decode_batch(synthetic_reports(n))
+    frames['host'] = np.arange(n) * 1e-3
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='dashboard refresh time, offscreen')
+    parser.add_argument('sessions', nargs='*', help='recorded sessions (default: synthetic reports)')
+    parser.add_argument('--history', type=int, action='append', help='plot history, may be repeated')
+    parser.add_argument('--batch', type=int, default=15, help='frames per refresh')
+    args = parser.parse_args()
+
+    if args.sessions:
+        from sweep import load_frames
+        frames = np.concatenate([load_frames(f) for f in args.sessions])
+    else:
+        frames = synthetic_frames(20000)
+    for name, ms in run(frames, args.history or (512,), args.batch).items():
+        print('%-32s %8.3f ms/call' % (name, ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+# Frames/sec through the detect stage of pluck.py, multipluck.py and
+# swipe.py, and through the hit detector, fed batch by batch as the
+# Pipeline would. Runs on synthetic hands (simulator.py) or on
+# recorded sessions.
+#
+#   python3 bench_gesture.py [--batch 16] [session.qs ...]
+
+import argparse
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../common'))
+from report import ReportDecoder
+from simulator import simulate
+from sweep import load_frames
+from gesture import (ThresholdDetector, BandDetector, SwipeDetector, HitDetector,
+                        ENGAGE, SWIPE_LEFT, SWIPE_RIGHT)
+
+RATE = 100.
+
+
+def synthetic_frames(n, rate=RATE, seed=0):
+    frames = simulate(rate, seed=seed)
+    frames = ReportDecoder().decode_batch([next(frames) for _ in range(n)])
+    frames['host'] = np.arange(n) / rate
+    return frames
+
+
+def pluck():
+    detector = ThresholdDetector(4, 180)
+
+    def detect(batch):
+        events = detector.process(batch['dist'])
+        events = events[events['kind'] == ENGAGE]
+        return ['%d %d;' % e for e in zip(events['chan'].tolist(), events['value'].tolist())]
+    return detect
+
+
+def multipluck():
+    detector = BandDetector(4, [(70, 180, 70), (float('-inf'), 70, 0)])
+
+    def detect(batch):
+        events = detector.process(batch['dist'])
+        events = events[events['kind'] == ENGAGE]
+        return ['%d %d;' % e for e in zip(events['chan'].tolist(), events['value'].tolist())]
+    return detect
+
+
+def swipe():
+    detector = SwipeDetector(4, 180, [(1, 3)])
+
+    def detect(batch):
+        kinds = detector.process(batch['dist'])['kind'].tolist()
+        return [k for k in kinds if k in (SWIPE_LEFT, SWIPE_RIGHT)]
+    return detect
+
+
+def hit():
+    detector = HitDetector(4, 180)
+
+    def detect(batch):
+        events = detector.process(batch['dist'], batch['host'])
+        return events['chan'].tolist()
+    return detect
+
+
+DETECTORS = (('pluck', pluck), ('multipluck', multipluck), ('swipe', swipe), ('hit', hit))
+
+
+def run(frames, batch=16, repeat=3):
+    # {name: (frames/s, number of messages)}, best of `repeat` runs
+    batches = [frames[k:k+batch] for k in range(0, len(frames), batch)]
+    results = {}
+    for name, make in DETECTORS:
+        best = 0.
+        for _ in range(repeat):
+            detect = make()
+            nmessages = 0
+            t0 = time.perf_counter()
+            for b in batches:
+                nmessages += len(detect(b))
+            best = max(best, len(frames) / (time.perf_counter() - t0))
+        results[name] = (best, nmessages)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gesture detection throughput')
+    parser.add_argument('sessions', nargs='*', help='recorded sessions (default: synthetic hands)')
+    parser.add_argument('--frames', type=int, default=100000, help='synthetic frames')
+    parser.add_argument('--batch', type=int, default=16, help='frames per batch')
+    parser.add_argument('--repeat', type=int, default=3, help='runs to take the best of')
+    args = parser.parse_args()
+
+    if args.sessions:
+        frames = np.concatenate([load_frames(f) for f in args.sessions])
+    else:
+        frames = synthetic_frames(args.frames)
+    for name, (fps, nmessages) in run(frames, args.batch, args.repeat).items():
+        print('%-12s %10.0f frames/s  (%d messages)' % (name, fps, nmessages))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+# Frames/sec of the status report decoders, on synthetic reports, plus the
+# report rate each wire format allows on a 115200 baud link and the memory
+# each decoded representation takes per report.
+#
+#   python3 bench_report.py [nframes]
+
+import json
+import math
+import random
+import sys
+import os
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../common'))
+from report import ReportDecoder, LIDARS, PARAMS
+from ingest import parse_raw
+from binreport import encode_report, cobs_decode
+
+BAUD = 115200
+
+
+def synthetic_reports(n, seed=0):
+    rng = random.Random(seed)
+    ts = 0
+    lines = []
+    for k in range(n):
+        ts += 1000 + rng.randint(-50, 50)
+        report = {'ts': ts}
+        for s in LIDARS:
+            d = rng.randint(0, 8190)
+            report[s] = {'dist': d, 'en': d < 300}
+        for s in PARAMS:
+            report[s] = {'val': round(rng.uniform(-1, 1), 6), 'en': rng.random() < 0.5}
+        report['events'] = ['hit%d' % rng.randint(0, 3)] if rng.random() < 0.02 else []
+        lines.append(json.dumps(report, separators=(',', ':')).encode() + b'\r\n')
+    return lines
+
+
+def to_binary(lines):
+    # COBS-framed binary frames carrying the same reports
+    frames = []
+    for line in lines:
+        r = json.loads(line)
+        frames.append(encode_report(r['ts'],
+                        [r[s]['dist'] for s in LIDARS], [r[s]['en'] for s in LIDARS],
+                        [r[s]['val'] for s in PARAMS], [r[s]['en'] for s in PARAMS],
+                        r['events']))
+    return frames
+
+
+def current_path(lines):
+    # what dashboard.py / readSerial.py do per report
+    total = 0.
+    for line in lines:
+        report = json.loads(line)
+        total += report['ts']
+        for s in LIDARS:
+            total += report[s]['dist'] + report[s]['en']
+        for s in PARAMS:
+            total += report[s]['val'] + report[s]['en']
+        total += len(report['events'])
+    return total
+
+
+def fast_path(lines):
+    dec = ReportDecoder()
+    total = 0.
+    for line in lines:
+        dec.decode(line)
+        total += dec.ts
+        dist, dist_en, val, val_en = dec.dist, dec.dist_en, dec.val, dec.val_en
+        for i in range(4):
+            total += dist[i] + dist_en[i]
+        for i in range(4):
+            total += val[i] + val_en[i]
+        total += len(dec.events)
+    return total
+
+
+def current_decode_only(lines):
+    loads = json.loads
+    for line in lines:
+        loads(line)
+    return None
+
+
+def fast_decode_only(lines):
+    decode = ReportDecoder().decode
+    for line in lines:
+        decode(line)
+    return None
+
+
+def batch_path(lines, batch=64):
+    # FRAME arrays, summed a column at a time
+    dec = ReportDecoder()
+    total = 0.
+    for k in range(0, len(lines), batch):
+        f = dec.decode_batch(lines[k:k+batch])
+        total += (f['ts'].sum() + f['dist'].sum() + f['dist_en'].sum() + f['val'].sum()
+                    + f['val_en'].sum() + sum(bin(e).count('1') for e in f['events'][f['events'] != 0]))
+    return total
+
+
+def raw_lines(lines):
+    return [b'%d %d %d %d\r\n' % tuple(json.loads(line)[s]['dist'] for s in LIDARS) for line in lines]
+
+
+def raw_tuples(lines):
+    return [parse_raw(line) for line in lines]
+
+
+def raw_batch(lines, batch=64):
+    dec = ReportDecoder()
+    return [dec.decode_batch(lines[k:k+batch]) for k in range(0, len(lines), batch)]
+
+
+def memory_per_report(build, n=10000):
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / n
+
+
+def binary_path(frames):
+    # framing included, as FrameReader would see it
+    return fast_path([cobs_decode(f[:-1]) for f in frames])
+
+
+def run(nframes=50000):
+    lines = synthetic_reports(nframes)
+    frames = to_binary(lines)
+    results = {}
+    for name, fn, data in (('json.loads', current_path, lines),
+                            ('ReportDecoder', fast_path, lines),
+                            ('ReportDecoder (binary)', binary_path, frames),
+                            ('decode_batch (json)', batch_path, lines),
+                            ('decode_batch (binary)', batch_path, [cobs_decode(f[:-1]) for f in frames]),
+                            ('json.loads (decode only)', current_decode_only, lines),
+                            ('ReportDecoder (decode only)', fast_decode_only, lines)):
+        t0 = time.perf_counter()
+        check = fn(data)
+        dt = time.perf_counter() - t0
+        results[name] = (nframes / dt, check)
+    raw = raw_lines(lines)
+    for name, fn in (('parse_raw (raw)', raw_tuples), ('decode_batch (raw)', raw_batch)):
+        t0 = time.perf_counter()
+        fn(raw)
+        results[name] = (nframes / (time.perf_counter() - t0), None)
+    wire = {'json': sum(map(len, lines)) / nframes, 'binary': sum(map(len, frames)) / nframes}
+    few = lines[:10000]
+    memory = {'json.loads dicts': memory_per_report(lambda: [json.loads(l) for l in few]),
+                'FRAME array': memory_per_report(lambda: ReportDecoder().decode_batch(few)),
+                'parse_raw tuples': memory_per_report(lambda: raw_tuples(raw[:10000])),
+                'FRAME array (raw)': memory_per_report(lambda: ReportDecoder().decode_batch(raw[:10000]))}
+    return results, wire, memory
+
+
+if __name__ == '__main__':
+    nframes = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    results, wire, memory = run(nframes)
+    base = results['json.loads'][0]
+    for name, (fps, check) in results.items():
+        print('%-28s %10.0f frames/s  (x%.2f)' % (name, fps, fps / base))
+    for name, nbytes in wire.items():
+        print('%-6s %6.1f bytes/report  -> %5.0f reports/s max at %d baud' %
+                (name, nbytes, BAUD / 10 / nbytes, BAUD))
+    for name, nbytes in memory.items():
+        print('%-18s %7.0f bytes/report' % (name, nbytes))
+    # batch_path sums in a different order, so allow for rounding
+    if (results['json.loads'][1] != results['ReportDecoder'][1] or
+            not math.isclose(results['json.loads'][1], results['decode_batch (json)'][1], rel_tol=1e-9)):
+        print('decoders disagree!')
+        sys.exit(1)
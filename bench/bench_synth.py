@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+
+# How many times faster than realtime the sampler (synth.py) mixes, with a
+# note every `interval` seconds on the pluck samples so that every voice is
+# busy and voices get stolen, rendered in sound-card-sized blocks.
+#
+#   python3 bench_synth.py [--seconds 20] [--block 256]
+
+import argparse
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../common'))
+from synth import load_sampler
+
+NOTES = ['c4', 'd4', 'e4', 'f4', 'g4', 'a4', 'b4', 'c5']
+
+
+def run(voices=(8, 32), seconds=20., block=256, interval=0.05, repeat=3, seed=0):
+    # {voices: (x realtime, voices stolen)}, best of `repeat` runs
+    results = {}
+    for nvoices in voices:
+        best = 0.
+        for _ in range(repeat):
+            sampler = load_sampler(NOTES, nvoices)
+            rng = np.random.default_rng(seed)
+            n = int(seconds * sampler.rate)
+            for at in range(0, n, int(interval * sampler.rate)):
+                sampler.play(int(rng.integers(len(NOTES))), float(rng.random()) / 8, at)
+            t0 = time.perf_counter()
+            while sampler.time < n:
+                sampler.render(block)
+            best = max(best, seconds / (time.perf_counter() - t0))
+        results[nvoices] = (best, sampler.stolen)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sampler mixing speed')
+    parser.add_argument('--seconds', type=float, default=20., help='audio to render')
+    parser.add_argument('--block', type=int, default=256, help='samples per render')
+    parser.add_argument('--voices', type=int, action='append', help='voice pool sizes (default 8 and 32)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs to take the best of')
+    args = parser.parse_args()
+
+    for nvoices, (speed, stolen) in run(args.voices or (8, 32), args.seconds, args.block,
+                                        repeat=args.repeat).items():
+        print('%3d voices %10.1f x realtime  (%d stolen)' % (nvoices, speed, stolen))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+# Replays a stream through the original per-report loops of pluck.py,
+# multipluck.py and swipe.py and through the vectorized detectors
+# (gesture.py) that replaced them, fed in batches of several sizes as the
+# Pipeline would, and checks that both print the same thing in the same
+# order. Exits 1 on the first difference. Runs on synthetic hands
+# (simulator.py) and on uniform noise, which puts edges on several channels
+# in the same frame far more often than hands do, or on recorded sessions.
+#
+#   python3 check_gesture.py [--batch 16 --batch 997] [session.qs ...]
+
+import argparse
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../common'))
+from sweep import load_frames
+from gesture import SwipeDetector, SWIPE_LEFT, SWIPE_RIGHT, FAKEOUT_LEFT, FAKEOUT_RIGHT
+from report import FRAME
+from bench_gesture import synthetic_frames, pluck, multipluck
+
+THRESH1 = 180
+THRESH2 = 70
+
+
+# the original scripts' loops, one "d d d d" report at a time
+
+def old_pluck(rows):
+    out = []
+    engaged = [False] * 4
+    for data in rows:
+        for i in range(4):
+            if (not engaged[i]) and (data[i] < 180):
+                engaged[i] = True
+                out.append('%d %d;' % (i, data[i]))
+            if engaged[i] and (data[i] >= 180):
+                engaged[i] = False
+    return out
+
+
+def old_multipluck(rows):
+    out = []
+    engaged = [False] * 8
+    for data in rows:
+        for i in range(4):
+            if (not engaged[i]) and (THRESH2 <= data[i] < THRESH1):
+                engaged[i] = True
+                out.append('%d %d;' % (i, data[i] - THRESH2))
+            if engaged[i] and (data[i] >= THRESH1) or (data[i] < THRESH2):
+                engaged[i] = False
+            if (not engaged[i+4]) and (data[i] < THRESH2):
+                engaged[i+4] = True
+                out.append('%d %d;' % (i+4, data[i]))
+            if engaged[i+4] and (data[i] >= THRESH2):
+                engaged[i+4] = False
+    return out
+
+
+def old_swipe(rows):
+    out = []
+    engaged = [False] * 4
+    primeLeft = primeRight = False
+    for data in rows:
+        for i in range(4):
+            if (not engaged[i]) and (data[i] < 180):
+                engaged[i] = True
+                if i==1 and engaged[3]:
+                    primeRight = True
+                if i==3 and engaged[1]:
+                    primeLeft = True
+            if engaged[i] and (data[i] >= 180):
+                engaged[i] = False
+                if i==1 and engaged[3]:
+                    if primeLeft:
+                        out.append('left swipe')
+                        primeLeft = False
+                    elif primeRight:
+                        out.append('right fakeout')
+                        primeRight = False
+                if i==3 and engaged[1]:
+                    if primeRight:
+                        out.append('right swipe')
+                        primeRight = False
+                    elif primeLeft:
+                        out.append('left fakeout')
+                        primeLeft = False
+    return out
+
+
+def noise_frames(n, seed=0):
+    frames = np.zeros(n, dtype=FRAME)
+    frames['dist'] = np.random.default_rng(seed).integers(0, 250, (n, 4))
+    return frames
+
+
+# swipe.py's detect stage, printing what the original did
+
+NAMES = {SWIPE_LEFT: 'left swipe', SWIPE_RIGHT: 'right swipe',
+            FAKEOUT_LEFT: 'left fakeout', FAKEOUT_RIGHT: 'right fakeout'}
+
+
+def swipe():
+    detector = SwipeDetector(4, 180, [(1, 3)])
+
+    def detect(batch):
+        return [NAMES[k] for k in detector.process(batch['dist'])['kind'].tolist() if k in NAMES]
+    return detect
+
+
+CHECKS = (('pluck', old_pluck, pluck), ('multipluck', old_multipluck, multipluck),
+            ('swipe', old_swipe, swipe))
+
+
+def check(frames, batches=(1, 16, 997)):
+    # [(name, batch, number of messages, index of the first difference or
+    # None, new messages, old messages), ...]
+    rows = frames['dist'].tolist()
+    results = []
+    for name, old, new in CHECKS:
+        expected = old(rows)
+        for batch in batches:
+            detect = new()
+            got = []
+            for k in range(0, len(frames), batch):
+                got += detect(frames[k:k+batch])
+            diff = None
+            if got != expected:
+                diff = next((k for k, (a, b) in enumerate(zip(got, expected)) if a != b),
+                            min(len(got), len(expected)))
+            results.append((name, batch, len(expected), diff, got, expected))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='old vs vectorized gesture detection')
+    parser.add_argument('sessions', nargs='*', help='recorded sessions (default: synthetic hands)')
+    parser.add_argument('--frames', type=int, default=100000, help='synthetic frames')
+    parser.add_argument('--seed', type=int, default=0, help='synthetic hands seed')
+    parser.add_argument('--batch', type=int, action='append', help='frames per batch (default 1, 16, 997)')
+    args = parser.parse_args()
+
+    if args.sessions:
+        streams = [('sessions', np.concatenate([load_frames(f) for f in args.sessions]))]
+    else:
+        streams = [('hands', synthetic_frames(args.frames, seed=args.seed)),
+                    ('noise', noise_frames(args.frames, args.seed))]
+    failed = False
+    for stream, frames in streams:
+        for name, batch, n, diff, got, expected in check(frames, args.batch or (1, 16, 997)):
+            if diff is None:
+                print('%-8s %-12s batch %4d  ok  (%d messages)' % (stream, name, batch, n))
+                continue
+            failed = True
+            print('%-8s %-12s batch %4d  DIFFERS at message %d: %r, was %r'
+                    % (stream, name, batch, diff, got[diff:diff+3], expected[diff:diff+3]))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
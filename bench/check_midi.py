@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+# Replays a session through swipe.py's MIDI output (--controllers: the
+# program on swipes plus the distance, elevation, pitch and roll streams)
+# into a RecordingSink, on the session's clock, and checks what came out:
+#
+#   bandwidth   no stretch of the recording carries more bytes than the
+#               link allows for its length, plus the engine's burst
+#   rate        no controller is sent more often than its max_rate
+#   changes     no controller is sent the value it already had
+#   final       once the engine has caught up, every controller holds the
+#               value of the last frame it maps (the last engaged one, for
+#               gated sources), and the program is where the swipes left it
+#
+# Exits 1 if any check fails. Default: 20 s of simulated hands at 1 kHz in
+# JSON, on a DIN link and on one tight enough that the engine has to hold
+# values back.
+#
+#   python3 check_midi.py [--bandwidth 3125 ...] [session.qs]
+
+import argparse
+import sys
+import os
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../common'))
+from ingest import FrameReader
+from report import ReportDecoder
+from session import read_session
+from simulator import Board, record
+from gesture import SwipeDetector, SWIPE_LEFT, SWIPE_RIGHT
+from midi import ControllerEngine, Controller, RecordingSink, DIN_BANDWIDTH, BURST
+
+PROGRAM = 0
+
+
+def controllers(max_rate):
+    # as swipe.py --controllers sets them up
+    return ([Controller(None, 'program', 1, max_rate=max_rate)] +
+            [Controller('l%d' % i, 'cc', 1, 20 + i, 400, 0, max_rate) for i in range(4)] +
+            [Controller('elevation', 'nrpn', 1, 0, 0, 1, max_rate),
+             Controller('pitch', 'bend', 1, 0, -1, 1, max_rate),
+             Controller('roll', 'cc', 1, 1, -1, 1, max_rate),
+             Controller('arc', 'cc', 1, 2, -1, 1, max_rate)])
+
+
+def key(c):
+    # what a message is addressed to, as decode() tells it
+    return (c.kind, c.channel, c.number if c.kind in ('cc', 'nrpn') else None)
+
+
+def decode(messages):
+    # [(index, key, value), ...] for the recorded messages, NRPNs put back
+    # together; index is the message completing the value
+    out = []
+    number = {}
+    msb = {}
+    for k, msg in enumerate(messages):
+        status, channel = msg[0] & 0xf0, (msg[0] & 0xf) + 1
+        if status == 0xc0:
+            out.append((k, ('program', channel, None), msg[1]))
+        elif status == 0xe0:
+            out.append((k, ('bend', channel, None), msg[1] | msg[2] << 7))
+        elif status == 0xb0:
+            cc, v = msg[1], msg[2]
+            if cc == 99:
+                number[channel] = v << 7
+            elif cc == 98:
+                number[channel] = number.get(channel, 0) | v
+            elif cc == 6:
+                msb[channel] = v
+            elif cc == 38:
+                out.append((k, ('nrpn', channel, number[channel]), msb.pop(channel) << 7 | v))
+            else:
+                out.append((k, ('cc', channel, cc), v))
+    return out
+
+
+def replay(session, engine, sink, tail=1.):
+    # runs the session through swipe.py's detect stage; returns ([time of
+    # each message], all frames, final program or None without swipes).
+    # After the session, the engine gets empty batches for `tail` seconds to
+    # send what it held back
+    reader = FrameReader(None, parse_batch=ReportDecoder().decode_batch)
+    detector = SwipeDetector(4, 180, [(1, 3)])
+    program = 1
+    swiped = False
+    times = []
+    batches = []
+    t = 0.
+    for t, data in read_session(session):
+        frames = reader.feed(data)
+        batches.append(frames)
+        for kind in detector.process(frames['dist'])['kind'].tolist():
+            if kind in (SWIPE_LEFT, SWIPE_RIGHT):
+                program = program - 1 or 16 if kind == SWIPE_LEFT else program % 16 + 1
+                engine.set(PROGRAM, program)
+                swiped = True
+        out = engine.process(frames, t)
+        times += [t] * len(out)
+        sink.send(out)
+    for t in np.arange(t, t + tail, 0.001)[1:].tolist():
+        out = engine.process(frames[:0], t)
+        times += [t] * len(out)
+        sink.send(out)
+    return times, np.concatenate(batches), program if swiped else None
+
+
+def check(session, bandwidth, max_rate):
+    # {check: (ok, detail)}
+    cs = controllers(max_rate)
+    engine = ControllerEngine(cs, bandwidth)
+    sink = RecordingSink()
+    times, frames, program = replay(session, engine, sink)
+    messages = [msg for _, msg in sink.messages]
+    values = decode(messages)
+    results = {}
+
+    # bytes up to and including each message, against the most the token
+    # bucket can have let through since any earlier message
+    sizes = np.array([len(msg) for msg in messages], dtype=np.float64)
+    t = np.array(times)
+    if bandwidth and len(messages):
+        cap = max(bandwidth * BURST, 12)
+        sent = np.cumsum(sizes)
+        before = sent - sizes - bandwidth * t
+        excess = (sent - bandwidth * t - np.minimum.accumulate(before)).max() - cap
+        results['bandwidth'] = (excess <= 1e-6, '%d bytes in %.1f s, %d sends deferred, most over '
+                                'budget %+.1f bytes' % (sent[-1], t[-1], engine.deferred, excess))
+    else:
+        results['bandwidth'] = (True, 'no limit')
+
+    keys = [key(c) for c in cs]
+    sends = {k: [] for k in keys}
+    for k, address, v in values:
+        sends[address].append((times[k], v))
+    # shortest gap between two sends of a controller, times its max_rate
+    closest = min(((b[0] - a[0]) * c.max_rate for c, k in zip(cs, keys)
+                    for a, b in zip(sends[k], sends[k][1:])), default=np.inf)
+    results['rate'] = (closest >= 1. - 1e-9, 'closest sends %.2f of 1/max_rate apart' % closest)
+    repeats = sum(a[1] == b[1] for s in sends.values() for a, b in zip(s, s[1:]))
+    results['changes'] = (repeats == 0, '%d values sent, %d repeated' % (len(values), repeats))
+
+    wrong = []
+    for c, k in zip(cs, keys):
+        expected = program if c.field is None else c.value(frames)
+        got = sends[k][-1][1] if sends[k] else None
+        if got != expected:
+            wrong.append('%s %s: sent %s, expected %s' % (c.source or 'program', k, got, expected))
+    results['final'] = (not wrong, '; '.join(wrong) or '%d controllers, program %s' % (len(cs), program))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MIDI controller engine bandwidth, rate and final values')
+    parser.add_argument('session', nargs='?', help='recorded session (default: 20 s of simulated hands, 1 kHz JSON)')
+    parser.add_argument('--bandwidth', type=float, action='append',
+                            help='bytes/s, 0 for no limit (default: a DIN link, and 300)')
+    parser.add_argument('--max-rate', type=float, default=100., help='messages/s per controller')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        session = args.session
+        if session is None:
+            session = os.path.join(directory, 'hands.qs')
+            record(Board(1000., 'json', seed=args.seed), session, 20.)
+        failed = False
+        for bandwidth in args.bandwidth or (DIN_BANDWIDTH, 300.):
+            print('%g bytes/s' % bandwidth)
+            for name, (ok, detail) in check(session, bandwidth, args.max_rate).items():
+                failed |= not ok
+                print('  %-10s %-8s %s' % (name, 'ok' if ok else 'FAILED', detail))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
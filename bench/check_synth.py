@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+# Checks the sampler (synth.py) against a brute-force mix, and that a
+# session renders to the same audio every time.
+#
+# mix: seeded random notes on the pluck samples, mixed by Sampler in
+# blocks of several sizes and by adding each note's whole sample into one
+# long buffer. With enough voices nothing is stolen; with few, the reference
+# gives each note the voice Sampler would and fades out the note it steals.
+#
+# render: a session (default: simulated hands, recorded to a temp file)
+# through pluck.py's detect stage into WavSink, twice with the same block
+# size and once with another. The first two must be byte for byte the same
+# file, the third the same samples, give or take the silent end of the last
+# block.
+#
+# Exits 1 if anything differs.
+#
+#   python3 check_synth.py [session.qs]
+
+import argparse
+import sys
+import os
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../common'))
+from synth import load_sampler, read_wav, render_session, WavSink
+from report import ReportDecoder
+from simulator import Board, record
+from gesture import ThresholdDetector, ENGAGE
+
+NOTES = ['c4', 'd4', 'e4', 'f4', 'g4', 'a4', 'b4', 'c5']
+# pluck.py's samples and volume
+PLUCK_NOTES = ['c4', 'd4', 'e4', 'g4']
+TOLERANCE = 1e-5
+
+
+def pluck_volume(value):
+    return (1 - value / 255) ** 2 / 4
+
+
+def random_notes(sampler, seconds, interval, seed):
+    # [(at, key, gain), ...] in time order, some starting on the same sample
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sampler.rate)
+    ats = np.sort(rng.integers(0, n, int(seconds / interval)))
+    ats[1::7] = ats[0::7][:len(ats[1::7])]
+    return [(at, int(rng.integers(len(sampler.samples))), float(rng.random()) / 8)
+            for at in ats.tolist()]
+
+
+def reference(sampler, notes, voices, n):
+    # every note added whole into one buffer; a stolen note stops where its
+    # voice is taken, fading over sampler.fade samples
+    out = np.zeros((n + max(sampler.length.tolist()) + sampler.fade, sampler.channels))
+    key = [-1] * voices
+    born = [0] * voices
+    ends = [0] * voices
+    index = [None] * voices
+    played = []
+    for at, note, gain in notes:
+        free = [v for v in range(voices) if key[v] < 0 or ends[v] <= at]
+        if free:
+            v = free[0]
+        else:
+            v = min(range(voices), key=lambda v: (born[v], v))
+            played[index[v]][3] = at
+        key[v], born[v], ends[v], index[v] = note, at, at + sampler.length[note], len(played)
+        played.append([at, note, gain, None])
+    ramp = np.linspace(1., 0., sampler.fade, endpoint=False)
+    for at, note, gain, stolen in played:
+        data = sampler.samples[note] * (gain * float(sampler.scale[note]))
+        if stolen is None:
+            out[at:at+len(data)] += data
+        else:
+            out[at:stolen] += data[:stolen-at]
+            tail = data[stolen-at:stolen-at+sampler.fade]
+            out[stolen:stolen+len(tail)] += tail * ramp[:len(tail),None]
+    return out[:n]
+
+
+def check_mix(seconds=5., interval=0.02, seed=0):
+    # [(voices, block, stolen, max error), ...]
+    results = []
+    for voices in (512, 4):
+        for block in (1024, 256, 97):
+            sampler = load_sampler(NOTES, voices)
+            notes = random_notes(sampler, seconds, interval, seed)
+            for at, key, gain in notes:
+                sampler.play(key, gain, at)
+            n = int(seconds * sampler.rate)
+            got = np.concatenate([sampler.render(block) for _ in range(-(-n // block))])[:n]
+            error = np.abs(got - reference(sampler, notes, voices, n)).max()
+            results.append((voices, block, sampler.stolen, float(error)))
+    return results
+
+
+def pluck_detect():
+    detector = ThresholdDetector(4, 180)
+
+    def detect(ready):
+        out = []
+        for board, t, batch in ready:
+            events = detector.process(batch['dist'], batch['ts'])
+            events = events[events['kind'] == ENGAGE]
+            out += ['%d %d;' % e for e in zip(events['chan'].tolist(), events['value'].tolist())]
+        return out
+    return detect
+
+
+def render(session, filename, block):
+    sink = WavSink(load_sampler(PLUCK_NOTES), pluck_volume, filename, block)
+    render_session(session, ReportDecoder().decode_batch, pluck_detect(), sink)
+    return sink.sampler.played
+
+
+def check_render(session, directory):
+    # (notes played, seconds of audio, same file, max difference across
+    # block sizes)
+    names = [os.path.join(directory, name) for name in ('a.wav', 'b.wav', 'c.wav')]
+    played = render(session, names[0], 1024)
+    render(session, names[1], 1024)
+    render(session, names[2], 256)
+    with open(names[0], 'rb') as a, open(names[1], 'rb') as b:
+        same = a.read() == b.read()
+    rate, a, _ = read_wav(names[0])
+    _, c, _ = read_wav(names[2])
+    n = min(len(a), len(c))
+    diff = max(np.abs(a[:n] - c[:n]).max(), np.abs(a[n:]).max(initial=0), np.abs(c[n:]).max(initial=0))
+    return played, len(a) / rate, same, float(diff)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sampler against a brute-force mix, render determinism')
+    parser.add_argument('session', nargs='?', help='recorded session (default: 30 s of simulated hands)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    failed = False
+    for voices, block, stolen, error in check_mix(seed=args.seed):
+        ok = error <= TOLERANCE
+        failed |= not ok
+        print('mix     %3d voices  block %4d  %4d stolen  max error %.2g  %s'
+                % (voices, block, stolen, error, 'ok' if ok else 'DIFFERS'))
+    with tempfile.TemporaryDirectory() as directory:
+        session = args.session
+        if session is None:
+            session = os.path.join(directory, 'hands.qs')
+            record(Board(100., seed=args.seed), session, 30.)
+        played, seconds, same, diff = check_render(session, directory)
+    ok = same and diff <= TOLERANCE and played > 0
+    failed |= not ok
+    print('render  %d notes, %.1f s  same file: %s  max difference across blocks %.2g  %s'
+            % (played, seconds, same, diff, 'ok' if ok else 'DIFFERS'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+# Runs every benchmark headless (report decoding, gesture detection, sampler
+# mixing and, when PyQt5 and pyqtgraph are installed, dashboard refresh
+# under the offscreen Qt platform) and saves the numbers as a JSON baseline,
+# or compares them against one.
+#
+#   python3 suite.py --save baseline.json
+#   python3 suite.py --compare baseline.json [--tolerance 0.2]
+#   python3 suite.py --session take1.qs --session take2.qs ...
+#
+# Each metric is saved with its unit; frames/s and x realtime are better
+# higher, ms/call better lower. --compare exits with status 1 when any metric is worse than
+# the baseline by more than the tolerance.
+
+import argparse
+import json
+import platform
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../common'))
+import bench_report
+import bench_gesture
+import bench_synth
+
+HIGHER = ('frames/s', 'x realtime')
+
+
+def run(args):
+    # best of --repeat runs for the throughputs, timing noise only ever slows
+    metrics = {}
+    for _ in range(args.repeat):
+        results, wire, memory = bench_report.run(args.frames)
+        for name, (fps, check) in results.items():
+            best = metrics.get('report/' + name, (0.,))[0]
+            metrics['report/' + name] = (max(fps, best), 'frames/s')
+
+    if args.session:
+        from sweep import load_frames
+        frames = np.concatenate([load_frames(f) for f in args.session])
+    else:
+        frames = bench_gesture.synthetic_frames(args.frames)
+    for name, (fps, nmessages) in bench_gesture.run(frames, repeat=args.repeat).items():
+        metrics['gesture/' + name] = (fps, 'frames/s')
+
+    for voices, (speed, stolen) in bench_synth.run(repeat=args.repeat).items():
+        metrics['synth/%d voices' % voices] = (speed, 'x realtime')
+
+    try:
+        import bench_dashboard
+        if not args.session:
+            frames = bench_dashboard.synthetic_frames(20000)
+        for name, ms in bench_dashboard.run(frames, (512, 360000)).items():
+            metrics['dashboard/' + name] = (ms, 'ms/call')
+    except ImportError as e:
+        print('skipping dashboard benchmarks: %s' % e)
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    # prints each metric against the baseline; returns the regressions
+    regressions = []
+    for name, (value, unit) in metrics.items():
+        if name not in baseline:
+            print('%-44s %12.4g %-9s (new)' % (name, value, unit))
+            continue
+        base = baseline[name]['value']
+        ratio = value / base if unit in HIGHER else base / value
+        flag = ''
+        if ratio < 1 - tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-44s %12.4g %-9s x%.2f%s' % (name, value, unit, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='headless benchmark suite')
+    parser.add_argument('--session', action='append', help='recorded session to use instead of synthetic streams')
+    parser.add_argument('--frames', type=int, default=50000, help='synthetic frames')
+    parser.add_argument('--repeat', type=int, default=3, help='runs to take the best of')
+    parser.add_argument('--save', metavar='FILE', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='fraction a metric may be worse than the baseline')
+    args = parser.parse_args()
+
+    metrics = run(args)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['metrics']
+        regressions = compare(metrics, baseline, args.tolerance)
+    else:
+        regressions = []
+        for name, (value, unit) in metrics.items():
+            print('%-44s %12.4g %s' % (name, value, unit))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'machine': platform.machine(),
+                        'node': platform.node(),
+                        'sessions': args.session or [],
+                        'metrics': {name: {'value': value, 'unit': unit}
+                                        for name, (value, unit) in metrics.items()}},
+                        f, indent=1)
+    if regressions:
+        print('%d regressions' % len(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+# Compact binary status report, COBS-framed.
+#
+# Each report is a packed little-endian struct, COBS-encoded so it contains
+# no zero bytes, followed by a single 0x00 delimiter:
+#
+#   u8      version (VERSION)
+#   u32     ts, device timestamp in us
+#   u16 x4  l0..l3 dist
+#   u8      engaged flags: bits 0-3 = l0..l3, bits 4-7 = elevation/pitch/roll/arc
+#   i16 x4  elevation, pitch, roll, arc val, scaled by VAL_SCALE
+#   u8      events: bits 0-5 = hit0, hit1, hit2, hit3, swl, swr
+#
+# That's 23 bytes (25 on the wire) against roughly 300 for the JSON report,
+# so the same 115200 baud link carries about ten times as many reports.
+#
+# The version byte is kept below 0x20 so a decoded payload can never be
+# mistaken for a JSON ('{') or "d d d d" text line; see ReportDecoder.decode.
+#
+# encode_report() is the reference encoder; the firmware side should produce
+# byte-identical frames.
+
+import struct
+
+VERSION = 1
+VAL_SCALE = 32767
+EVENTS = ('hit0', 'hit1', 'hit2', 'hit3', 'swl', 'swr')
+
+REPORT = struct.Struct('<BIHHHHBhhhhB')
+
+
+def cobs_encode(data):
+    out = bytearray(b'\x00')
+    code_at = 0
+    code = 1
+    for b in data:
+        if b:
+            out.append(b)
+            code += 1
+        if not b or code == 0xff:
+            out[code_at] = code
+            code_at = len(out)
+            out.append(0)
+            code = 1
+    out[code_at] = code
+    return bytes(out)
+
+
+def cobs_decode(data):
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        code = data[i]
+        if code == 0 or i + code > n:
+            raise ValueError('bad COBS frame')
+        out += data[i+1:i+code]
+        i += code
+        if code < 0xff and i < n:
+            out.append(0)
+    return bytes(out)
+
+
+def encode_report(ts, dist, dist_en, val, val_en, events=()):
+    # returns one complete frame, delimiter included
+    en = 0
+    for i in range(4):
+        if dist_en[i]:
+            en |= 1 << i
+        if val_en[i]:
+            en |= 1 << (i + 4)
+    ev = 0
+    for e in events:
+        ev |= 1 << EVENTS.index(e)
+    vals = [max(-VAL_SCALE, min(VAL_SCALE, round(v * VAL_SCALE))) for v in val]
+    dists = [max(0, min(0xffff, int(d))) for d in dist]
+    payload = REPORT.pack(VERSION, ts & 0xffffffff, *dists, en, *vals, ev)
+    return cobs_encode(payload) + b'\x00'
+
+
+def decode_events(ev):
+    return [e for i, e in enumerate(EVENTS) if ev & (1 << i)]
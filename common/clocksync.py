@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+# Online estimate of a board's clock against host time.
+#
+# Every batch read from a board gives one pair (device time of its last
+# report, host arrival time). Arrival is always late by some transport delay
+# (USB polling, batching, OS scheduling) that is never negative, so
+#
+#   skew = host - device = offset + drift * device + delay,  delay >= 0
+#
+# and the clock lies along the lower envelope of the skews. BoardClock keeps
+# the minimum skew in each `bucket` seconds of device time over a `window`,
+# takes their lower convex hull, and fits the hull edge spanning the mean
+# device time: of all lines that no point falls below, that's the one with
+# the least total distance to the points (a linear program whose optimum
+# lies on the hull). Late reads only ever raise points above the line, so
+# however bursty the transport, they don't pull the estimate; only the
+# fastest reads in each bucket count.
+#
+# to_host() then maps device timestamps onto host time, which is what lets
+# reports from several boards share one timeline (mux.TimelineAligner) and
+# events be played on the device clock (jitterbuf.py).
+
+from collections import deque
+
+import numpy as np
+
+TS_WRAP = 2**32
+
+
+def lower_hull(x, y):
+    # indices of the lower convex hull of points sorted by x
+    hull = []
+    for i in range(len(x)):
+        while len(hull) >= 2:
+            a, b = hull[-2], hull[-1]
+            if (y[b] - y[a]) * (x[i] - x[a]) >= (y[i] - y[a]) * (x[b] - x[a]):
+                hull.pop()
+            else:
+                break
+        hull.append(i)
+    return hull
+
+
+class BoardClock:
+
+    def __init__(self, bucket=0.25, window=30.):
+        self.bucket = bucket
+        # (device time, skew) of each finished bucket's fastest read
+        self.points = deque(maxlen=max(int(window / bucket), 2))
+        self.current = None
+        self.ts_last = None
+        self.device = 0.
+        # skew(d) = c + m * (d - xm)
+        self.c = self.m = self.xm = 0.
+
+    def update(self, ts, host):
+        # ts: a batch's device timestamps (us), host: its arrival time (s);
+        # returns the device time (s, unwrapped) of each report
+        ts = np.asarray(ts, dtype=np.int64)
+        if self.ts_last is None:
+            self.ts_last = int(ts[0])
+        device = self.device + np.cumsum(np.diff(ts, prepend=self.ts_last) % TS_WRAP) * 1e-6
+        self.ts_last = int(ts[-1])
+        self.device = float(device[-1])
+        # every report of a batch arrived together, so only the last one
+        # says anything about the transport
+        d, s = self.device, host - self.device
+        k = int(d // self.bucket)
+        if self.current is None or k != self.current[0]:
+            if self.current is not None:
+                self.points.append(self.current[1:])
+            self.current = [k, d, s]
+            self._fit()
+        elif s < self.current[2]:
+            self.current[1:] = d, s
+            self._fit()
+        return device
+
+    def _fit(self):
+        pts = np.array(list(self.points) + [self.current[1:]])
+        x, y = pts[:,0], pts[:,1]
+        self.xm = float(x.mean())
+        if len(x) < 2:
+            self.c, self.m = float(y[0]), 0.
+            return
+        hull = lower_hull(x, y)
+        # the hull edge over the mean device time
+        for a, b in zip(hull[:-1], hull[1:]):
+            if x[b] >= self.xm:
+                break
+        self.m = float((y[b] - y[a]) / (x[b] - x[a]))
+        self.c = float(y[a] + self.m * (self.xm - x[a]))
+
+    @property
+    def offset(self):
+        # host - device (s) now, transport delay excluded
+        return self.c + self.m * (self.device - self.xm)
+
+    @property
+    def drift(self):
+        # device clock rate error, as a fraction (1e-6 = 1 ppm slow)
+        return self.m
+
+    def host_time(self, device):
+        # host time of unwrapped device times (s)
+        device = np.asarray(device, dtype=np.float64)
+        return device + self.c + self.m * (device - self.xm)
+
+    def to_host(self, ts):
+        # host time of reports with timestamps ts, no later than the last
+        # update
+        back = (self.ts_last - np.asarray(ts, dtype=np.int64)) % TS_WRAP
+        return self.host_time(self.device - back * 1e-6)
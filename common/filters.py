@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+# Smoothing and velocity estimation for distance streams.
+#
+# AlphaBetaFilter tracks position and velocity for every channel at once:
+# one update() is a handful of array operations over all channels, however
+# many boards they come from. Each channel carries its own timestamp, so
+# channels from boards with different clocks (or that didn't report this
+# time) can share one filter:
+#
+#   dt == 0          channel not updated (same report as last time)
+#   dt < 0 or > gap  channel restarts from the new sample (timestamp wrap,
+#                    board reset, long silence)
+#
+# alpha sets how far the position follows each new sample and beta how far
+# the velocity does; higher is more responsive and noisier. predict() gives
+# the position `horizon` seconds ahead, to make up for some of the latency.
+
+import numpy as np
+
+
+class AlphaBetaFilter:
+
+    def __init__(self, nchan, alpha=0.6, beta=0.2, horizon=0.01, gap=0.5):
+        self.alpha = alpha
+        self.beta = beta
+        self.horizon = horizon
+        self.gap = gap
+        self.x = np.zeros(nchan)
+        self.v = np.zeros(nchan)
+        self.t = np.full(nchan, np.nan)
+
+    def update(self, z, t):
+        # z: (nchan,) samples, t: scalar or (nchan,) times in seconds;
+        # returns (position, velocity, predicted position)
+        z = np.asarray(z, dtype=np.float64)
+        t = np.broadcast_to(np.asarray(t, dtype=np.float64), z.shape)
+        dt = t - self.t
+        restart = ~((dt >= 0) & (dt <= self.gap))  # also true for the first sample (nan)
+        step = dt > 0
+        step &= ~restart
+        dt = np.where(step, dt, 1.)
+        predicted = self.x + self.v * dt
+        r = z - predicted
+        x = np.where(step, predicted + self.alpha * r, self.x)
+        v = np.where(step, self.v + (self.beta / dt) * r, self.v)
+        self.x = np.where(restart, z, x)
+        self.v = np.where(restart, 0., v)
+        self.t = np.where(restart | step, t, self.t)
+        return self.x, self.v, self.predict()
+
+    def predict(self, horizon=None):
+        return self.x + self.v * (self.horizon if horizon is None else horizon)
+
+    def reset(self):
+        self.x[:] = 0
+        self.v[:] = 0
+        self.t[:] = np.nan
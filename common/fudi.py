@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+# Output sinks for messages to Pd.
+#
+# FudiSink talks FUDI straight to a [netreceive] (TCP by default, as in all
+# the main.pd patches here), so there's no pipe and no pdsend process in the
+# way. All messages for one frame go out in a single write. If Pd isn't up
+# yet or goes away, messages are dropped rather than queued (a late note is
+# worse than a missing one) and the connection is retried at most once every
+# RETRY_INTERVAL seconds.
+#
+# StdoutSink keeps the old `python3 -u script.py | pdsend 8000` setup working.
+#
+# Messages are strings like 'bs 1 2 3;', with or without the trailing ';'.
+
+import socket
+import sys
+import time
+
+RETRY_INTERVAL = 1.
+
+
+def _encode(messages):
+    return ''.join((m if m.endswith(';') else m + ';') + '\n' for m in messages if m)
+
+
+class StdoutSink:
+
+    def send(self, messages):
+        if messages:
+            sys.stdout.write(_encode(messages))
+            sys.stdout.flush()
+
+    def close(self):
+        pass
+
+
+class FudiSink:
+
+    def __init__(self, host='localhost', port=8000, udp=False):
+        self.addr = (host, port)
+        self.udp = udp
+        self.sock = None
+        self.last_attempt = -RETRY_INTERVAL
+        self.dropped = 0
+        self.connect()
+
+    def connect(self):
+        self.last_attempt = time.monotonic()
+        try:
+            if self.udp:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.connect(self.addr)
+            else:
+                sock = socket.create_connection(self.addr, timeout=RETRY_INTERVAL)
+                sock.settimeout(None)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            self.sock = None
+            return False
+        self.sock = sock
+        return True
+
+    def send(self, messages):
+        if not messages:
+            return
+        if self.sock is None:
+            if time.monotonic() - self.last_attempt < RETRY_INTERVAL or not self.connect():
+                self.dropped += len(messages)
+                return
+        try:
+            self.sock.sendall(_encode(messages).encode())
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            self.dropped += len(messages)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def open_sink(spec):
+    # '-' for stdout, osc://[host:]port[/address] for OSC (osc.py),
+    # metrics[:seconds] for message rates on stderr (pipeline.MetricsSink),
+    # otherwise [tcp://|udp://][host:]port
+    if spec in (None, '', '-'):
+        return StdoutSink()
+    if spec == 'metrics' or spec.startswith('metrics:'):
+        from pipeline import MetricsSink
+        return MetricsSink(float(spec.split(':', 1)[1]) if ':' in spec else 1.)
+    if spec.startswith('osc://'):
+        from osc import open_osc
+        return open_osc(spec[len('osc://'):])
+    udp = spec.startswith('udp://')
+    if '://' in spec:
+        spec = spec.split('://', 1)[1]
+    host, _, port = spec.rpartition(':')
+    return FudiSink(host or 'localhost', int(port), udp=udp)
+
+
+def add_sink_argument(parser):
+    parser.add_argument('--out', default='-', metavar='SINK',
+                            help="'-' to print for pdsend (default), [tcp://|udp://][host:]port "
+                                    "to send FUDI straight to a netreceive, e.g. --out 8000, "
+                                    "osc://[host:]port[/address] for OSC, or metrics[:seconds] "
+                                    "to print message rates instead")
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+# Vectorized gesture detection shared by pluck, multipluck and swipe, and by
+# the offline threshold sweep (sweep.py).
+#
+# Detectors take a whole batch of frames at once, as an (nframes, nchan)
+# array of distances, with the channels of any number of boards side by
+# side. Their state lives in NumPy arrays and the work is done with array
+# operations across frames and channels; the only Python loop is over the
+# (rare) swipe edge candidates, which have to be replayed in order.
+#
+# Events come back as an EVENT structured array ordered the way the original
+# scripts printed them: by frame, then by channel.
+#
+# The hysteresis in pluck.py and multipluck.py collapses to "engaged means
+# inside the band": a channel engages on the first frame inside [lo, hi)
+# and releases on the first frame outside it. BandDetector computes exactly
+# that, so the scripts' output is reproduced frame for frame.
+
+import numpy as np
+
+ENGAGE, RELEASE, SWIPE_LEFT, SWIPE_RIGHT, FAKEOUT_LEFT, FAKEOUT_RIGHT, HIT = range(7)
+
+EVENT = np.dtype([('t', np.float64), ('frame', np.int64), ('chan', np.int32),
+                    ('kind', np.int8), ('value', np.float64)])
+
+
+def _frame_times(t, n, first):
+    if t is None:
+        return np.arange(first, first + n, dtype=np.float64)
+    return np.asarray(t, dtype=np.float64)
+
+
+class BandDetector:
+
+    # bands: [(lo, hi, offset), ...]; band b of input channel i is output
+    # channel b*nchan + i, engaged while lo <= d < hi, and its ENGAGE
+    # events carry d - offset
+
+    def __init__(self, nchan, bands):
+        self.nchan = nchan
+        self.lo = np.array([b[0] for b in bands], dtype=np.float64)
+        self.hi = np.array([b[1] for b in bands], dtype=np.float64)
+        self.offset = np.array([b[2] for b in bands], dtype=np.float64)
+        self.state = np.zeros((nchan, len(bands)), dtype=bool)
+        self.nframes = 0
+
+    @property
+    def engaged(self):
+        # (nchan * nbands,) in output channel order
+        return self.state.T.ravel()
+
+    def states(self, dist):
+        # (n, nchan, nbands) engaged state after each frame, and the state
+        # before the batch stacked in front
+        d = np.asarray(dist, dtype=np.float64)[:,:,None]
+        state = (d >= self.lo) & (d < self.hi)
+        prev = np.concatenate((self.state[None], state[:-1]))
+        return state, prev
+
+    def process(self, dist, t=None):
+        dist = np.asarray(dist)
+        n = dist.shape[0]
+        if n == 0:
+            return np.zeros(0, dtype=EVENT)
+        state, prev = self.states(dist)
+        edges = state != prev
+        frame, chan, band = np.nonzero(edges)
+        events = np.empty(frame.size, dtype=EVENT)
+        events['t'] = _frame_times(t, n, self.nframes)[frame]
+        events['frame'] = frame + self.nframes
+        events['chan'] = band * self.nchan + chan
+        rising = state[frame, chan, band]
+        events['kind'] = np.where(rising, ENGAGE, RELEASE)
+        events['value'] = dist[frame, chan] - np.where(rising, self.offset[band], 0.)
+        self.state = state[-1].copy()
+        self.nframes += n
+        return events
+
+
+class ThresholdDetector(BandDetector):
+
+    # engaged while d < thresh (pluck.py)
+
+    def __init__(self, nchan, thresh):
+        super().__init__(nchan, [(-np.inf, thresh, 0)])
+
+
+class HitDetector:
+
+    # triangulation.ino's hit logic on the host: a HIT fires on release when
+    # the channel was engaged for more than min_dt and less than max_dt
+    # seconds; its value is the engaged time. Needs real timestamps.
+
+    def __init__(self, nchan, thresh, min_dt=0.03, max_dt=0.15):
+        self.engagement = ThresholdDetector(nchan, thresh)
+        self.min_dt = min_dt
+        self.max_dt = max_dt
+        self.t_engage = np.full(nchan, np.nan)
+
+    def process(self, dist, t):
+        events = self.engagement.process(dist, t)
+        if not events.size:
+            return events
+        # group each channel's edges together, keeping time order
+        e = events[np.argsort(events['chan'], kind='stable')]
+        chan = e['chan']
+        engage = e['kind'] == ENGAGE
+        start = np.where(engage, e['t'], np.nan)
+        same = np.concatenate(([False], chan[1:] == chan[:-1]))
+        prev = np.where(same, np.concatenate(([np.nan], start[:-1])), self.t_engage[chan])
+        dt = e['t'] - prev
+        hit = ~engage & (dt > self.min_dt) & (dt < self.max_dt)
+        # carry the last engage time of each channel into the next batch
+        last = np.concatenate((~same[1:], [True]))
+        self.t_engage[chan[last]] = np.where(engage[last], start[last], np.nan)
+        hits = e[hit]
+        hits['kind'] = HIT
+        hits['value'] = dt[hit]
+        return hits[np.lexsort((hits['chan'], hits['frame']))]
+
+
+class SwipeDetector:
+
+    # swipe.py's two-channel swipe logic, for any number of channel pairs.
+    # For a pair (a, b): a engaging while b is engaged primes a right swipe,
+    # b engaging while a is engaged primes a left swipe; the swipe completes
+    # (or is a fakeout) when the first hand to arrive leaves while the other
+    # is still there. Channels are visited in index order within a frame, as
+    # in swipe.py, so a channel sees the current state of lower channels and
+    # the previous state of higher ones.
+
+    def __init__(self, nchan, thresh, pairs):
+        self.engagement = ThresholdDetector(nchan, thresh)
+        self.pairs = list(pairs)
+        self.prime_left = np.zeros(len(self.pairs), dtype=bool)
+        self.prime_right = np.zeros(len(self.pairs), dtype=bool)
+
+    def process(self, dist, t=None):
+        dist = np.asarray(dist)
+        n = dist.shape[0]
+        if n == 0:
+            return np.zeros(0, dtype=EVENT)
+        first = self.engagement.nframes
+        times = _frame_times(t, n, first)
+        state, prev = self.engagement.states(dist)
+        state, prev = state[:,:,0], prev[:,:,0]
+        self.engagement.process(dist, times)
+
+        found = []
+        for p, (a, b) in enumerate(self.pairs):
+            # what each channel sees of the other one when it is visited
+            b_seen_by_a = state[:,b] if b < a else prev[:,b]
+            a_seen_by_b = state[:,a] if a < b else prev[:,a]
+            cand = np.stack(((state[:,a] != prev[:,a]) & b_seen_by_a,
+                                (state[:,b] != prev[:,b]) & a_seen_by_b), axis=1)
+            frames, which = np.nonzero(cand)
+            if not frames.size:
+                continue
+            order = np.lexsort((np.where(which == 0, a, b), frames))
+            pl, pr = self.prime_left[p], self.prime_right[p]
+            for f, w in zip(frames[order].tolist(), which[order].tolist()):
+                ch = a if w == 0 else b
+                if state[f, ch]:
+                    if w == 0:
+                        pr = True
+                    else:
+                        pl = True
+                elif w == 0:
+                    if pl:
+                        found.append((f, ch, p, SWIPE_LEFT))
+                        pl = False
+                    elif pr:
+                        found.append((f, ch, p, FAKEOUT_RIGHT))
+                        pr = False
+                else:
+                    if pr:
+                        found.append((f, ch, p, SWIPE_RIGHT))
+                        pr = False
+                    elif pl:
+                        found.append((f, ch, p, FAKEOUT_LEFT))
+                        pl = False
+            self.prime_left[p], self.prime_right[p] = pl, pr
+
+        found.sort()
+        events = np.empty(len(found), dtype=EVENT)
+        if found:
+            f, ch, p, kind = (np.array(x) for x in zip(*found))
+            events['t'] = times[f]
+            events['frame'] = f + first
+            events['chan'] = p
+            events['kind'] = kind
+            events['value'] = 0.
+        return events
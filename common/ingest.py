@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+# Buffered report ingest shared by the serial bridges.
+#
+# Instead of one quadrant.readline() per report, FrameReader drains everything
+# the driver has buffered (in_waiting) in a single read, splits complete
+# frames out of a reusable bytearray, and hands back the parsed frames as a
+# batch. Partial frames stay in the buffer until the rest arrives.
+#
+# Text reports (JSON or "d d d d") are newline-delimited; binary reports (see
+# binreport.py) are COBS-encoded and zero-delimited, and come out of the
+# reader already COBS-decoded. With delimiter=None the framing is detected
+# from the first complete frame that arrives, and detected again if frames
+# keep failing to frame under it.
+#
+# With parse_batch (e.g. ReportDecoder.decode_batch) the whole batch of lines
+# is parsed in one call instead, and batches come back as FRAME arrays.
+
+import threading
+import time
+
+import numpy as np
+
+from binreport import cobs_decode
+from report import FRAME
+
+# bad frames in a row before a detected framing is given up on
+REDETECT = 8
+# printable text, with the \r of \r\n line ends and tabs
+_TEXT = bytes(range(0x20, 0x7f)) + b'\r\t'
+
+
+def parse_raw(line):
+    # "d d d d" distance lines from serial2stdout-style firmware
+    try:
+        data = tuple(map(int, line.split()))
+    except ValueError:
+        return None
+    if len(data) != 4:
+        return None
+    return data
+
+
+class FrameReader:
+
+    def __init__(self, port, parse=None, on_error=None, delimiter=None, parse_batch=None):
+        self.port = port
+        self.parse = parse
+        self.parse_batch = parse_batch
+        self.on_error = on_error
+        self.delimiter = delimiter
+        self.detecting = delimiter is None
+        self.buf = bytearray()
+        self.nframes = 0
+        self.nerrors = 0
+        # frames in a row that failed to frame, see REDETECT
+        self.nbad = 0
+        self.t_ready = self.t_read = 0.
+        # host (time.monotonic()) arrival of the last batch, taken before
+        # it's decoded
+        self.t_host = 0.
+
+    def read_batch(self, block=True):
+        # returns a (possibly empty) batch of parsed frames
+        n = self.port.in_waiting
+        if n:
+            self.t_ready = time.perf_counter()
+            self.t_host = time.monotonic()
+            chunk = self.port.read(n)
+        elif block:
+            # sleep in the driver until something arrives, then take the rest
+            chunk = self.port.read(1)
+            self.t_ready = time.perf_counter()
+            self.t_host = time.monotonic()
+            n = self.port.in_waiting
+            if n:
+                chunk += self.port.read(n)
+        else:
+            return []
+        # stage times for latency.py, two clock reads per batch
+        self.t_read = time.perf_counter()
+        return self.feed(chunk)
+
+    @property
+    def binary(self):
+        return self.delimiter == b'\x00'
+
+    def feed(self, chunk):
+        buf = self.buf
+        buf += chunk
+        lines = []
+        if self.delimiter is not None or self._detect():
+            end = buf.rfind(self.delimiter)
+            if end >= 0:
+                data = bytes(buf[:end])
+                del buf[:end+1]
+                lines = data.split(self.delimiter)
+                if self.binary:
+                    lines = self._cobs_decode(lines)
+                elif self.detecting and b'\x00' in data:
+                    # binary frames split on newlines
+                    self._framed(sum(b'\x00' in line for line in lines), len(lines))
+            elif self.detecting and len(buf) > 4096:
+                # no delimiter in all that: not this framing after all
+                self.delimiter = None
+        if self.parse_batch is not None:
+            batch = self.parse_batch([line for line in lines if line.strip()])
+            self.nframes += len(batch)
+            return batch
+        parse = self.parse
+        if parse is None:
+            # caller decodes the raw lines itself
+            batch = [line for line in lines if line.strip()]
+            self.nframes += len(batch)
+            return batch
+        batch = []
+        for line in lines:
+            if not line.strip():
+                continue
+            frame = parse(line)
+            if frame is None:
+                self.nerrors += 1
+                if self.on_error is not None:
+                    self.on_error(line)
+            else:
+                batch.append(frame)
+        self.nframes += len(batch)
+        return batch
+
+    def _detect(self):
+        # decides on the first complete frame, the data between two
+        # delimiters, never on a partial one: COBS frames never contain
+        # anything but their delimiter, and text never contains a zero byte
+        buf = self.buf
+        start = buf.find(b'\x00')
+        while start >= 0:
+            end = buf.find(b'\x00', start + 1)
+            if end < 0:
+                break
+            if end > start + 1:
+                try:
+                    cobs_decode(bytes(buf[start+1:end]))
+                except ValueError:
+                    pass
+                else:
+                    self.delimiter = b'\x00'
+                    return True
+            start = end
+        start = buf.find(b'\n')
+        while start >= 0:
+            end = buf.find(b'\n', start + 1)
+            if end < 0:
+                break
+            line = bytes(buf[start+1:end])
+            if line.strip() and not line.translate(None, _TEXT):
+                self.delimiter = b'\n'
+                return True
+            start = end
+        if len(buf) > 4096:
+            del buf[:]
+        return False
+
+    def _framed(self, nbad, n):
+        # a detected framing whose every frame fails REDETECT times in a row
+        # was detected on noise, or the board switched formats
+        if not n:
+            return
+        self.nbad = self.nbad + nbad if nbad == n else 0
+        if self.nbad >= REDETECT:
+            self.delimiter = None
+            self.nbad = 0
+
+    def _cobs_decode(self, frames):
+        decoded = []
+        nbad = 0
+        for frame in frames:
+            if not frame:
+                continue
+            try:
+                decoded.append(cobs_decode(frame))
+            except ValueError:
+                nbad += 1
+                self.nerrors += 1
+                if self.on_error is not None:
+                    self.on_error(frame)
+        if self.detecting:
+            self._framed(nbad, len(decoded) + nbad)
+        return decoded
+
+
+class ReaderThread(threading.Thread):
+
+    # Runs a FrameReader on its own thread so a slow consumer (a GUI repaint)
+    # never stalls the port. The reader must produce FRAME arrays
+    # (parse_batch); each batch's host column is set to the host arrival
+    # time of the read it came in, and drain() returns them as one array.
+    # Frames collect in a buffer bounded to `capacity`; when the consumer
+    # falls that far behind the oldest are discarded and counted in
+    # `overflows`.
+
+    def __init__(self, reader, capacity=65536):
+        super().__init__(daemon=True)
+        self.reader = reader
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.pending = []
+        self.npending = 0
+        self.overflows = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            batch = self.reader.read_batch()
+            if not len(batch):
+                continue
+            batch['host'] = self.reader.t_host
+            with self.lock:
+                self.pending.append(batch)
+                self.npending += len(batch)
+                self._trim()
+
+    def _trim(self):
+        pending = self.pending
+        while self.npending - len(pending[0]) >= self.capacity:
+            self.npending -= len(pending[0])
+            self.overflows += len(pending.pop(0))
+        excess = self.npending - self.capacity
+        if excess > 0:
+            pending[0] = pending[0][excess:]
+            self.npending -= excess
+            self.overflows += excess
+
+    def drain(self):
+        # everything received since the last drain, oldest first
+        with self.lock:
+            batches = self.pending
+            self.pending = []
+            self.npending = 0
+        return np.concatenate(batches) if batches else np.zeros(0, dtype=FRAME)
+
+    def stop(self):
+        # the port needs a read timeout for this to return promptly
+        self.running = False
+        self.join()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# Report timing analysis: how regularly the firmware produces reports, and
+# how much the USB/OS path adds on top.
+#
+# Device intervals come from the report `ts` (us, wrapping at 2**32), host
+# intervals from when the reads returned. Skew is host arrival time minus
+# device time since the first report; its slope is the clock drift and its
+# excursions above the recent minimum are the transport delay, which is
+# what separates host-side jitter from firmware jitter. Everything is kept
+# in quantile sketches, so memory stays fixed however long it runs.
+
+import numpy as np
+
+from rollstats import RollingStats
+from sketch import QuantileSketch
+
+TS_WRAP = 2**32
+
+
+class JitterAnalyzer:
+
+    def __init__(self, skew_window=2000):
+        self.device = QuantileSketch()
+        self.host = QuantileSketch()
+        self.delay = QuantileSketch()
+        self.skew_floor = RollingStats(1, skew_window)
+        self.ts_last = None
+        self.host_last = None
+        self.host0 = None
+        self.device_time = 0.
+        self.nreports = 0
+
+    def update(self, ts, host):
+        # ts: device timestamps (us), host: arrival times (s), oldest first;
+        # returns (device intervals in us, skew in us) for the new reports
+        ts = np.asarray(ts, dtype=np.int64)
+        host = np.asarray(host, dtype=np.float64)
+        if not ts.size:
+            return np.zeros(0), np.zeros(0)
+        if self.ts_last is None:
+            self.ts_last = ts[0]
+            self.host_last = host[0]
+            self.host0 = host[0]
+        dt_device = np.diff(ts, prepend=self.ts_last) % TS_WRAP
+        dt_host = np.diff(host, prepend=self.host_last) * 1e6
+        if self.nreports == 0:
+            dt_device, dt_host = dt_device[1:], dt_host[1:]
+        self.device.add(dt_device)
+        self.host.add(dt_host)
+
+        device_time = self.device_time + np.cumsum(np.diff(ts, prepend=self.ts_last) % TS_WRAP)
+        skew = (host - self.host0) * 1e6 - device_time
+        self.skew_floor.extend(skew.reshape(1,-1))
+        self.delay.add(skew - self.skew_floor.min()[0])
+
+        self.device_time = float(device_time[-1])
+        self.ts_last = ts[-1]
+        self.host_last = host[-1]
+        self.nreports += ts.size
+        return dt_device, skew
+
+    def summary(self, qs=(0.5, 0.99, 0.999)):
+        # {'device': [...], 'host': [...], 'delay': [...]} quantiles in us
+        return {name: sketch.quantiles(qs) for name, sketch in
+                    (('device', self.device), ('host', self.host), ('delay', self.delay))}
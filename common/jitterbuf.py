@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+# Jitter buffer: play events on the device's clock instead of on arrival.
+#
+# A message sent the moment its report is read carries all the USB and OS
+# scheduling jitter of the read. Stamped with the report's device `ts`
+# instead, it can go out at
+#
+#   device time + offset + latency
+#
+# where offset maps the board's clock onto host time: the lower envelope of
+# host arrival minus device time, drift included (clocksync.BoardClock),
+# i.e. the fastest the transport has been. Every event then has the same
+# delay behind its report, so rhythm survives, at the price of a constant
+# `latency`. Reads delayed by more than the latency come out late, as soon as
+# they arrive, and are counted.
+#
+# With a FUDI sink (fudi.py) messages are held and released on schedule by
+# a thread. With an OscSink (osc.py) they're sent at once in bundles
+# timetagged with their due time, and the receiver does the waiting.
+#
+# The detect stage stamps its messages; JitterBuffer is then the sink:
+#
+#   jitter = JitterBuffer(open_sink(args.out), args.latency / 1000)
+#   events = detector.process(batch['dist'], batch['ts'])
+#   out += jitter.stamp(board, t, batch['ts'], events['t'], messages)
+#
+# Raw "d d d d" reports have no device time (ts -1); their messages go out
+# immediately and are counted as untimed.
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+from clocksync import BoardClock
+from sketch import QuantileSketch
+
+
+class JitterBuffer:
+
+    def __init__(self, sink, latency=0.01, window=30., interval=10., out=sys.stderr):
+        self.sink = sink
+        self.latency = latency
+        self.window = window
+        self.osc = hasattr(sink, 'send_bundle')
+        self.clocks = {}
+        self.queue = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+        self.interval = interval
+        self.out = out
+        self.t_report = time.monotonic()
+        # stats: lateness (ms) of late messages, and how far each read
+        # arrived behind the envelope (ms), i.e. the jitter taken out
+        self.scheduled = self.late = self.untimed = 0
+        self.lateness = QuantileSketch(lo=1e-3, hi=1e4)
+        self.delay = QuantileSketch(lo=1e-3, hi=1e4)
+        if not self.osc:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stamp(self, board, host, ts, event_ts, messages):
+        # board's batch with device timestamps ts arrived at host; messages
+        # belong to the reports at event_ts. Returns [(due, message), ...]
+        # for send(), due None for "now"
+        if not len(ts) or ts[-1] < 0:
+            return [(None, m) for m in messages]
+        clock = self.clocks.get(board)
+        if clock is None:
+            clock = self.clocks[board] = BoardClock(window=self.window)
+        clock.update(ts, host)
+        self.delay.add((host - clock.to_host(ts[-1:])[0]) * 1e3)
+        if not messages:
+            return []
+        due = clock.to_host(event_ts) + self.latency
+        return list(zip(due.tolist(), messages))
+
+    def send(self, timed):
+        now = time.monotonic()
+        ready = []
+        later = []
+        for due, message in timed:
+            if due is None:
+                self.untimed += 1
+                ready.append(message)
+            elif due <= now:
+                self.late += 1
+                self.lateness.add_one((now - due) * 1e3)
+                ready.append(message)
+            else:
+                self.scheduled += 1
+                later.append((due, message))
+        if self.osc:
+            self._send_osc(now, ready, later)
+        else:
+            with self.cond:
+                for message in ready:
+                    heapq.heappush(self.queue, (now, next(self.seq), message))
+                for due, message in later:
+                    heapq.heappush(self.queue, (due, next(self.seq), message))
+                self.cond.notify()
+        if self.interval and now - self.t_report >= self.interval:
+            self.report()
+            self.t_report = now
+
+    def _send_osc(self, now, ready, later):
+        if ready:
+            self.sink.send_bundle(None, ready)
+        # one bundle per due time, timetagged on the wall clock
+        wall = time.time() - now
+        for due, group in itertools.groupby(later, key=lambda x: x[0]):
+            self.sink.send_bundle(due + wall, [m for _, m in group])
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.cond.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if not self.running:
+                    return
+                now = time.monotonic()
+                messages = []
+                while self.queue and self.queue[0][0] <= now:
+                    messages.append(heapq.heappop(self.queue)[2])
+            self.sink.send(messages)
+
+    def stats(self):
+        return {'offset': {board: clock.offset for board, clock in self.clocks.items()},
+                'drift_ppm': {board: clock.drift * 1e6 for board, clock in self.clocks.items()},
+                'scheduled': self.scheduled, 'late': self.late, 'untimed': self.untimed,
+                'lateness_ms': self.lateness.quantiles((0.5, 0.99)) if self.late else None,
+                'delay_ms': self.delay.quantiles((0.5, 0.99, 0.999)) if self.delay.total else None}
+
+    def report(self):
+        s = self.stats()
+        line = 'jitter buffer: %d on time, %d late, %d untimed' % (s['scheduled'], s['late'], s['untimed'])
+        if s['lateness_ms']:
+            line += ' (late by %.2f/%.2f ms p50/p99)' % tuple(s['lateness_ms'])
+        if s['delay_ms']:
+            line += ', read delay %.2f/%.2f/%.2f ms p50/p99/p99.9' % tuple(s['delay_ms'])
+        line += ', offset ' + ' '.join('%d:%.3f s (%+.1f ppm)' % (b, o, s['drift_ppm'][b])
+                                        for b, o in sorted(s['offset'].items()))
+        self.out.write(line + '\n')
+        self.out.flush()
+
+    def close(self):
+        if not self.osc:
+            with self.cond:
+                self.running = False
+                self.cond.notify()
+            self.thread.join()
+            # whatever was still waiting goes out now rather than never
+            self.sink.send([m for _, _, m in sorted(self.queue)])
+        self.report()
+        self.sink.close()
+
+
+def add_latency_argument(parser):
+    parser.add_argument('--latency', type=float, metavar='MS',
+                            help='play events on the board clock, this many ms behind it '
+                                    '(JSON or binary reports; see jitterbuf.py)')
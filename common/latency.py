@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+# Optional per-stage latency timing for the bridge scripts.
+#
+# Off unless QUADRANT_TIMING is set in the environment, in which case
+# `timing` is a StageTimer; otherwise it is None and every hook in the
+# scripts is a single `if timing:` test. Each batch is timed from the moment
+# its first byte was readable:
+#
+#   read    first byte ready -> bulk read returned
+#   parse   framing and parsing of the batch
+#   filter  smoothing, where the app has a filter stage
+#   detect  gesture/state logic
+#   write   output written
+#   total   first byte ready -> output written
+#
+# Histograms are dumped to stderr on SIGUSR1 and at exit. If QUADRANT_METRICS
+# is set to a port number they are also served as plain text over HTTP:
+#
+#   QUADRANT_TIMING=1 python3 -u pluck.py | pdsend 8000
+#   kill -USR1 <pid>
+#   QUADRANT_METRICS=9100 python3 -u pluck.py | pdsend 8000
+#   curl localhost:9100
+
+import atexit
+import http.server
+import os
+import signal
+import sys
+import threading
+import time
+
+from sketch import QuantileSketch
+
+STAGES = ('read', 'parse', 'filter', 'detect', 'write', 'total')
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class StageTimer:
+
+    def __init__(self, stages=STAGES):
+        # times in us; 0.1 us .. 10 s
+        self.sketches = {name: QuantileSketch(lo=0.1, hi=1e7) for name in stages}
+        # reentrant: the SIGUSR1 dump can land while record() holds it
+        self.lock = threading.RLock()
+        self.origin = 0.
+        self.last = 0.
+
+    def reader(self, reader):
+        # start timing a batch from the FrameReader that produced it; the
+        # next stage() includes the reader's own framing and parsing
+        self.origin = reader.t_ready
+        self.record('read', reader.t_read - reader.t_ready)
+        self.last = reader.t_read
+
+    def start(self):
+        self.origin = self.last = time.perf_counter()
+
+    def stage(self, name):
+        now = time.perf_counter()
+        self.record(name, now - self.last)
+        self.last = now
+
+    def end(self):
+        self.record('total', time.perf_counter() - self.origin)
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.sketches:
+                self.sketches[name] = QuantileSketch(lo=0.1, hi=1e7)
+            self.sketches[name].add_one(seconds * 1e6)
+
+    def report(self):
+        lines = ['%-8s %9s' % ('stage', 'count') +
+                    ''.join('%10s' % ('p%g' % (q * 100)) for q in QUANTILES) + '%10s  (us)' % 'max']
+        with self.lock:
+            for name, sketch in self.sketches.items():
+                if not sketch.total:
+                    continue
+                lines.append('%-8s %9d' % (name, sketch.total) +
+                                ''.join('%10.1f' % v for v in sketch.quantiles(QUANTILES)) +
+                                '%10.1f' % sketch.max)
+        return '\n'.join(lines) + '\n'
+
+    def metrics(self):
+        lines = []
+        with self.lock:
+            for name, sketch in self.sketches.items():
+                if not sketch.total:
+                    continue
+                for q, v in zip(QUANTILES, sketch.quantiles(QUANTILES)):
+                    lines.append('quadrant_latency_us{stage="%s",quantile="%g"} %.1f' % (name, q, v))
+                lines.append('quadrant_latency_us_count{stage="%s"} %d' % (name, sketch.total))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, *args):
+        sys.stderr.write(self.report())
+        sys.stderr.flush()
+
+    def serve(self, port):
+        timer = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = timer.metrics().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('', port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _from_env():
+    if not (os.environ.get('QUADRANT_TIMING') or os.environ.get('QUADRANT_METRICS')):
+        return None
+    timer = StageTimer()
+    signal.signal(signal.SIGUSR1, timer.dump)
+    # make sure a plain kill still gets the exit dump
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    atexit.register(timer.dump)
+    if os.environ.get('QUADRANT_METRICS'):
+        timer.serve(int(os.environ['QUADRANT_METRICS']))
+    return timer
+
+
+timing = _from_env()
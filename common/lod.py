@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+# Min/max level-of-detail pyramid over a fixed-length history.
+#
+# Level 0 is the raw history (a RingBuffer). Each level above holds the min
+# and max of `factor` consecutive buckets of the level below, so level k
+# summarizes factor**k samples per bucket. Levels are updated as samples
+# arrive: only the newly completed buckets are reduced, with the leftover
+# carried to the next extend().
+#
+# segment() picks the coarsest level that still gives about one bucket per
+# pixel of the visible range, and returns it as a min/max zigzag, so a plot
+# draws at most ~2 points per pixel however long the history is. Peaks
+# survive decimation, unlike plain subsampling.
+#
+# x is in samples from the start of the history window, as with
+# plot(view()[i]): the newest sample is at length - 1.
+
+import numpy as np
+
+from ringbuf import RingBuffer
+
+
+class MinMaxPyramid:
+
+    def __init__(self, nchan, length, factor=4, min_buckets=64, dtype=np.float32):
+        self.nchan = nchan
+        self.length = length
+        self.factor = factor
+        self.raw = RingBuffer(nchan, length, dtype)
+        self.scales = []
+        self.mins = []
+        self.maxs = []
+        # leftover (not yet a whole bucket) input to each level
+        self.carry_min = []
+        self.carry_max = []
+        scale = factor
+        while length // scale >= min_buckets:
+            nbuckets = length // scale + 2
+            self.scales.append(scale)
+            self.mins.append(RingBuffer(nchan, nbuckets, dtype))
+            self.maxs.append(RingBuffer(nchan, nbuckets, dtype))
+            self.carry_min.append(np.zeros((nchan, 0), dtype=dtype))
+            self.carry_max.append(np.zeros((nchan, 0), dtype=dtype))
+            scale *= factor
+
+    @property
+    def count(self):
+        return self.raw.count
+
+    def extend(self, block):
+        # block: (nchan, n), oldest first
+        block = np.asarray(block, dtype=self.raw.buf.dtype)
+        self.raw.extend(block)
+        lo = hi = block
+        f = self.factor
+        for k in range(len(self.scales)):
+            lo = np.concatenate((self.carry_min[k], lo), axis=1)
+            hi = np.concatenate((self.carry_max[k], hi), axis=1)
+            whole = lo.shape[1] // f * f
+            self.carry_min[k] = lo[:,whole:]
+            self.carry_max[k] = hi[:,whole:]
+            if not whole:
+                break
+            lo = lo[:,:whole].reshape(self.nchan, -1, f).min(axis=2)
+            hi = hi[:,:whole].reshape(self.nchan, -1, f).max(axis=2)
+            self.mins[k].extend(lo)
+            self.maxs[k].extend(hi)
+
+    def append(self, sample):
+        self.extend(np.asarray(sample).reshape(self.nchan, 1))
+
+    def level_for(self, span, width):
+        # index into scales of the coarsest level with at least one bucket per
+        # pixel for `span` samples on `width` pixels, -1 for the raw samples
+        level = -1
+        for k, scale in enumerate(self.scales):
+            if span / scale < width:
+                break
+            level = k
+        return level
+
+    def segment(self, x0, x1, width):
+        # (x, y) covering [x0, x1]; y is (nchan, len(x))
+        L = self.length
+        x0 = int(max(np.floor(x0), 0))
+        x1 = int(min(np.ceil(x1) + 1, L))
+        if x1 <= x0:
+            return np.zeros(0), np.zeros((self.nchan, 0))
+        level = self.level_for(x1 - x0, max(width, 1))
+        if level < 0:
+            return np.arange(x0, x1, dtype=np.float64), self.raw.view()[:,x0:x1]
+        scale = self.scales[level]
+        count = self.count
+        base = count - L
+        # buckets (absolute numbering) overlapping the range
+        b0 = max(x0 + base, 0) // scale
+        b1 = (x1 - 1 + base) // scale + 1
+        complete = count // scale
+        mins, maxs = self.mins[level], self.maxs[level]
+        first = complete - mins.length
+        b0 = max(b0, first)
+        lo = mins.view()[:,b0-first:min(b1, complete)-first]
+        hi = maxs.view()[:,b0-first:min(b1, complete)-first]
+        if b0 * scale < base and lo.shape[1]:
+            # the oldest bucket is partly out of the window
+            head = self.raw.view()[:,:(b0 + 1) * scale - base]
+            lo = np.concatenate((head.min(axis=1, keepdims=True), lo[:,1:]), axis=1)
+            hi = np.concatenate((head.max(axis=1, keepdims=True), hi[:,1:]), axis=1)
+        if b1 > complete and count % scale:
+            # the newest, still filling bucket, straight from the raw samples
+            tail = self.raw.view()[:,L-count%scale:]
+            lo = np.concatenate((lo, tail.min(axis=1, keepdims=True)), axis=1)
+            hi = np.concatenate((hi, tail.max(axis=1, keepdims=True)), axis=1)
+        n = lo.shape[1]
+        x = (np.arange(b0, b0 + n) * scale - base).astype(np.float64)
+        x = np.repeat(x, 2)
+        x[1::2] += scale - 1
+        if n:
+            x[0] = max(x[0], 0)
+        y = np.empty((self.nchan, 2 * n), dtype=lo.dtype)
+        y[:,0::2] = lo
+        y[:,1::2] = hi
+        return x, y
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+# MIDI output: message builders, sinks, and a continuous controller engine.
+#
+# ControllerEngine maps report streams (l0..l3 distance, elevation, pitch,
+# roll, arc) to 7-bit CCs, 14-bit NRPNs or pitch bend, and carries values the
+# app sets itself (program changes) under the same budget. Per batch of frames it
+# sends at most one value per controller (the newest), only when the value
+# has changed, no more than max_rate times a second per controller, and
+# within `bandwidth` bytes/s over all of them. A value held back by the rate
+# cap or the bandwidth stays pending and goes out as soon as it's allowed,
+# so the last position of a fast gesture always arrives. The default
+# bandwidth is what a 31.25 kbaud DIN link carries; a 1 kHz sensor stream
+# would otherwise flood it several times over.
+#
+# Sinks take lists of messages, each a list of bytes: MidiSink sends them to
+# an rtmidi port, RecordingSink keeps them (with their time) for tests and
+# offline checks.
+
+import sys
+import time
+
+import numpy as np
+
+from report import LIDARS, PARAMS
+
+DIN_BANDWIDTH = 31250 / 10
+BURST = 0.01
+
+
+def program_change(channel, program):
+    statusByte = (192 & 0xf0) | (channel - 1 & 0xf)
+    return [statusByte] + [program & 0x7f]
+
+
+def control_change(channel, number, value):
+    return [0xb0 | (channel - 1 & 0xf), number & 0x7f, value & 0x7f]
+
+
+def pitch_bend(channel, value):
+    # value 0..16383, 8192 centered
+    return [0xe0 | (channel - 1 & 0xf), value & 0x7f, value >> 7 & 0x7f]
+
+
+def nrpn(channel, number, value, select=True):
+    # 14-bit value; select=False leaves out the parameter number, for when
+    # it's already the one selected on that channel
+    out = [control_change(channel, 99, number >> 7), control_change(channel, 98, number)] if select else []
+    return out + [control_change(channel, 6, value >> 7), control_change(channel, 38, value)]
+
+
+class Controller:
+
+    # one stream mapped to one controller. source is one of report.LIDARS or
+    # report.PARAMS, or None for values given to ControllerEngine.set();
+    # kind is 'cc', 'nrpn', 'bend' or 'program'. [lo, hi] maps onto the
+    # controller's full range (lo > hi inverts it). With gate, values from
+    # frames where the source isn't engaged are ignored (the controller
+    # holds); distances are sent regardless by default.
+
+    def __init__(self, source, kind='cc', channel=1, number=0, lo=0., hi=1., max_rate=100., gate=None):
+        if source is None:
+            self.field, self.index = None, None
+        elif source in LIDARS:
+            self.field, self.index = 'dist', LIDARS.index(source)
+        else:
+            self.field, self.index = 'val', PARAMS.index(source)
+        self.source = source
+        self.kind = kind
+        self.channel = channel
+        self.number = number
+        self.lo = lo
+        self.hi = hi
+        self.max_rate = max_rate
+        self.gate = self.field == 'val' if gate is None else gate
+        self.top = 127 if kind in ('cc', 'program') else 16383
+
+    def value(self, frames):
+        # the newest usable value in the batch, scaled, or None
+        if self.field is None:
+            return None
+        x = frames[self.field][:,self.index]
+        if self.gate:
+            x = x[frames[self.field + '_en'][:,self.index]]
+        if not len(x):
+            return None
+        x = (float(x[-1]) - self.lo) / (self.hi - self.lo)
+        return int(round(min(max(x, 0.), 1.) * self.top))
+
+
+class ControllerEngine:
+
+    def __init__(self, controllers, bandwidth=DIN_BANDWIDTH):
+        self.controllers = controllers
+        self.bandwidth = bandwidth
+        n = len(controllers)
+        self.sent = [None] * n
+        self.pending = [None] * n
+        self.t_sent = np.full(n, -np.inf)
+        self.tokens = bandwidth * BURST if bandwidth else None
+        self.t_last = None
+        self.next = 0
+        # NRPN number currently selected on each channel
+        self.selected = {}
+        self.nbytes = 0
+        self.deferred = 0
+
+    def set(self, i, value):
+        # value (unscaled) for controller i, sent under the same rules as
+        # the streams: dropped if unchanged, the newest one wins while held
+        self.pending[i] = value if value != self.sent[i] else None
+
+    def process(self, frames, t=None):
+        # messages for a batch of FRAME records arriving at host time t
+        t = time.monotonic() if t is None else t
+        if len(frames):
+            for i, c in enumerate(self.controllers):
+                v = c.value(frames)
+                if v is not None:
+                    self.pending[i] = v if v != self.sent[i] else None
+        if self.tokens is not None and self.t_last is not None:
+            self.tokens = min(self.tokens + (t - self.t_last) * self.bandwidth,
+                                max(self.bandwidth * BURST, 12))
+        self.t_last = t
+        out = []
+        n = len(self.controllers)
+        # round robin, so a busy controller can't starve the rest
+        start = self.next
+        for k in range(n):
+            i = (start + k) % n
+            v = self.pending[i]
+            if v is None:
+                continue
+            c = self.controllers[i]
+            if t - self.t_sent[i] < 1. / c.max_rate:
+                continue
+            msgs = self.encode(c, v)
+            size = sum(map(len, msgs))
+            if self.tokens is not None:
+                if size > self.tokens:
+                    self.deferred += 1
+                    self.next = i
+                    break
+                self.tokens -= size
+            if c.kind == 'nrpn':
+                self.selected[c.channel] = c.number
+            out += msgs
+            self.nbytes += size
+            self.sent[i] = v
+            self.pending[i] = None
+            self.t_sent[i] = t
+            self.next = (i + 1) % n
+        return out
+
+    def encode(self, c, v):
+        if c.kind == 'cc':
+            return [control_change(c.channel, c.number, v)]
+        if c.kind == 'bend':
+            return [pitch_bend(c.channel, v)]
+        if c.kind == 'program':
+            return [program_change(c.channel, v)]
+        return nrpn(c.channel, c.number, v, self.selected.get(c.channel) != c.number)
+
+
+class MidiSink:
+
+    # an rtmidi output port: by number, by (part of its) name, or 'virtual'
+    # for a virtual port; by default the first port if there is one,
+    # otherwise a virtual port
+
+    def __init__(self, port=None, name="My virtual output"):
+        import rtmidi
+        self.midi_out = rtmidi.MidiOut()
+        available_ports = self.midi_out.get_ports()
+        if port is not None and port != 'virtual' and not str(port).isdigit():
+            matches = [i for i, p in enumerate(available_ports) if port.lower() in p.lower()]
+            if not matches:
+                raise ValueError('no MIDI port matching %r in %s' % (port, available_ports))
+            port = matches[0]
+        if available_ports and port != 'virtual':
+            port = int(port or 0)
+            print('opening port %d (%s)' % (port, available_ports[port]))
+            self.midi_out.open_port(port)
+        else:
+            print('opening virtual port')
+            self.midi_out.open_virtual_port(name)
+
+    def send(self, messages):
+        for msg in messages:
+            self.midi_out.send_message(msg)
+
+    def close(self):
+        self.midi_out.close_port()
+
+
+class RecordingSink:
+
+    # keeps every message as (host time, bytes); with out, also prints them
+    # as hex, one per line
+
+    def __init__(self, out=None):
+        self.out = out
+        self.messages = []
+
+    def send(self, messages):
+        t = time.monotonic()
+        for msg in messages:
+            self.messages.append((t, bytes(msg)))
+            if self.out is not None:
+                self.out.write('%.6f %s\n' % (t, bytes(msg).hex(' ')))
+        if self.out is not None:
+            self.out.flush()
+
+    def close(self):
+        pass
+
+
+def open_midi(spec):
+    # None for the first port (or a virtual one), 'virtual', a port number or
+    # name, or '-' to print the messages instead
+    if spec == '-':
+        return RecordingSink(sys.stdout)
+    return MidiSink(spec)
+
+
+def add_midi_argument(parser):
+    parser.add_argument('--midi', metavar='PORT',
+                            help="MIDI output port number or name, 'virtual', or '-' to print the "
+                                    "messages (default: the first port, else a virtual one)")
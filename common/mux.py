@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+
+# Read any number of boards at once.
+#
+# Multiplexer waits on all the ports with one selector and reads whichever
+# have data, so no board waits on another and nothing gets thrown away.
+# FrameAligner then pairs the boards up: each board's latest frame is held,
+# and whenever the fastest board (the "leader") delivers a frame, one combined
+# frame is emitted with every other board's most recent frame at that time.
+# The combined stream therefore runs at the rate of the fastest board.
+#
+# FrameAligner pairs by board timestamps, mapped to host time through each
+# board's clock estimate (clocksync.py): a leader frame goes with each other
+# board's last frame at or before it, so a batch that sat in one driver
+# doesn't pair its frames with whatever happened to be newest. It never
+# waits, though: a frame only pairs with frames already read, and reports
+# without timestamps pair by arrival. TimelineAligner places reports on host time the same way but waits
+# for every board, then interpolates them onto one regular grid, for when
+# the boards have to agree (cross-board gestures, velocities).
+
+import bisect
+import selectors
+import sys
+
+import numpy as np
+
+from clocksync import BoardClock
+from report import FRAME
+
+
+class Multiplexer:
+
+    def __init__(self, readers):
+        self.readers = readers
+        self.selector = selectors.DefaultSelector()
+        for i, reader in enumerate(readers):
+            self.selector.register(reader.port.fileno(), selectors.EVENT_READ, i)
+        self.open = len(readers)
+
+    def poll(self, timeout=None):
+        # blocks until at least one port is readable (or timeout); returns
+        # [(board, host time, batch), ...] in arrival order, host time as
+        # each batch was read, before decoding it or reading other ports
+        ready = []
+        for key, events in self.selector.select(timeout):
+            i = key.data
+            # the port is readable, so this doesn't block. A port that has
+            # gone away (unplugged board, closed pty) raises OSError, and a
+            # replay raises EOFError at its end; either way the port is
+            # dropped, and once every port has ended so does the poll
+            try:
+                batch = self.readers[i].read_batch()
+            except (EOFError, OSError) as e:
+                if not isinstance(e, EOFError):
+                    sys.stderr.write('board %d: port closed (%s)\n' % (i, e))
+                self.selector.unregister(key.fileobj)
+                self.open -= 1
+                if not self.open:
+                    raise EOFError('all ports closed') from None
+                continue
+            if len(batch):
+                ready.append((i, self.readers[i].t_host, batch))
+        return ready
+
+    def close(self):
+        self.selector.close()
+
+
+class FrameAligner:
+
+    def __init__(self, nboards, window=1., history=256):
+        self.nboards = nboards
+        self.leader = None
+        # frame counts over the current window, for picking the leader
+        self.window = window
+        self.window_start = None
+        self.counts = [0] * nboards
+        # each board's last `history` frames and their host times
+        self.clocks = [BoardClock() for _ in range(nboards)]
+        self.history = history
+        self.times = [[] for _ in range(nboards)]
+        self.frames = [[] for _ in range(nboards)]
+
+    def push(self, ready):
+        # ready: output of Multiplexer.poll(); returns the combined frames,
+        # each a tuple of the boards' frames in board order
+        new = []
+        for i, t, batch in sorted(ready, key=lambda r: r[1]):
+            self._count(i, t, len(batch))
+            times = self._host_times(i, t, batch)
+            self.times[i].extend(times)
+            self.frames[i].extend(batch)
+            new.append((i, times, batch))
+        if not all(self.times):
+            return []
+        combined = []
+        for i, times, batch in new:
+            if i != self.leader:
+                continue
+            for th, frame in zip(times, batch):
+                combined.append(tuple(frame if j == i else self._at(j, th)
+                                        for j in range(self.nboards)))
+        for i in range(self.nboards):
+            del self.times[i][:-self.history]
+            del self.frames[i][:-self.history]
+        return combined
+
+    def _at(self, i, th):
+        # board i's last frame at or before host time th, or its oldest
+        k = bisect.bisect_right(self.times[i], th)
+        return self.frames[i][max(k - 1, 0)]
+
+    def _host_times(self, i, t, batch):
+        # FRAME batches with device timestamps by the board's clock, in
+        # order; anything else at its arrival time
+        if getattr(batch, 'dtype', None) != FRAME or batch['ts'][-1] < 0:
+            th = np.full(len(batch), float(t))
+        else:
+            th = self.clocks[i].host_time(self.clocks[i].update(batch['ts'], t))
+        if self.times[i]:
+            th = np.maximum(th, self.times[i][-1])
+        return np.maximum.accumulate(th).tolist()
+
+    def _count(self, i, t, n):
+        if self.window_start is None:
+            self.window_start = t
+            self.leader = i
+        self.counts[i] += n
+        if t - self.window_start >= self.window:
+            self.leader = max(range(self.nboards), key=self.counts.__getitem__)
+            self.counts = [0] * self.nboards
+            self.window_start = t
+
+
+class TimelineAligner:
+
+    # Combined frames at `rate` Hz of host time. A grid time goes out once
+    # every board has reported past it; a board that has been silent for
+    # `stale` seconds is held at its last report instead of holding up the
+    # rest. Distances and parameters are interpolated to the grid times,
+    # ts and the engaged flags are the latest report's, and each report's
+    # events go out with the first grid time at or after it. Raw "d d d d"
+    # reports have no device time and are placed at their arrival time.
+
+    def __init__(self, nboards, rate=100., stale=0.1, window=30.):
+        self.nboards = nboards
+        self.rate = rate
+        self.stale = stale
+        self.clocks = [BoardClock(window=window) for _ in range(nboards)]
+        self.times = [np.zeros(0) for _ in range(nboards)]
+        self.frames = [np.zeros(0, dtype=FRAME) for _ in range(nboards)]
+        self.arrival = [None] * nboards
+        self.k_next = None
+
+    def push(self, ready):
+        # ready: output of Multiplexer.poll(); returns an (n, nboards) FRAME
+        # array, host set to the grid times
+        for i, t, batch in ready:
+            if batch['ts'][-1] >= 0:
+                th = self.clocks[i].host_time(self.clocks[i].update(batch['ts'], t))
+            else:
+                th = np.full(len(batch), t)
+            # the clock estimate moves; times must not
+            if self.times[i].size:
+                th = np.maximum(th, self.times[i][-1])
+            self.times[i] = np.concatenate((self.times[i], np.maximum.accumulate(th)))
+            self.frames[i] = np.concatenate((self.frames[i], batch))
+            self.arrival[i] = t
+        empty = np.zeros((0, self.nboards), dtype=FRAME)
+        if None in self.arrival:
+            return empty
+        now = max(self.arrival)
+        live = [i for i in range(self.nboards) if now - self.arrival[i] < self.stale]
+        horizon = min(self.times[i][-1] for i in live)
+        if self.k_next is None:
+            self.k_next = int(np.ceil(max(t[0] for t in self.times) * self.rate))
+        grid = np.arange(self.k_next, int(np.floor(horizon * self.rate)) + 1) / self.rate
+        if not grid.size:
+            return empty
+        self.k_next += grid.size
+        out = np.zeros((grid.size, self.nboards), dtype=FRAME)
+        for i in range(self.nboards):
+            th, frames = self.times[i], self.frames[i]
+            out['host'][:,i] = grid
+            for c in range(4):
+                out['dist'][:,i,c] = np.rint(np.interp(grid, th, frames['dist'][:,c]))
+                out['val'][:,i,c] = np.interp(grid, th, frames['val'][:,c])
+            held = np.maximum(np.searchsorted(th, grid, 'right') - 1, 0)
+            for name in ('ts', 'dist_en', 'val_en'):
+                out[name][:,i] = frames[name][held]
+            done = th <= grid[-1]
+            ev = np.nonzero(done & (frames['events'] != 0))[0]
+            np.bitwise_or.at(out['events'][:,i], np.searchsorted(grid, th[ev]), frames['events'][ev])
+            # keep the last report at or before the grid for interpolating,
+            # its events already sent
+            keep = max(int(done.sum()) - 1, 0)
+            self.times[i] = th[keep:]
+            self.frames[i] = frames[keep:].copy()
+            if done.any():
+                self.frames[i]['events'][0] = 0
+        return out
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+# OSC over UDP, for receivers that schedule by timetag.
+#
+# Messages come in as the same FUDI-style strings the other sinks take
+# ('3 120;'); each becomes one OSC message, its atoms typed as int32,
+# float32 or string. A leading '/...' atom is used as the address, otherwise
+# the sink's default address. send_bundle() wraps messages in a bundle
+# timetagged with a wall-clock time (time.time()), so the receiver plays them
+# at that time rather than when they arrive.
+
+import socket
+import struct
+import time
+
+NTP_EPOCH = 2208988800
+IMMEDIATELY = 1
+
+
+def _pad(data):
+    return data + b'\0' * (4 - len(data) % 4)
+
+
+def _atom(a):
+    try:
+        return 'i', struct.pack('>i', int(a))
+    except ValueError:
+        pass
+    try:
+        return 'f', struct.pack('>f', float(a))
+    except ValueError:
+        return 's', _pad(a.encode())
+
+
+def encode_message(message, address='/quadrant'):
+    atoms = message.rstrip().rstrip(';').split()
+    if atoms and atoms[0].startswith('/'):
+        address, atoms = atoms[0], atoms[1:]
+    tags, args = zip(*map(_atom, atoms)) if atoms else ((), ())
+    return _pad(address.encode()) + _pad((',' + ''.join(tags)).encode()) + b''.join(args)
+
+
+def timetag(t):
+    # wall-clock seconds -> 64-bit NTP fixed point; None for "immediately"
+    if t is None:
+        return IMMEDIATELY
+    t += NTP_EPOCH
+    return int(t) << 32 | int((t % 1) * 2**32)
+
+
+def encode_bundle(t, messages, address='/quadrant'):
+    out = [b'#bundle\0', struct.pack('>Q', timetag(t))]
+    for m in messages:
+        data = encode_message(m, address)
+        out += [struct.pack('>i', len(data)), data]
+    return b''.join(out)
+
+
+class OscSink:
+
+    def __init__(self, host='localhost', port=57120, address='/quadrant'):
+        self.addr = (host, port)
+        self.address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.dropped = 0
+
+    def _send(self, data, n):
+        try:
+            self.sock.sendto(data, self.addr)
+        except OSError:
+            self.dropped += n
+
+    def send(self, messages):
+        for m in messages:
+            if m:
+                self._send(encode_message(m, self.address), 1)
+
+    def send_bundle(self, t, messages):
+        messages = [m for m in messages if m]
+        if messages:
+            self._send(encode_bundle(t, messages, self.address), len(messages))
+
+    def close(self):
+        self.sock.close()
+
+
+def open_osc(spec):
+    # [host:]port[/address]
+    spec, slash, address = spec.partition('/')
+    host, _, port = spec.rpartition(':')
+    return OscSink(host or 'localhost', int(port), slash + address if slash else '/quadrant')
+
+
+if __name__ == '__main__':
+    # print what arrives on a port, e.g. python3 osc.py 57120
+    import sys
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', int(sys.argv[1]) if len(sys.argv) > 1 else 57120))
+    while True:
+        data, _ = sock.recvfrom(65536)
+        print('%.6f %r' % (time.time(), data))
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+# source -> parse -> filter -> detect -> sink, batch at a time.
+#
+# Every bridge script has the same skeleton: open one or more boards, sleep
+# until one of them sends something, turn the batch into messages, send the
+# messages somewhere. Pipeline is that skeleton, so each app only supplies
+# its own stages:
+#
+#   source = open_source(args.device, parse_batch=ReportDecoder().decode_batch)
+#   Pipeline([source], [open_sink(args.out)], detect=pluck).run()
+#
+# Sources all look like a board to the Multiplexer (a FrameReader on
+# something with a fileno), so the same app runs from
+#
+#   /dev/ttyACM0     a Quadrant (SerialSource)
+#   session.qs       a session recorded with record.py, at recorded speed
+#                    (ReplaySource)
+#   sim[:rate]       synthetic "d d d d" hands at rate Hz, default 100
+#                    (SimSource, see simulator.py)
+#
+# Sources take either a per-line parse or a parse_batch; with
+# ReportDecoder(...).decode_batch every batch is a FRAME array (report.py),
+# whatever the board prints.
+#
+# Stages are optional callables, each taking the previous one's output; the
+# first gets the Multiplexer's [(board, host time, batch), ...]. The last
+# one's output goes to every sink's send(). With QUADRANT_TIMING set, each
+# stage is timed under its own name (see latency.py).
+#
+# Sinks: StdoutSink and FudiSink (fudi.py) take FUDI strings, MidiSink and
+# RecordingSink (midi.py) take MIDI messages as lists of bytes, MetricsSink
+# (--out metrics) counts whatever it gets.
+
+import fcntl
+import os
+import sys
+import termios
+import threading
+import time
+
+import serial
+
+from ingest import FrameReader
+from mux import Multiplexer
+from session import MAGIC, play
+from simulator import simulate
+from latency import timing
+
+SOURCE_HELP = "serial device, recorded session (.qs) or sim[:rate]"
+
+
+class SerialSource:
+
+    def __init__(self, device, parse=None, on_error=None, parse_batch=None):
+        self.port = serial.Serial(device, 115200)
+        self.reader = FrameReader(self.port, parse, on_error, parse_batch=parse_batch)
+
+    def close(self):
+        self.port.close()
+
+
+class _PipePort:
+
+    # the read end of a pipe, with the bits of the pyserial interface
+    # FrameReader uses
+
+    def __init__(self, fd):
+        self.fd = fd
+        self._n = bytearray(4)
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        fcntl.ioctl(self.fd, termios.FIONREAD, self._n)
+        return int.from_bytes(self._n, sys.byteorder)
+
+    def read(self, n):
+        data = os.read(self.fd, n)
+        if not data:
+            raise EOFError
+        return data
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _ThreadSource:
+
+    # a writer thread feeding a pipe; EOFError from the reader when it's done
+
+    def __init__(self, parse, on_error, parse_batch):
+        r, self.w = os.pipe()
+        self.port = _PipePort(r)
+        self.reader = FrameReader(self.port, parse, on_error, parse_batch=parse_batch)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.w, data):]
+
+    def _run(self):
+        try:
+            self.produce()
+        except BrokenPipeError:
+            pass
+        finally:
+            os.close(self.w)
+
+    def close(self):
+        self.port.close()
+
+
+class ReplaySource(_ThreadSource):
+
+    def __init__(self, filename, parse=None, on_error=None, parse_batch=None,
+                    speed=1., fast=False, loop=False):
+        self.filename = filename
+        self.speed = speed
+        self.fast = fast
+        self.loop = loop
+        super().__init__(parse, on_error, parse_batch)
+
+    def produce(self):
+        play(self.filename, self.write, self.speed, self.fast, self.loop)
+
+
+class SimSource(_ThreadSource):
+
+    def __init__(self, rate=100., parse=None, on_error=None, parse_batch=None, nchan=4, seed=None):
+        self.rate = rate
+        self.frames = simulate(rate, nchan, seed)
+        super().__init__(parse, on_error, parse_batch)
+
+    def produce(self):
+        t0 = time.monotonic()
+        for k, frame in enumerate(self.frames):
+            wait = t0 + k / self.rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.write(frame)
+
+
+def _is_session(spec):
+    if spec.endswith('.qs'):
+        return True
+    try:
+        with open(spec, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def open_source(spec, parse=None, on_error=None, parse_batch=None):
+    # see SOURCE_HELP
+    if spec == 'sim' or spec.startswith('sim:'):
+        rate = float(spec.split(':', 1)[1]) if ':' in spec else 100.
+        return SimSource(rate, parse, on_error, parse_batch)
+    if _is_session(spec):
+        return ReplaySource(spec, parse, on_error, parse_batch)
+    return SerialSource(spec, parse, on_error, parse_batch)
+
+
+class MetricsSink:
+
+    # message and batch rates on stderr every `interval` seconds
+
+    def __init__(self, interval=1., out=sys.stderr):
+        self.interval = interval
+        self.out = out
+        self.messages = 0
+        self.batches = 0
+        self.t0 = time.monotonic()
+
+    def send(self, messages):
+        self.batches += 1
+        self.messages += len(messages)
+        now = time.monotonic()
+        if now - self.t0 >= self.interval:
+            dt = now - self.t0
+            self.out.write('%.1f msgs/s  %.1f batches/s\n' % (self.messages / dt, self.batches / dt))
+            self.out.flush()
+            self.messages = self.batches = 0
+            self.t0 = now
+
+    def close(self):
+        pass
+
+
+class Pipeline:
+
+    def __init__(self, sources, sinks, parse=None, filter=None, detect=None):
+        self.sources = sources
+        self.sinks = sinks
+        # parse is always timed: the readers decode their batches as they
+        # read them, so it covers that too, with or without a parse stage
+        self.stages = [('parse', parse)] + [(name, stage) for name, stage in
+                                            (('filter', filter), ('detect', detect)) if stage]
+        self.mux = Multiplexer([source.reader for source in sources])
+
+    def step(self, timeout=None):
+        ready = self.mux.poll(timeout)
+        if not ready:
+            return
+        if timing:
+            timing.reader(self.mux.readers[ready[0][0]])
+        out = ready
+        for name, stage in self.stages:
+            if stage is not None:
+                out = stage(out)
+            if timing:
+                timing.stage(name)
+        if out:
+            for sink in self.sinks:
+                sink.send(out)
+        if timing:
+            timing.stage('write')
+            timing.end()
+
+    def run(self):
+        # until a replay or simulation ends or every board has gone away
+        try:
+            while True:
+                self.step()
+        except EOFError:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.mux.close()
+        for sink in self.sinks:
+            sink.close()
+        for source in self.sources:
+            source.close()
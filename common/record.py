@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+
+# Record a raw serial session from a Quadrant, for replay.py.
+#
+#   python3 record.py /dev/ttyACM0 session.qs
+#
+# Stop with ctrl-c.
+
+import serial
+import sys
+import time
+
+from session import SessionWriter
+
+if len(sys.argv) < 3:
+    print('usage: record.py <device> <session file>')
+    sys.exit(1)
+
+deviceFile = sys.argv[1]
+filename = sys.argv[2]
+
+quadrant = serial.Serial(deviceFile, 115200)
+writer = SessionWriter(filename)
+print('recording %s to %s' % (deviceFile, filename))
+
+try:
+    while True:
+        data = quadrant.read(1)
+        n = quadrant.in_waiting
+        if n:
+            data += quadrant.read(n)
+        writer.write(time.monotonic(), data)
+except KeyboardInterrupt:
+    pass
+finally:
+    writer.close()
+    print('\n%d bytes recorded' % writer.nbytes)
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+# Serve a recorded session through a pseudo-terminal, so any of the scripts
+# can open it like a board:
+#
+#   python3 replay.py session.qs --link /tmp/quadrant0
+#   python3 ../apps/pluck/pluck.py /tmp/quadrant0
+#
+# --speed scales the recorded timing (2 = twice as fast), --max writes as
+# fast as the reader keeps up, --loop starts over at the end.
+
+import argparse
+import os
+import time
+import tty
+
+from session import play
+
+parser = argparse.ArgumentParser(description='replay a recorded Quadrant session on a pty')
+parser.add_argument('session')
+parser.add_argument('--speed', type=float, default=1.)
+parser.add_argument('--max', action='store_true', help='ignore recorded timing')
+parser.add_argument('--loop', action='store_true')
+parser.add_argument('--link', help='symlink to create for the pty, e.g. /tmp/quadrant0')
+parser.add_argument('--delay', type=float, default=2.,
+                        help='seconds to wait before starting, to let the reader open the port')
+args = parser.parse_args()
+
+
+def write(data):
+    while data:
+        data = data[os.write(master, data):]
+
+
+master, slave = os.openpty()
+tty.setraw(slave)
+devname = os.ttyname(slave)
+if args.link:
+    if os.path.lexists(args.link):
+        os.remove(args.link)
+    os.symlink(devname, args.link)
+print('replaying %s on %s' % (args.session, args.link or devname))
+
+try:
+    time.sleep(args.delay)
+    play(args.session, write, speed=args.speed, fast=args.max, loop=args.loop)
+    # give the reader a moment to drain before the pty goes away
+    time.sleep(0.5)
+except KeyboardInterrupt:
+    pass
+finally:
+    if args.link and os.path.islink(args.link):
+        os.remove(args.link)
@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+
+# Fast decoder for the JSON status report from quadrant.printReportToSerial().
+#
+# The firmware always prints the same layout, so the first report is parsed
+# with json.loads and used to compile a regex and a fill plan for that exact
+# layout. After that each report is one regex match, and the values are
+# written straight into preallocated fields instead of building nested dicts. Anything that
+# doesn't match the learned layout (new keys, reordered keys, garbage) goes
+# back through json.loads, and unrecognized keys are kept in `extra`.
+#
+# The same decoder also accepts the COBS-decoded binary report (binreport.py)
+# and plain "d d d d" distance lines, told apart by their first byte.
+#
+# decode_batch() turns a whole batch of lines into a FRAME array, one record
+# per report with the fields as columns, so later stages work on batches
+# without unpacking them. Batches of raw or binary reports are converted in a
+# few array operations. JSON reports that match the learned layout each
+# become one flat tuple of values (a function generated for the layout, the
+# only code generation here: on whole batches it runs several times faster
+# than a loop would), and the tuples are turned into columns once per batch.
+
+import json
+import re
+import warnings
+from array import array
+
+import numpy as np
+
+import binreport
+
+LIDARS = ('l0', 'l1', 'l2', 'l3')
+PARAMS = ('elevation', 'pitch', 'roll', 'arc')
+ELEVATION, PITCH, ROLL, ARC = range(4)
+
+# one decoded report; ts is -1 for raw "d d d d" lines, which have none, and
+# events is a bit mask in binreport.EVENTS order. host is left for the
+# caller (arrival time).
+FRAME = np.dtype([('ts', np.int64), ('host', np.float64),
+                    ('dist', np.int32, (4,)), ('dist_en', np.bool_, (4,)),
+                    ('val', np.float64, (4,)), ('val_en', np.bool_, (4,)),
+                    ('events', np.uint8)])
+
+EVENT_BITS = {name: 1 << i for i, name in enumerate(binreport.EVENTS)}
+
+# binreport.REPORT as a packed dtype, for whole batches of binary payloads
+_BINARY = np.dtype([('version', 'u1'), ('ts', '<u4'), ('dist', '<u2', (4,)), ('en', 'u1'),
+                        ('val', '<i2', (4,)), ('events', 'u1')])
+
+_VALUE = rb'([^,}\s]+)'
+_BOOL = rb'(true|false)'
+_EVENTS = rb'\[([^\]]*)\]'
+_EVENT_NAME = re.compile(rb'"([^"]*)"')
+
+
+def _to_events(g):
+    return [e.decode() for e in _EVENT_NAME.findall(g)] if g else []
+
+
+def event_mask(events):
+    mask = 0
+    for e in events:
+        mask |= EVENT_BITS.get(e, 0)
+    return mask
+
+
+def event_names(mask):
+    return binreport.decode_events(mask)
+
+
+class ReportDecoder:
+
+    def __init__(self, on_error=None):
+        # on_error(line) for each line decode_batch() can't decode
+        self.on_error = on_error
+        self.nerrors = 0
+        self._ts = array('q', [0])
+        self.dist = array('l', [0] * 4)
+        self.dist_en = [False] * 4
+        self.val = array('d', [0.] * 4)
+        self.val_en = [False] * 4
+        self._events = [[]]
+        self.extra = {}
+        self.nfast = 0
+        self.nslow = 0
+        self.nbinary = 0
+        self.nraw = 0
+        self._match = None
+        # [(destination, index, conversion), ...], one per regex group
+        self._plan = None
+        self._row = None
+
+    @property
+    def ts(self):
+        return self._ts[0]
+
+    @property
+    def events(self):
+        return self._events[0]
+
+    def _fill(self, groups):
+        for (dest, i, conv), g in zip(self._plan, groups):
+            dest[i] = conv(g)
+
+    def decode(self, line):
+        # returns True if the report was decoded into the fields
+        m = self._match(line) if self._match is not None else None
+        if m is None:
+            if not line:
+                return False
+            if line[0] < 0x20:
+                return self._decode_binary(line)
+            if not line.lstrip().startswith(b'{'):
+                return self._decode_raw(line)
+            return self._decode_slow(line)
+        try:
+            self._fill(m.groups())
+        except ValueError:
+            return self._decode_slow(line)
+        self.nfast += 1
+        return True
+
+    def decode_batch(self, lines):
+        # FRAME array of the lines that decode
+        if not lines:
+            return np.zeros(0, dtype=FRAME)
+        first = lines[0]
+        if first and self._match is None:
+            if first[0] < 0x20:
+                frames = self._decode_binary_batch(lines)
+            elif not first.lstrip().startswith(b'{'):
+                frames = self._decode_raw_batch(lines)
+            else:
+                frames = None
+            if frames is not None:
+                return frames
+        # one flat tuple per report: ts, dist, dist_en, val, val_en, events
+        rows = []
+        match, row = self._match, self._row
+        last = None
+        nfast = 0
+        for line in lines:
+            m = match(line) if match is not None else None
+            if m is not None:
+                try:
+                    rows.append(row(m.groups()))
+                    last = m
+                    nfast += 1
+                    continue
+                except ValueError:
+                    pass
+            if last is not None:
+                # catch the fields up first, for what this report leaves out
+                self._fill(last.groups())
+                last = None
+            nraw = self.nraw
+            if not self.decode(line):
+                self.nerrors += 1
+                if self.on_error is not None:
+                    self.on_error(line)
+                continue
+            rows.append((-1 if self.nraw > nraw else self._ts[0], *self.dist, *self.dist_en,
+                            *self.val, *self.val_en, event_mask(self._events[0])))
+            match, row = self._match, self._row
+        if last is not None:
+            # leave the scalar fields on the last report, as decode() would
+            self._fill(last.groups())
+        self.nfast += nfast
+        out = np.zeros(len(rows), dtype=FRAME)
+        if rows:
+            values = np.array(rows, dtype=np.float64)
+            out['ts'] = values[:,0]
+            out['dist'] = values[:,1:5]
+            out['dist_en'] = values[:,5:9] != 0
+            out['val'] = values[:,9:13]
+            out['val_en'] = values[:,13:17] != 0
+            out['events'] = values[:,17]
+        return out
+
+    def _decode_raw_batch(self, lines):
+        # all four numbers of every line in one parse, or None to go line by
+        # line (a bad line anywhere, or a line with the wrong count)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            try:
+                values = np.fromstring(b' '.join(lines), dtype=np.int32, sep=' ')
+            except (ValueError, DeprecationWarning):
+                return None
+        if values.size != 4 * len(lines):
+            return None
+        out = np.zeros(len(lines), dtype=FRAME)
+        out['ts'] = -1
+        out['dist'] = values.reshape(-1, 4)
+        self.dist[:] = array('l', values[-4:].tolist())
+        self._events[0] = []
+        self.nraw += len(lines)
+        return out
+
+    def _decode_binary_batch(self, payloads):
+        size = binreport.REPORT.size
+        joined = b''.join(payloads)
+        if len(joined) != size * len(payloads):
+            return None
+        raw = np.frombuffer(joined, dtype=_BINARY)
+        if (raw['version'] != binreport.VERSION).any():
+            return None
+        out = np.zeros(len(payloads), dtype=FRAME)
+        out['ts'] = raw['ts']
+        out['dist'] = raw['dist']
+        bits = 1 << np.arange(4)
+        out['dist_en'] = (raw['en'][:,None] & bits) != 0
+        out['val'] = raw['val'] / binreport.VAL_SCALE
+        out['val_en'] = (raw['en'][:,None] & (bits << 4)) != 0
+        out['events'] = raw['events']
+        # leave the scalar fields on the last report, as decode() would
+        self._decode_binary(payloads[-1])
+        self.nbinary += len(payloads) - 1
+        return out
+
+    def _decode_binary(self, payload):
+        if payload[0] != binreport.VERSION or len(payload) != binreport.REPORT.size:
+            return False
+        (_, self._ts[0], d0, d1, d2, d3, en, v0, v1, v2, v3,
+            ev) = binreport.REPORT.unpack(payload)
+        dist = self.dist
+        dist[0], dist[1], dist[2], dist[3] = d0, d1, d2, d3
+        val = self.val
+        scale = binreport.VAL_SCALE
+        val[0], val[1], val[2], val[3] = v0 / scale, v1 / scale, v2 / scale, v3 / scale
+        for i in range(4):
+            self.dist_en[i] = bool(en & (1 << i))
+            self.val_en[i] = bool(en & (16 << i))
+        self._events[0] = binreport.decode_events(ev) if ev else []
+        self.nbinary += 1
+        return True
+
+    def _decode_raw(self, line):
+        try:
+            data = tuple(map(int, line.split()))
+        except ValueError:
+            return False
+        if len(data) != 4:
+            return False
+        dist = self.dist
+        dist[0], dist[1], dist[2], dist[3] = data
+        self._events[0] = []
+        self.nraw += 1
+        return True
+
+    def _decode_slow(self, line):
+        try:
+            report = json.loads(line)
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+            return False
+        if not isinstance(report, dict):
+            return False
+        self.nslow += 1
+        self.extra = {}
+        self._events[0] = []
+        for k, v in report.items():
+            try:
+                if k == 'ts':
+                    self._ts[0] = v
+                elif k in LIDARS:
+                    i = LIDARS.index(k)
+                    self.dist[i] = v['dist']
+                    self.dist_en[i] = v['en']
+                elif k in PARAMS:
+                    i = PARAMS.index(k)
+                    self.val[i] = v['val']
+                    self.val_en[i] = v['en']
+                elif k == 'events':
+                    self._events[0] = list(v)
+                else:
+                    self.extra[k] = v
+            except (KeyError, TypeError, ValueError, OverflowError):
+                self.extra[k] = v
+        self._learn(report, b' ' in line.strip() if isinstance(line, bytes) else True)
+        return True
+
+    def _learn(self, report, spaced):
+        # learn a matcher, fill plan and row function for this report's exact
+        # layout, or give up if it contains anything the fast path can't store
+        self._match = None
+        sep = rb'\s*,\s*' if spaced else rb','
+        key = (lambda k: rb'"%s"\s*:\s*' % k) if spaced else (lambda k: rb'"%s":' % k)
+        pattern = []
+        plan = []
+        # the flat tuple for decode_batch(): fields not in the layout keep
+        # whatever the decoder holds
+        row = (['ts[0]'] + ['dist[%d]' % i for i in range(4)] + ['dist_en[%d]' % i for i in range(4)]
+                + ['val[%d]' % i for i in range(4)] + ['val_en[%d]' % i for i in range(4)]
+                + ['mask(events[0])'])
+        for k, v in report.items():
+            if not k.isidentifier():
+                return
+            g = 'g[%d]' % len(plan)
+            if k == 'ts' and isinstance(v, int) and not isinstance(v, bool):
+                pattern.append(key(b'ts') + _VALUE)
+                plan.append((self._ts, 0, int))
+                row[0] = 'int(%s)' % g
+            elif k == 'events' and isinstance(v, list):
+                pattern.append(key(b'events') + _EVENTS)
+                plan.append((self._events, 0, _to_events))
+                row[17] = 'mask(to_events(%s)) if %s else 0' % (g, g)
+            elif (k in LIDARS or k in PARAMS) and isinstance(v, dict):
+                if k in LIDARS:
+                    i, field, values, engaged, conv = LIDARS.index(k), 'dist', self.dist, self.dist_en, int
+                    col = 1 + i
+                else:
+                    i, field, values, engaged, conv = PARAMS.index(k), 'val', self.val, self.val_en, float
+                    col = 9 + i
+                if set(v) != {field, 'en'} or conv is int and not isinstance(v[field], int):
+                    return
+                inner = []
+                for kk in v:
+                    g = 'g[%d]' % len(plan)
+                    if kk == 'en':
+                        inner.append(key(b'en') + _BOOL)
+                        plan.append((engaged, i, b'true'.__eq__))
+                        row[col + 4] = "%s == b'true'" % g
+                    else:
+                        inner.append(key(field.encode()) + _VALUE)
+                        plan.append((values, i, conv))
+                        row[col] = '%s(%s)' % (conv.__name__, g)
+                pattern.append(key(k.encode()) + rb'\{' + sep.join(inner) + rb'\}')
+            else:
+                return
+        src = 'def row(g):\n    return (' + ', '.join(row) + ')\n'
+        scope = {'ts': self._ts, 'dist': self.dist, 'dist_en': self.dist_en,
+                    'val': self.val, 'val_en': self.val_en, 'events': self._events,
+                    'to_events': _to_events, 'mask': event_mask}
+        exec(src, scope)
+        self._plan = plan
+        self._row = scope['row']
+        self._match = re.compile(rb'\s*\{' + sep.join(pattern) + rb'\}\s*').fullmatch
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+# Fixed-length multi-channel history.
+#
+# Every sample is written twice, at pos and pos+length, so the last `length`
+# samples are always one contiguous slice of the backing array: view() costs
+# nothing and can go straight to a plot, oldest sample first.
+
+import numpy as np
+
+
+class RingBuffer:
+
+    def __init__(self, nchan, length, dtype=np.float32, fill=0):
+        self.nchan = nchan
+        self.length = length
+        self.buf = np.full((nchan, 2*length), fill, dtype=dtype)
+        self.pos = 0
+        self.count = 0
+
+    def append(self, sample):
+        # sample: one value per channel
+        p = self.pos
+        self.buf[:,p] = sample
+        self.buf[:,p+self.length] = sample
+        self.pos = (p + 1) % self.length
+        self.count += 1
+
+    def extend(self, block):
+        # block: (nchan, n) array, oldest first
+        block = np.asarray(block)
+        n = block.shape[1]
+        if n == 0:
+            return
+        L = self.length
+        if n > L:
+            self.pos = (self.pos + n - L) % L
+            self.count += n - L
+            block = block[:,-L:]
+            n = L
+        idx = (self.pos + np.arange(n)) % L
+        self.buf[:,idx] = block
+        self.buf[:,idx+L] = block
+        self.pos = (self.pos + n) % L
+        self.count += n
+
+    def view(self):
+        # (nchan, length), oldest first; valid until the next write
+        return self.buf[:,self.pos:self.pos+self.length]
+
+    def latest(self):
+        return self.buf[:,self.pos+self.length-1]
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+# Windowed mean/std/min/max over the last `window` samples of each channel,
+# updated incrementally.
+#
+# Mean and std come from running sums: each new sample adds itself and
+# subtracts the one leaving the window, and the sums are recomputed from
+# scratch once per trip around the ring so float error can't build up.
+#
+# Min and max come from the ring split into blocks of ~sqrt(window) samples,
+# each with a running min/max since it was last started. A query combines
+# the whole blocks inside the window with a direct scan of the one partial
+# block at the old end, so it costs O(sqrt(window)) per channel no matter
+# how many samples arrived since the last query.
+
+import math
+
+import numpy as np
+
+
+class RollingStats:
+
+    def __init__(self, nchan, window):
+        self.nchan = nchan
+        self.window = window
+        self.block = max(1, int(math.sqrt(window)))
+        self.nblocks = -(-window // self.block) + 1
+        self.size = self.nblocks * self.block
+        self.ring = np.zeros((nchan, self.size), dtype=np.float64)
+        self.bmin = np.zeros((nchan, self.nblocks), dtype=np.float64)
+        self.bmax = np.zeros((nchan, self.nblocks), dtype=np.float64)
+        self.sum = np.zeros(nchan, dtype=np.float64)
+        self.sumsq = np.zeros(nchan, dtype=np.float64)
+        self.pos = 0
+        self.count = 0
+        self.since_resum = 0
+
+    def append(self, sample):
+        self.extend(np.asarray(sample, dtype=np.float64).reshape(self.nchan, 1))
+
+    def extend(self, block):
+        # block: (nchan, n), oldest first
+        block = np.asarray(block, dtype=np.float64)
+        n = block.shape[1]
+        if n == 0:
+            return
+        if n > self.size:
+            self.pos = (self.pos + n - self.size) % self.size
+            self.count += n - self.size
+            block = block[:,-self.size:]
+            n = self.size
+
+        # take out what leaves the window before it gets overwritten
+        if n < self.window:
+            first = max(0, self.window - self.count)
+            if first < n:
+                leaving = self.ring[:, self._idx(self.pos - self.window + first, self.pos - self.window + n)]
+                self.sum -= leaving.sum(axis=1)
+                self.sumsq -= (leaving * leaving).sum(axis=1)
+            self.sum += block.sum(axis=1)
+            self.sumsq += (block * block).sum(axis=1)
+
+        self.ring[:, self._idx(self.pos, self.pos + n)] = block
+
+        # running min/max of each block touched
+        B = self.block
+        a = 0
+        p = self.pos
+        while a < n:
+            k, offset = divmod(p, B)
+            b = min(n, a + B - offset)
+            seg = block[:,a:b]
+            if offset == 0:
+                self.bmin[:,k] = seg.min(axis=1)
+                self.bmax[:,k] = seg.max(axis=1)
+            else:
+                np.minimum(self.bmin[:,k], seg.min(axis=1), out=self.bmin[:,k])
+                np.maximum(self.bmax[:,k], seg.max(axis=1), out=self.bmax[:,k])
+            p = (p + b - a) % self.size
+            a = b
+
+        self.pos = (self.pos + n) % self.size
+        self.count += n
+        self.since_resum += n
+        if n >= self.window or self.since_resum >= self.size:
+            self._resum()
+
+    def _idx(self, a, b):
+        return np.arange(a, b) % self.size
+
+    def _resum(self):
+        n = min(self.count, self.window)
+        w = self.ring[:, self._idx(self.pos - n, self.pos)]
+        self.sum = w.sum(axis=1)
+        self.sumsq = (w * w).sum(axis=1)
+        self.since_resum = 0
+
+    @property
+    def n(self):
+        return min(self.count, self.window)
+
+    def mean(self):
+        if not self.n:
+            return np.full(self.nchan, np.nan)
+        return self.sum / self.n
+
+    def std(self):
+        if not self.n:
+            return np.full(self.nchan, np.nan)
+        mean = self.sum / self.n
+        return np.sqrt(np.maximum(self.sumsq / self.n - mean * mean, 0.))
+
+    def min(self):
+        return self._extreme(self.bmin, np.min)
+
+    def max(self):
+        return self._extreme(self.bmax, np.max)
+
+    def _extreme(self, blocks, reduce):
+        n = self.n
+        if not n:
+            return np.full(self.nchan, np.nan)
+        B = self.block
+        end = self.pos if self.pos >= n else self.pos + self.size
+        start = end - n
+        # partial block at the old end, scanned directly
+        head_end = min(end, (start // B + 1) * B)
+        parts = [reduce(self.ring[:, self._idx(start, head_end)], axis=1)]
+        # whole blocks, plus the newest block whose running value only
+        # covers samples written since it started
+        if head_end < end:
+            ks = np.arange(head_end // B, -(-end // B)) % self.nblocks
+            parts.append(reduce(blocks[:, ks], axis=1))
+        return reduce(np.stack(parts, axis=1), axis=1)
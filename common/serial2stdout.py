@@ -1,19 +1,21 @@
 #!/usr/bin/python3 -u
 
-import serial
-import struct
-import sys
+import argparse
 
-if len(sys.argv) > 1:
-    deviceFile = sys.argv[1]
-else:
-    deviceFile = '/dev/ttyACM0'
+from report import ReportDecoder
+from fudi import open_sink, add_sink_argument
+from pipeline import Pipeline, open_source, SOURCE_HELP
 
-quadrant = serial.Serial(deviceFile, 115200)
-while True:
-    data_raw = quadrant.readline();
-    data = tuple(map(int, data_raw.split()))
-    if len(data) == 4:
-        print('%d %d %d %d;' % data)
-    else:
-        print('wtf!')
+parser = argparse.ArgumentParser(description='forward raw Quadrant distances to Pd')
+parser.add_argument('device', nargs='?', default='/dev/ttyACM0', help=SOURCE_HELP)
+add_sink_argument(parser)
+args = parser.parse_args()
+
+
+def forward(ready):
+    return ['%d %d %d %d;' % tuple(data) for board, t, batch in ready for data in batch['dist'].tolist()]
+
+
+decoder = ReportDecoder(on_error=lambda line: print('wtf!'))
+source = open_source(args.device, parse_batch=decoder.decode_batch)
+Pipeline([source], [open_sink(args.out)], detect=forward).run()
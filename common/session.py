@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+# Raw serial session files, written by record.py and served by replay.py.
+#
+# A session is the magic line followed by one record per read from the port:
+#
+#   f64     host arrival time, seconds since the first record
+#   u32     length
+#   bytes   exactly what the port returned
+#
+# Nothing is parsed on the way in, so a session replays byte-for-byte into
+# any of the scripts, whatever report format the firmware was printing.
+#
+# play() writes a session back out with its recorded timing, for replay.py
+# and the pipeline's replay source.
+
+import struct
+import time
+
+MAGIC = b'QUADRANT-SESSION 1\n'
+RECORD = struct.Struct('<dI')
+
+
+class SessionWriter:
+
+    def __init__(self, filename):
+        self.f = open(filename, 'wb')
+        self.f.write(MAGIC)
+        self.t0 = None
+        self.nbytes = 0
+
+    def write(self, t, data):
+        if self.t0 is None:
+            self.t0 = t
+        self.f.write(RECORD.pack(t - self.t0, len(data)))
+        self.f.write(data)
+        self.nbytes += len(data)
+
+    def close(self):
+        self.f.close()
+
+
+def read_session(filename):
+    # yields (t, data) in recorded order
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a session file' % filename)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            t, n = RECORD.unpack(header)
+            data = f.read(n)
+            if len(data) < n:
+                return
+            yield t, data
+
+
+def play(filename, write, speed=1., fast=False, loop=False):
+    # write(data) for each record at its recorded time (scaled by speed),
+    # or as fast as write() returns with fast=True
+    while True:
+        t0 = time.monotonic()
+        for t, data in read_session(filename):
+            if not fast:
+                wait = t0 + t / speed - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            write(data)
+        if not loop:
+            return
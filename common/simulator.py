@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+
+# Simulated Quadrants on pseudo-terminals, for load testing without boards.
+#
+# Each board plays hands dipping into its four channels: a raised-cosine dip
+# from IDLE down to a random depth and back, 50 ms to 1 s long, about once a
+# second per channel, over sensor noise. Dips under HIT_MAX are quick enough
+# to be hits (hit0..hit3, reported at the bottom of the dip), and now and then
+# a hand swipes across l1 and l3 (swl: l3 then l1, swr: l1 then l3). A
+# channel is engaged below ENGAGE; elevation, pitch, roll and arc are
+# derived from the engaged distances.
+#
+# Reports go out in any of the firmware's formats:
+#
+#   raw      "d d d d" lines (serial2stdout.py, pluck.py, multipluck.py)
+#   json     status reports (dashboard.py, readSerial.py)
+#   binary   COBS-framed binreport.py reports
+#
+#   python3 simulator.py --format json --rate 1000 --boards 2 --link /tmp/quadrant
+#   python3 ../apps/dataViz/dashboard/dashboard.py /tmp/quadrant0
+#
+# Writes never block: when a reader falls behind, the pty fills up, whole
+# reports are dropped once more than --buffer bytes are waiting (as a board's
+# USB buffer would), and the drops are counted. --rate takes a list of rates
+# to step through, --step seconds each, with a line per step and board, to
+# find where a script starts to fall behind:
+#
+#   python3 simulator.py --rate 100,200,500,1000,2000,5000 --step 10 --link /tmp/quadrant
+#
+# --drift gives each board's clock a random error of up to that many ppm, as
+# independent boards have. --record writes a session (session.py) instead,
+# as fast as it can be generated.
+
+import argparse
+import errno
+import os
+import sys
+import time
+import tty
+
+import numpy as np
+
+from binreport import encode_report
+from report import LIDARS, PARAMS
+from session import SessionWriter
+
+IDLE = 400.
+NOISE = 2.
+ENGAGE = 300
+HIT_MAX = 0.15
+DIP_INTERVAL = 1.
+SWIPE_INTERVAL = 5.
+SWIPE_GAP = 0.08
+TS_WRAP = 2**32
+
+
+class Hands:
+
+    # distance curves for nchan channels, a block of frames at a time
+
+    def __init__(self, rate, nchan=4, seed=None):
+        self.rate = rate
+        self.nchan = nchan
+        self.rng = np.random.default_rng(seed)
+        self.phase = np.ones(nchan)
+        self.step = np.zeros(nchan)
+        self.depth = np.full(nchan, IDLE)
+        self.event = [None] * nchan
+        # frames until each channel's next dip, and that dip if it's planned
+        self.wait = self.rng.geometric(1. / (DIP_INTERVAL * rate), nchan)
+        self.next = [None] * nchan
+
+    def start(self, c, depth, duration, event=None):
+        self.depth[c] = depth
+        self.step[c] = 1. / max(duration * self.rate, 1.)
+        self.phase[c] = 0.
+        self.event[c] = event
+
+    def schedule(self, c, delay, depth, duration, event=None):
+        # a dip on channel c in `delay` frames, cutting short the current one
+        self.phase[c] = 1.
+        self.wait[c] = max(delay, 1)
+        self.next[c] = (depth, duration, event)
+
+    def frames(self, n):
+        # (n, nchan) distances and [(frame, event name), ...]
+        out = np.empty((n, self.nchan))
+        events = []
+        rng = self.rng
+        for c in range(self.nchan):
+            k = 0
+            while k < n:
+                if self.phase[c] < 1:
+                    m = min(n - k, max(int(np.ceil((1 - self.phase[c]) / self.step[c])), 1))
+                    phase = self.phase[c] + self.step[c] * np.arange(m)
+                    out[k:k+m,c] = IDLE - (IDLE - self.depth[c]) * (1 - np.cos(2 * np.pi * phase)) / 2
+                    # the event goes with the first frame past the bottom
+                    i = int(np.searchsorted(phase, 0.5))
+                    if self.event[c] is not None and i < m and phase[i] - self.step[c] < 0.5:
+                        events.append((k + i, self.event[c]))
+                    self.phase[c] += self.step[c] * m
+                    k += m
+                    continue
+                m = min(n - k, int(self.wait[c]))
+                out[k:k+m,c] = IDLE
+                self.wait[c] -= m
+                k += m
+                if self.wait[c] <= 0:
+                    if self.next[c] is not None:
+                        depth, duration, event = self.next[c]
+                        self.next[c] = None
+                    else:
+                        duration = rng.uniform(0.05, 1.)
+                        depth = rng.uniform(20, 250)
+                        event = 'hit%d' % c if duration < HIT_MAX and c < 4 else None
+                    self.start(c, depth, duration, event)
+                    self.wait[c] = int(duration * self.rate) + rng.geometric(1. / (DIP_INTERVAL * self.rate))
+        out += rng.normal(0, NOISE, out.shape)
+        np.clip(out, 0, 8190, out=out)
+        events.sort()
+        return out, events
+
+
+class Board:
+
+    # one simulated Quadrant: Hands plus device clock, engagement, parameters
+    # and events, encoded as `fmt` reports
+
+    def __init__(self, rate, fmt='raw', seed=None, drift=0.):
+        self.rate = rate
+        self.fmt = fmt
+        self.hands = Hands(rate, 4, seed)
+        rng = self.hands.rng
+        self.drift = drift
+        self.ts0 = int(rng.integers(0, TS_WRAP))
+        self.n = 0
+        self.swipe_wait = rng.geometric(1. / (SWIPE_INTERVAL * rate))
+        self.encode = {'raw': self.raw, 'json': self.json, 'binary': self.binary}[fmt]
+
+    def set_rate(self, rate):
+        # keeps the device clock continuous
+        self.ts0 += int(self.n * 1e6 * (1 + self.drift) / self.rate)
+        self.n = 0
+        self.rate = self.hands.rate = rate
+
+    def reports(self, n):
+        # the next n reports, as one bytes object
+        self.swipe_wait -= n
+        if self.swipe_wait <= 0:
+            rng = self.hands.rng
+            a, b, name = (3, 1, 'swl') if rng.random() < 0.5 else (1, 3, 'swr')
+            duration = rng.uniform(0.1, 0.3)
+            self.hands.schedule(a, 1, rng.uniform(50, 200), duration)
+            self.hands.schedule(b, int(SWIPE_GAP * self.rate), rng.uniform(50, 200), duration, name)
+            self.swipe_wait = rng.geometric(1. / (SWIPE_INTERVAL * self.rate))
+        dist, events = self.hands.frames(n)
+        ts = self.ts0 + ((self.n + np.arange(n)) * 1e6 * (1 + self.drift) / self.rate).astype(np.int64)
+        self.n += n
+        dist_en = dist < ENGAGE
+        val, val_en = params(dist, dist_en)
+        ev = [[] for _ in range(n)]
+        for k, name in events:
+            ev[k].append(name)
+        return self.encode(ts % TS_WRAP, dist.astype(np.int64), dist_en, val, val_en, ev)
+
+    def raw(self, ts, dist, dist_en, val, val_en, ev):
+        return b''.join(b'%d %d %d %d\r\n' % tuple(d) for d in dist.tolist())
+
+    def json(self, ts, dist, dist_en, val, val_en, ev):
+        out = []
+        flag = ('false', 'true')
+        for t, d, de, v, ve, e in zip(ts.tolist(), dist.tolist(), dist_en.tolist(),
+                                        val.tolist(), val_en.tolist(), ev):
+            fields = ['"ts":%d' % t]
+            fields += ['"%s":{"dist":%d,"en":%s}' % (s, d[i], flag[de[i]]) for i, s in enumerate(LIDARS)]
+            fields += ['"%s":{"val":%.6f,"en":%s}' % (s, v[i], flag[ve[i]]) for i, s in enumerate(PARAMS)]
+            fields.append('"events":[%s]' % ','.join('"%s"' % name for name in e))
+            out.append('{%s}\r\n' % ','.join(fields))
+        return ''.join(out).encode()
+
+    def binary(self, ts, dist, dist_en, val, val_en, ev):
+        return b''.join(encode_report(*r) for r in zip(ts.tolist(), dist.tolist(), dist_en.tolist(),
+                                                            val.tolist(), val_en.tolist(), ev))
+
+
+def params(dist, dist_en):
+    # elevation from how close the engaged channels are, the tilts from their
+    # differences (l0 l1 front, l2 l3 back; l0 l2 left, l1 l3 right)
+    x = np.where(dist_en, (ENGAGE - np.minimum(dist, ENGAGE)) / ENGAGE, 0.)
+    engaged = dist_en.sum(axis=1)
+    val = np.zeros(dist.shape)
+    val[:,0] = x.sum(axis=1) / np.maximum(engaged, 1)
+    val[:,1] = (x[:,0] + x[:,1] - x[:,2] - x[:,3]) / 2
+    val[:,2] = (x[:,0] + x[:,2] - x[:,1] - x[:,3]) / 2
+    val[:,3] = x[:,1] - x[:,3]
+    val_en = np.zeros(dist.shape, dtype=bool)
+    val_en[:,0] = engaged > 0
+    val_en[:,1:] = (engaged >= 2)[:,None]
+    return np.round(val, 6), val_en
+
+
+def simulate(rate, nchan=4, seed=None):
+    # endless "d d d d" frames, one at a time (pipeline.SimSource)
+    hands = Hands(rate, nchan, seed)
+    fmt = ' '.join(['%d'] * nchan) + '\r\n'
+    block = max(int(rate / 10), 1)
+    while True:
+        dist, events = hands.frames(block)
+        for d in dist.astype(np.int64).tolist():
+            yield (fmt % tuple(d)).encode()
+
+
+class PtyBoard:
+
+    # a Board behind a pty, written without blocking
+
+    def __init__(self, board, link=None, buffer=4096):
+        self.board = board
+        self.buffer = buffer
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.name = os.ttyname(self.slave)
+        self.link = link
+        if link:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(self.name, link)
+        self.backlog = b''
+        self.n = self.sent = self.dropped = 0
+
+    def send(self, n):
+        data = self.board.reports(n)
+        self.n += n
+        if len(self.backlog) > self.buffer:
+            self.dropped += n
+        else:
+            self.backlog += data
+            self.sent += n
+        self.flush()
+
+    def flush(self):
+        try:
+            while self.backlog:
+                self.backlog = self.backlog[os.write(self.master, self.backlog):]
+        except OSError as e:
+            # EAGAIN: the pty is full; EIO: nobody has it open
+            if e.errno not in (errno.EAGAIN, errno.EIO):
+                raise
+
+    def close(self):
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def run(ptys, rates, step=None, tick=0.001, interval=1., out=sys.stderr):
+    # the rates in turn, `step` seconds each (forever when step is None), with
+    # a line per board every `interval` seconds
+    for rate in rates:
+        for p in ptys:
+            p.board.set_rate(rate)
+            p.n = p.sent = p.dropped = 0
+        t0 = t_report = time.monotonic()
+        while step is None or time.monotonic() - t0 < step:
+            due = int((time.monotonic() - t0) * rate)
+            for p in ptys:
+                if due > p.n:
+                    p.send(due - p.n)
+            time.sleep(tick)
+            if time.monotonic() - t_report >= interval:
+                t_report = time.monotonic()
+                for k, p in enumerate(ptys):
+                    out.write('%8.0f Hz  board %d: %8d sent %8d dropped%s\n' %
+                                (rate, k, p.sent, p.dropped, '  BEHIND' if p.dropped else ''))
+                    p.sent = p.dropped = 0
+                out.flush()
+
+
+def record(board, filename, duration, chunk=0.01):
+    # the simulated stream as a session, timed as if read every `chunk` s
+    writer = SessionWriter(filename)
+    n = max(int(chunk * board.rate), 1)
+    for k in range(int(duration * board.rate / n)):
+        writer.write(k * n / board.rate, board.reports(n))
+    writer.close()
+    return writer.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulated Quadrants on ptys')
+    parser.add_argument('--format', choices=('raw', 'json', 'binary'), default='raw')
+    parser.add_argument('--rate', default='100', help='reports/s per board, or a list to step through')
+    parser.add_argument('--step', type=float, help='seconds at each rate')
+    parser.add_argument('--interval', type=float, help='seconds between stats lines (default: --step, or 1)')
+    parser.add_argument('--boards', type=int, default=1)
+    parser.add_argument('--link', help='symlinks to create, LINK0, LINK1, ...')
+    parser.add_argument('--buffer', type=int, default=4096, help='bytes waiting before reports are dropped')
+    parser.add_argument('--drift', type=float, default=0., help='clock error per board, up to +-ppm')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--tick', type=float, default=0.001, help='seconds between writes')
+    parser.add_argument('--delay', type=float, default=2.,
+                            help='seconds to wait before starting, to let the reader open the port')
+    parser.add_argument('--record', metavar='FILE', help='write a session instead (one board)')
+    parser.add_argument('--duration', type=float, default=60., help='seconds to --record')
+    args = parser.parse_args()
+
+    rates = [float(r) for r in args.rate.split(',')]
+    if len(rates) > 1 and args.step is None:
+        parser.error('--step is needed to step through rates')
+    rng = np.random.default_rng(args.seed)
+    boards = [Board(rates[0], args.format, int(rng.integers(2**31)),
+                    rng.uniform(-args.drift, args.drift) * 1e-6) for _ in range(args.boards)]
+    if args.record:
+        nbytes = record(boards[0], args.record, args.duration)
+        print('%d bytes recorded' % nbytes)
+        return
+
+    ptys = [PtyBoard(b, args.link and '%s%d' % (args.link, k), args.buffer) for k, b in enumerate(boards)]
+    for k, p in enumerate(ptys):
+        print('board %d (%s, %+.1f ppm) on %s' % (k, args.format, p.board.drift * 1e6, p.link or p.name))
+    try:
+        time.sleep(args.delay)
+        run(ptys, rates, args.step, args.tick, args.interval or args.step or 1.)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in ptys:
+            p.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+# Streaming quantiles in fixed memory.
+#
+# Values are counted in logarithmic buckets whose width is a fixed fraction
+# of their value (DDSketch-style), so any quantile comes back within
+# `rel_acc` of a true sample value, however many samples went in. Values
+# outside [lo, hi] are clamped into the end buckets.
+
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+
+    def __init__(self, rel_acc=0.01, lo=1., hi=1e8):
+        self.gamma = (1 + rel_acc) / (1 - rel_acc)
+        self.lo = lo
+        self.hi = hi
+        self.log_gamma = math.log(self.gamma)
+        self.nbuckets = int(math.ceil(math.log(hi / lo) / self.log_gamma)) + 2
+        self.counts = np.zeros(self.nbuckets, dtype=np.int64)
+        self.total = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not values.size:
+            return
+        with np.errstate(divide='ignore', invalid='ignore'):
+            idx = np.ceil(np.log(values / self.lo) / self.log_gamma)
+        idx = np.clip(np.nan_to_num(idx, nan=0., neginf=0.), 0, self.nbuckets - 1).astype(np.intp)
+        self.counts += np.bincount(idx, minlength=self.nbuckets)
+        self.total += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def add_one(self, value):
+        # scalar path, much cheaper than add() for a single value
+        if value > self.lo:
+            i = min(int(math.ceil(math.log(value / self.lo) / self.log_gamma)), self.nbuckets - 1)
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.total += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def _value(self, i):
+        # midpoint (in the relative sense) of bucket i
+        return self.lo * 2 * self.gamma ** i / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.total:
+            return math.nan
+        rank = max(1, int(math.ceil(q * self.total)))
+        i = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(max(self._value(i), self.min), self.max)
+
+    def quantiles(self, qs):
+        return [self.quantile(q) for q in qs]
+
+    def histogram(self):
+        # (edges, counts) over the non-empty range of buckets
+        nz = np.flatnonzero(self.counts)
+        if not nz.size:
+            return np.array([self.lo, self.lo * self.gamma]), np.zeros(1, dtype=np.int64)
+        a, b = nz[0], nz[-1] + 1
+        edges = self.lo * self.gamma ** (np.arange(a, b + 1) - 1.)
+        return edges, self.counts[a:b]
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.min = math.inf
+        self.max = -math.inf
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+
+# Columnar on-disk store for every frame of a session.
+#
+# A store is a directory of append-only column files, one per field and per
+# channel, plus a sparse time index:
+#
+#   t.col           int64    key: device time in us, unwrapped (raw "d d d d"
+#                            reports have no device time; their host time is
+#                            used instead)
+#   ts.col          int64    device ts as reported (-1 for raw reports)
+#   host.col        float64  host arrival time, s
+#   dist0..3.col    int32
+#   val0..3.col     float64
+#   en.col          uint8    bits 0-3 dist_en, bits 4-7 val_en
+#   events.col      uint8    binreport.EVENTS bit mask
+#   index.col       int64    t of every INDEX_STRIDE-th frame
+#
+# StoreWriter appends FRAME arrays (report.py) in chunks. FrameStore maps
+# the columns read-only, so a multi-hour session opens instantly and only the
+# pages actually looked at are read. Time lookups bisect the small index and
+# then a single stride of t.
+#
+#   python3 store.py import session.qs show.store
+#   python3 store.py info show.store
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from report import FRAME
+
+TS_WRAP = 2**32
+INDEX_STRIDE = 1024
+CHUNK = 4096
+FLUSH_INTERVAL = 1.
+
+COLUMNS = dict([('t', np.int64), ('ts', np.int64), ('host', np.float64)] +
+                [('dist%d' % i, np.int32) for i in range(4)] +
+                [('val%d' % i, np.float64) for i in range(4)] +
+                [('en', np.uint8), ('events', np.uint8)])
+
+_BITS = 1 << np.arange(4)
+
+
+def _path(root, name):
+    return os.path.join(root, name + '.col')
+
+
+def _count(root, name, dtype):
+    try:
+        return os.path.getsize(_path(root, name)) // np.dtype(dtype).itemsize
+    except OSError:
+        return 0
+
+
+def _columns(frames):
+    # FRAME array -> {column name: array}
+    cols = {'ts': frames['ts'], 'host': frames['host'], 'events': frames['events']}
+    for i in range(4):
+        cols['dist%d' % i] = frames['dist'][:,i]
+        cols['val%d' % i] = frames['val'][:,i]
+    cols['en'] = ((frames['dist_en'] * _BITS).sum(axis=1) |
+                    ((frames['val_en'] * _BITS).sum(axis=1) << 4)).astype(np.uint8)
+    return cols
+
+
+class StoreWriter:
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # a crash can leave columns of different lengths; the shortest wins
+        self.n = min(_count(root, name, dtype) for name, dtype in COLUMNS.items())
+        self.files = {}
+        for name, dtype in COLUMNS.items():
+            f = open(_path(root, name), 'r+b' if os.path.exists(_path(root, name)) else 'wb')
+            f.truncate(self.n * np.dtype(dtype).itemsize)
+            f.seek(0, os.SEEK_END)
+            self.files[name] = f
+        nindex = (self.n + INDEX_STRIDE - 1) // INDEX_STRIDE
+        self.index = open(_path(root, 'index'), 'r+b' if os.path.exists(_path(root, 'index')) else 'wb')
+        self.index.truncate(nindex * 8)
+        self.index.seek(0, os.SEEK_END)
+        self.t_last = self.ts_last = None
+        if self.n:
+            self.t_last = int(np.fromfile(_path(root, 't'), np.int64, 1, offset=(self.n - 1) * 8)[0])
+            self.ts_last = int(np.fromfile(_path(root, 'ts'), np.int64, 1, offset=(self.n - 1) * 8)[0])
+        self.pending = []
+        self.npending = 0
+        self.t_flush = time.monotonic()
+
+    def append(self, frames):
+        if len(frames):
+            self.pending.append(frames)
+            self.npending += len(frames)
+        if self.npending >= CHUNK or (self.npending and time.monotonic() - self.t_flush > FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        self.t_flush = time.monotonic()
+        if not self.pending:
+            return
+        frames = np.concatenate(self.pending)
+        self.pending = []
+        self.npending = 0
+        cols = _columns(frames)
+        cols['t'] = self._keys(frames)
+        for name, dtype in COLUMNS.items():
+            np.ascontiguousarray(cols[name], dtype=dtype).tofile(self.files[name])
+            self.files[name].flush()
+        # index entries for the frames at multiples of INDEX_STRIDE
+        first = -self.n % INDEX_STRIDE
+        cols['t'][first::INDEX_STRIDE].astype(np.int64).tofile(self.index)
+        self.index.flush()
+        self.n += len(frames)
+
+    def _keys(self, frames):
+        ts = frames['ts']
+        raw = ts < 0
+        t = np.empty(len(frames), dtype=np.int64)
+        t[raw] = (frames['host'][raw] * 1e6).astype(np.int64)
+        dev = ts[~raw]
+        if dev.size:
+            if self.ts_last is None or self.ts_last < 0:
+                base, prev = int(dev[0]), int(dev[0])
+            else:
+                base, prev = self.t_last, self.ts_last
+            t[~raw] = base + np.cumsum(np.diff(dev, prepend=prev) % TS_WRAP)
+        self.t_last, self.ts_last = int(t[-1]), int(ts[-1])
+        return t
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.index.close()
+
+
+class FrameStore:
+
+    def __init__(self, root):
+        self.root = root
+        self.refresh()
+
+    def refresh(self):
+        # (re)map the columns, picking up anything appended since
+        self.n = min(_count(self.root, name, dtype) for name, dtype in COLUMNS.items())
+        self.cols = {}
+        for name, dtype in COLUMNS.items():
+            if self.n:
+                self.cols[name] = np.memmap(_path(self.root, name), dtype, 'r', shape=(self.n,))
+            else:
+                self.cols[name] = np.zeros(0, dtype=dtype)
+        nindex = (self.n + INDEX_STRIDE - 1) // INDEX_STRIDE
+        self.index = np.fromfile(_path(self.root, 'index'), np.int64, nindex) if nindex else \
+                        np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def t(self):
+        return self.cols['t']
+
+    def search(self, t, side='left'):
+        # frame number where t would go, like np.searchsorted on the t column
+        block = max(int(np.searchsorted(self.index, t, side)) - 1, 0)
+        lo = block * INDEX_STRIDE
+        hi = min(lo + 2 * INDEX_STRIDE, self.n)
+        return lo + int(np.searchsorted(self.cols['t'][lo:hi], t, side))
+
+    def range(self, t0, t1):
+        # (start, stop) frame numbers with t0 <= t < t1
+        return self.search(t0), self.search(t1)
+
+    def column(self, name, start=0, stop=None):
+        # a mapped view, nothing is read until it's used
+        return self.cols[name][start:stop]
+
+    def dist(self, start=0, stop=None):
+        return np.stack([self.cols['dist%d' % i][start:stop] for i in range(4)])
+
+    def frames(self, start=0, stop=None):
+        # copy of frames start:stop as a FRAME array
+        start, stop, _ = slice(start, stop).indices(self.n)
+        out = np.zeros(max(stop - start, 0), dtype=FRAME)
+        c = self.cols
+        out['ts'] = c['ts'][start:stop]
+        out['host'] = c['host'][start:stop]
+        out['events'] = c['events'][start:stop]
+        en = c['en'][start:stop, None]
+        out['dist_en'] = (en & _BITS) != 0
+        out['val_en'] = (en & (_BITS << 4)) != 0
+        for i in range(4):
+            out['dist'][:,i] = c['dist%d' % i][start:stop]
+            out['val'][:,i] = c['val%d' % i][start:stop]
+        return out
+
+    def duration(self):
+        return (self.t[-1] - self.t[0]) * 1e-6 if self.n else 0.
+
+
+def import_session(filename, root):
+    # run a recorded session (record.py) through the decoder into a store
+    from ingest import FrameReader
+    from report import ReportDecoder
+    from session import read_session
+    reader = FrameReader(None, parse_batch=ReportDecoder().decode_batch)
+    writer = StoreWriter(root)
+    for t, data in read_session(filename):
+        frames = reader.feed(data)
+        frames['host'] = t
+        writer.append(frames)
+    writer.close()
+    return writer.n
+
+
+def main():
+    parser = argparse.ArgumentParser(description='columnar frame store')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('import', help='import a recorded session')
+    p.add_argument('session')
+    p.add_argument('store')
+    p = sub.add_parser('info', help='summarize a store')
+    p.add_argument('store')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        n = import_session(args.session, args.store)
+        print('%d frames in %s' % (n, args.store))
+    else:
+        store = FrameStore(args.store)
+        print('%d frames, %.1f s' % (len(store), store.duration()))
+
+
+if __name__ == '__main__':
+    main()
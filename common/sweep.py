@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+# Offline threshold sweep for the gesture detectors.
+#
+# Replays recorded sessions (record.py) through the gesture logic for every
+# point of a parameter grid, spread over a process pool, and reports per
+# parameter set:
+#
+#   events    number of events detected
+#   per min   events per minute of recording
+#   false     events within --chatter seconds of the previous event of the
+#             same channel (retriggers/chatter), as a fraction of events
+#   latency   time from the approach onset to the event, median and p90 (ms);
+#             the onset is where the distance first drops below --onset
+#             (default: the largest threshold in the sweep)
+#
+# Modes: pluck (--thresh), multipluck (--thresh x --thresh2, as THRESH1 and
+# THRESH2) and hit (--thresh x --hit-min x --hit-max, triangulation.ino's
+# 30-150 ms window). Ranges are 'start:stop:step' (stop included) or
+# comma-separated values.
+#
+#   python3 sweep.py --mode pluck --thresh 120:240:10 *.qs
+#   python3 sweep.py --mode hit --thresh 180 --hit-min 0.02:0.05:0.01 --hit-max 0.1:0.2:0.025 *.qs
+#
+# Sessions with device timestamps (JSON or binary reports) are timed by the
+# device clock; raw "d d d d" sessions only have the host arrival time of
+# each read, so their latencies are as coarse as the USB batching.
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from ingest import FrameReader
+from report import ReportDecoder, FRAME
+from session import read_session
+from gesture import BandDetector, ThresholdDetector, HitDetector, ENGAGE, HIT
+
+TS_WRAP = 2**32
+NCHAN = 4
+
+# loaded once in the parent, inherited (or sent once) to each worker
+_sessions = None
+_config = None
+
+
+def load_frames(filename):
+    # every report of a session as one FRAME array, host set to the
+    # recorded arrival time
+    reader = FrameReader(None, parse_batch=ReportDecoder().decode_batch)
+    batches = []
+    for t, data in read_session(filename):
+        frames = reader.feed(data)
+        frames['host'] = t
+        batches.append(frames)
+    return np.concatenate(batches) if batches else np.zeros(0, dtype=FRAME)
+
+
+def load_session(filename):
+    # returns (dist (n, 4) int array, t (n,) seconds)
+    frames = load_frames(filename)
+    dist, ts = frames['dist'].astype(np.int64), frames['ts']
+    if ts.size and (ts >= 0).all():
+        t = np.concatenate(([0], np.cumsum(np.diff(ts) % TS_WRAP))) * 1e-6
+    else:
+        t = frames['host']
+    return dist, t
+
+
+def onsets(dist, t, onset):
+    # per channel, the times the distance dropped below onset
+    below = dist < onset
+    prev = np.concatenate((np.zeros((1, dist.shape[1]), dtype=bool), below[:-1]))
+    rising = below & ~prev
+    return [t[rising[:,c]] for c in range(dist.shape[1])]
+
+
+def parse_range(spec):
+    if ':' in spec:
+        start, stop, step = map(float, spec.split(':'))
+        return list(np.round(np.arange(start, stop + step / 2, step), 9))
+    return [float(v) for v in spec.split(',')]
+
+
+def make_detector(mode, params):
+    if mode == 'pluck':
+        return ThresholdDetector(NCHAN, params['thresh'])
+    if mode == 'multipluck':
+        return BandDetector(NCHAN, [(params['thresh2'], params['thresh'], params['thresh2']),
+                                    (-np.inf, params['thresh2'], 0)])
+    return HitDetector(NCHAN, params['thresh'], params['hit_min'], params['hit_max'])
+
+
+def evaluate(params):
+    mode, chatter = _config
+    kind = HIT if mode == 'hit' else ENGAGE
+    nevents = nfalse = 0
+    latencies = []
+    for dist, t, onset_times in _sessions:
+        events = make_detector(mode, params).process(dist, t)
+        events = events[events['kind'] == kind]
+        nevents += events.size
+        for c in np.unique(events['chan']).tolist():
+            te = events['t'][events['chan'] == c]
+            nfalse += int((np.diff(te) < chatter).sum())
+            starts = onset_times[c % NCHAN]
+            i = np.searchsorted(starts, te, side='right') - 1
+            latencies.append(te[i >= 0] - starts[i[i >= 0]])
+    latencies = np.concatenate(latencies) * 1e3 if latencies else np.zeros(0)
+    p50, p90 = np.percentile(latencies, (50, 90)) if latencies.size else (np.nan, np.nan)
+    return dict(params, events=nevents, false=nfalse, latency_p50=p50, latency_p90=p90)
+
+
+def _init(sessions, config):
+    global _sessions, _config
+    _sessions, _config = sessions, config
+
+
+def grid(args):
+    axes = {'thresh': parse_range(args.thresh)}
+    if args.mode == 'multipluck':
+        axes['thresh2'] = parse_range(args.thresh2)
+    elif args.mode == 'hit':
+        axes['hit_min'] = parse_range(args.hit_min)
+        axes['hit_max'] = parse_range(args.hit_max)
+    names = list(axes)
+    points = [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+    if args.mode == 'multipluck':
+        points = [p for p in points if p['thresh2'] < p['thresh']]
+    elif args.mode == 'hit':
+        points = [p for p in points if p['hit_min'] < p['hit_max']]
+    return names, points
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sweep gesture thresholds over recorded sessions')
+    parser.add_argument('sessions', nargs='+')
+    parser.add_argument('--mode', choices=('pluck', 'multipluck', 'hit'), default='pluck')
+    parser.add_argument('--thresh', default='120:240:10', help='engage distance (THRESH1)')
+    parser.add_argument('--thresh2', default='40:100:10', help="multipluck's inner band (THRESH2)")
+    parser.add_argument('--hit-min', default='0.03', help='shortest hit, seconds')
+    parser.add_argument('--hit-max', default='0.15', help='longest hit, seconds')
+    parser.add_argument('--onset', type=float, help='distance marking the approach onset')
+    parser.add_argument('--chatter', type=float, default=0.1,
+                            help='seconds within which a retrigger counts as false')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    names, points = grid(args)
+    onset = args.onset if args.onset is not None else max(p['thresh'] for p in points)
+    sessions = []
+    duration = 0.
+    for filename in args.sessions:
+        dist, t = load_session(filename)
+        if not dist.shape[0]:
+            print('%s: no reports' % filename)
+            continue
+        sessions.append((dist, t, onsets(dist, t, onset)))
+        duration += t[-1] - t[0]
+    print('%d sessions, %.1f min, %d parameter sets' % (len(sessions), duration / 60, len(points)))
+
+    config = (args.mode, args.chatter)
+    with multiprocessing.Pool(args.jobs, _init, (sessions, config)) as pool:
+        results = pool.map(evaluate, points, chunksize=max(1, len(points) // (4 * args.jobs)))
+
+    print(''.join('%10s' % n for n in names) +
+            '%9s%9s%8s%12s%12s' % ('events', 'per min', 'false', 'p50 (ms)', 'p90 (ms)'))
+    for r in results:
+        print(''.join('%10g' % r[n] for n in names) +
+                '%9d%9.1f%7.1f%%%12.1f%12.1f' % (r['events'], r['events'] / max(duration / 60, 1e-9),
+                    100. * r['false'] / max(r['events'], 1), r['latency_p50'], r['latency_p90']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+
+# A polyphonic sampler in NumPy, standing in for Pd and sampler.pd.
+#
+# The pluck apps send 'chan value;' and their main.pd plays sample `chan` at
+# a volume from `value`. SynthSink does the same without Pd: channel i plays
+# the i-th sample at volume(value) through the sound card (sounddevice);
+# WavSink renders into a WAV file instead, on the session's clock and as
+# fast as it goes, so a recorded session always renders to the same audio:
+#
+#   python3 pluck.py --out synth /dev/ttyACM0
+#   python3 pluck.py --render take1.wav take1.qs
+#
+# Samples are memory-mapped, not loaded. Sampler mixes a fixed pool of
+# voices, all arrays allocated up front: each block is one gather per
+# sample over all the voices playing it. Notes start on the sample they're
+# due at, not at the next block. When every voice is busy the oldest one is
+# stolen and faded out over `fade` samples rather than cut off.
+
+import heapq
+import itertools
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from ingest import FrameReader
+from session import read_session
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FADE = 64
+BLOCK = 1024
+# the longest a render runs past the session, for the last notes to ring out
+TAIL = 10.
+
+PCM = 1
+FLOAT = 3
+EXTENSIBLE = 0xfffe
+
+
+def read_wav(filename):
+    # (rate, data, scale): data a read-only (frames, channels) memmap of the
+    # sample data, times scale for -1..1
+    with open(filename, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError('%s is not a WAV file' % filename)
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError('%s has no data' % filename)
+            chunk, size = struct.unpack('<4sI', header)
+            if chunk == b'fmt ':
+                fmt = f.read(size)
+            elif chunk == b'data':
+                break
+            else:
+                f.seek(size, 1)
+            if size % 2:
+                f.seek(1, 1)
+        offset = f.tell()
+    if fmt is None:
+        raise ValueError('%s has no format' % filename)
+    tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if tag == EXTENSIBLE:
+        tag = struct.unpack('<H', fmt[24:26])[0]
+    if (tag, bits) == (FLOAT, 32):
+        dtype, scale = '<f4', 1.
+    elif (tag, bits) == (PCM, 16):
+        dtype, scale = '<i2', 1. / 2**15
+    elif (tag, bits) == (PCM, 32):
+        dtype, scale = '<i4', 1. / 2**31
+    else:
+        raise ValueError('%s: unsupported format %d, %d bits' % (filename, tag, bits))
+    frames = size // (channels * bits // 8)
+    data = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+    return rate, data, scale
+
+
+class WavWriter:
+
+    # 32-bit float WAV, written a block at a time
+
+    def __init__(self, filename, rate, channels):
+        self.f = open(filename, 'wb')
+        self.rate = rate
+        self.channels = channels
+        self.nbytes = 0
+        self._header()
+
+    def _header(self):
+        self.f.write(struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + self.nbytes, b'WAVE',
+                                    b'fmt ', 16, FLOAT, self.channels, self.rate,
+                                    self.rate * self.channels * 4, self.channels * 4, 32,
+                                    b'data', self.nbytes))
+
+    def write(self, block):
+        data = np.ascontiguousarray(block, dtype='<f4').tobytes()
+        self.f.write(data)
+        self.nbytes += len(data)
+
+    def close(self):
+        self.f.seek(0)
+        self._header()
+        self.f.close()
+
+
+class Sampler:
+
+    def __init__(self, samples, rate=44100, channels=2, voices=16, fade=FADE):
+        # samples: [(data, scale), ...] as from read_wav, data (frames,
+        # channels), mono samples playing on every channel
+        self.samples = [np.asarray(data) for data, scale in samples]
+        self.scale = np.array([scale for data, scale in samples], dtype=np.float32)
+        self.length = np.array([len(data) for data in self.samples], dtype=np.int64)
+        self.rate = rate
+        self.channels = channels
+        # the voice pool; key -1 for a free voice
+        self.key = np.full(voices, -1, dtype=np.int64)
+        self.pos = np.zeros(voices, dtype=np.int64)
+        self.gain = np.zeros(voices, dtype=np.float32)
+        self.born = np.zeros(voices, dtype=np.int64)
+        self.fade = fade
+        self.ramp = np.linspace(1., 0., fade, endpoint=False, dtype=np.float32)
+        # what stolen voices still have to play into the next block
+        self.carry = np.zeros((fade, channels), dtype=np.float32)
+        # notes not started yet: (sample time, seq, key, gain)
+        self.queue = []
+        self.seq = itertools.count()
+        self.time = 0
+        self.played = self.stolen = 0
+
+    def play(self, key, gain, at=None):
+        # sample `key` at `gain`, from sample time `at` (default, and if
+        # already past: the start of the next block)
+        if not 0 <= key < len(self.samples):
+            raise ValueError('no sample %d' % key)
+        heapq.heappush(self.queue, (self.time if at is None else at, next(self.seq), key, gain))
+
+    @property
+    def active(self):
+        return int((self.key >= 0).sum())
+
+    def idle(self):
+        return not self.queue and self.active == 0 and not self.carry.any()
+
+    def render(self, n):
+        # the next n samples, (n, channels) float32
+        out = np.zeros((n + self.fade, self.channels), dtype=np.float32)
+        out[:self.fade] = self.carry
+        a = 0
+        while self.queue and self.queue[0][0] < self.time + n:
+            at, _, key, gain = heapq.heappop(self.queue)
+            start = max(at - self.time, a)
+            self._mix(out, a, start)
+            self._start(out, start, key, gain)
+            a = start
+        self._mix(out, a, n)
+        self.carry = out[n:].copy()
+        self.time += n
+        return out[:n]
+
+    def _gather(self, key, voices, n, ramp=None):
+        # the next n samples of `voices` (all playing `key`), each scaled by
+        # its gain (and ramp) and zero past the end, summed: (n, channels)
+        idx = self.pos[voices,None] + np.arange(n)
+        gain = self.gain[voices,None] * self.scale[key] * (idx < self.length[key])
+        if ramp is not None:
+            gain *= ramp
+        return np.einsum('vn,vnc->nc', gain, self.samples[key][np.minimum(idx, self.length[key] - 1)])
+
+    def _mix(self, out, a, b):
+        if b <= a:
+            return
+        voices = np.flatnonzero(self.key >= 0)
+        if not len(voices):
+            return
+        keys = self.key[voices]
+        for key in np.unique(keys).tolist():
+            out[a:b] += self._gather(key, voices[keys == key], b - a)
+        self.pos[voices] += b - a
+        done = voices[self.pos[voices] >= self.length[keys]]
+        self.key[done] = -1
+
+    def _start(self, out, a, key, gain):
+        free = np.flatnonzero(self.key < 0)
+        if len(free):
+            v = free[0]
+        else:
+            v = int(np.argmin(self.born))
+            out[a:a+self.fade] += self._gather(int(self.key[v]), [v], self.fade, self.ramp)
+            self.stolen += 1
+        self.key[v] = key
+        self.pos[v] = 0
+        self.gain[v] = gain
+        self.born[v] = self.time + a
+        self.played += 1
+
+
+def load_sampler(names, voices=16, directory=HERE):
+    # a Sampler over directory/<name>.wav for each name
+    samples = []
+    rates = set()
+    channels = 1
+    for name in names:
+        rate, data, scale = read_wav(os.path.join(directory, name + '.wav'))
+        samples.append((data, scale))
+        rates.add(rate)
+        channels = max(channels, data.shape[1])
+    if len(rates) > 1:
+        raise ValueError('samples at different rates: %s' % sorted(rates))
+    return Sampler(samples, rates.pop(), channels, voices)
+
+
+def parse_note(message):
+    # 'chan value;' -> (chan, value), or None
+    atoms = message.rstrip().rstrip(';').split()
+    if len(atoms) != 2:
+        return None
+    try:
+        return int(atoms[0]), float(atoms[1])
+    except ValueError:
+        return None
+
+
+class SynthSink:
+
+    # plays messages on a Sampler through the sound card. send_bundle() takes
+    # a wall-clock time (time.time()) to play at, as OscSink does, so
+    # JitterBuffer schedules onto the sample
+
+    def __init__(self, sampler, volume, device=None):
+        import sounddevice
+        self.sampler = sampler
+        self.volume = volume
+        self.lock = threading.Lock()
+        # (wall time the next block will be heard, its sample time)
+        self.anchor = None
+        self.stream = sounddevice.OutputStream(samplerate=sampler.rate, channels=sampler.channels,
+                                                dtype='float32', device=device, callback=self._callback)
+        self.stream.start()
+
+    def _callback(self, outdata, frames, time_info, status):
+        with self.lock:
+            latency = time_info.outputBufferDacTime - time_info.currentTime
+            outdata[:] = self.sampler.render(frames)
+            self.anchor = (time.time() + latency + frames / self.sampler.rate, self.sampler.time)
+
+    def _play(self, t, messages):
+        with self.lock:
+            at = None
+            if t is not None and self.anchor is not None:
+                wall, n = self.anchor
+                at = n + int(round((t - wall) * self.sampler.rate))
+            for message in messages:
+                note = parse_note(message)
+                if note is not None and note[0] < len(self.sampler.samples):
+                    self.sampler.play(note[0], self.volume(note[1]), at)
+
+    def send(self, messages):
+        self._play(None, messages)
+
+    def send_bundle(self, t, messages):
+        self._play(t, messages)
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+
+class WavSink:
+
+    # renders messages on a Sampler into a WAV file, on a clock advanced by
+    # whoever feeds it (render_session(): the session's recorded time, in
+    # seconds) rather than the sound card's. Like SynthSink it takes
+    # send_bundle(t, ...) for notes due at t on that clock
+
+    def __init__(self, sampler, volume, filename, block=BLOCK):
+        self.sampler = sampler
+        self.volume = volume
+        self.writer = WavWriter(filename, sampler.rate, sampler.channels)
+        self.block = block
+        self.t = 0.
+
+    def advance(self, t):
+        # render every whole block before t; notes can't come due before it
+        # any more
+        self.t = t
+        n = int(t * self.sampler.rate) - self.sampler.time
+        while n >= self.block:
+            self.writer.write(self.sampler.render(self.block))
+            n -= self.block
+
+    def send_bundle(self, t, messages):
+        at = int(round((self.t if t is None else t) * self.sampler.rate))
+        for message in messages:
+            note = parse_note(message)
+            if note is not None and note[0] < len(self.sampler.samples):
+                self.sampler.play(note[0], self.volume(note[1]), at)
+
+    def send(self, messages):
+        self.send_bundle(None, messages)
+
+    def close(self):
+        if self.writer is None:
+            return
+        # until the last note has rung out
+        end = self.sampler.time + int(TAIL * self.sampler.rate)
+        while not self.sampler.idle() and self.sampler.time < end:
+            self.writer.write(self.sampler.render(self.block))
+        self.writer.close()
+        self.writer = None
+
+
+def render_session(filename, parse_batch, detect, sink):
+    # runs a recorded session through detect() (a Pipeline detect stage) as
+    # fast as it goes, into a WavSink. Messages play at the time their read
+    # was recorded; (due, message) pairs from JitterBuffer.stamp() at due.
+    # Returns the session's length in seconds
+    reader = FrameReader(None, parse_batch=parse_batch)
+    t = 0.
+    for t, data in read_session(filename):
+        frames = reader.feed(data)
+        frames['host'] = t
+        sink.advance(t)
+        for item in detect([(0, t, frames)]) or []:
+            due, message = item if isinstance(item, tuple) else (None, item)
+            sink.send_bundle(due, [message])
+    sink.close()
+    return t
+
+
+def open_synth(args, names, volume):
+    # the sink for --render or --out synth (add_synth_argument), else None
+    if args.render:
+        return WavSink(load_sampler(names, args.voices), volume, args.render)
+    if args.out == 'synth':
+        return SynthSink(load_sampler(names, args.voices), volume)
+    return None
+
+
+def add_synth_argument(parser):
+    parser.add_argument('--render', metavar='WAV',
+                            help='play a recorded session on the built-in sampler into a WAV file, '
+                                    'as fast as it goes (see synth.py); --out synth plays live '
+                                    'through the sound card instead of Pd')
+    parser.add_argument('--voices', type=int, default=16, help='polyphony of the built-in sampler')